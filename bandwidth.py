@@ -0,0 +1,132 @@
+import threading
+import time
+
+# --- Configuration ---
+BURST_SECONDS = 1         # Bucket capacity in seconds of its rate, what an idle client may send at once
+ACTIVE_WINDOW = 2         # Seconds after its last chunk a tunnel still counts towards the fair share
+SHAPING_QUANTUM = 64 * 1024 # Largest chunk charged at once while shaping, so tunnels take turns at this granularity
+
+class TokenBucket:
+    """Reservation-style token bucket: reserve() charges bytes right away and says how long to wait.
+
+    The state is the time at which every reserved byte will have been paid for, so a bucket
+    costs one float and concurrent senders are served in the order they reserved.
+    """
+
+    def __init__(self, rate, burst_seconds=BURST_SECONDS):
+        self.rate = rate # Bytes per second
+        self.burst_seconds = burst_seconds
+        self.paid_until = float('-inf') # Monotonic time at which the bucket is back to zero debt, a new one is full
+
+    def reserve(self, count, now):
+        """Charges count bytes and returns the seconds to wait before sending them."""
+        # A bucket that was idle for burst_seconds is full, it never collects more credit than that
+        self.paid_until = max(self.paid_until, now - self.burst_seconds) + count / self.rate
+        return max(0.0, self.paid_until - now)
+
+    def is_full(self, now):
+        """Returns True if the bucket refilled completely, so dropping it loses nothing."""
+        return self.paid_until <= now - self.burst_seconds
+
+class FairScheduler:
+    """Splits a total rate equally between the tunnels that are currently moving data.
+
+    Every tunnel gets its own bucket at rate / active tunnels, so a client fast-forwarding
+    through a backlog gets the same share as a live stream, and idle tunnels leave their
+    share to the others after ACTIVE_WINDOW.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.flows = {} # flow -> (TokenBucket, monotonic time of its last reservation)
+
+    def reserve(self, flow, count, now):
+        """Charges count bytes to a tunnel's share and returns the seconds to wait, the caller holds the lock."""
+        bucket, _ = self.flows.get(flow) or (TokenBucket(self.rate), now)
+        self.flows[flow] = (bucket, now)
+        active = sum(1 for _, last in self.flows.values() if now - last < ACTIVE_WINDOW)
+        bucket.rate = self.rate / active
+        return bucket.reserve(count, now)
+
+    def remove(self, flow):
+        """Forgets a closed tunnel."""
+        self.flows.pop(flow, None)
+
+class ShapedFlow:
+    """One relayed tunnel or request, charged to its client's, its host's and the fair share's buckets."""
+
+    def __init__(self, shaper, client, host):
+        self.shaper = shaper
+        self.client = client
+        self.host = host # None until a plain HTTP connection's first request names one
+        self.quantum = SHAPING_QUANTUM
+
+    def reserve(self, count):
+        """Returns the seconds to wait before sending count bytes of this flow."""
+        return self.shaper.reserve(self, count)
+
+    def close(self):
+        """Releases the flow's fair share."""
+        self.shaper.close_flow(self)
+
+class BandwidthShaper:
+    """Token buckets per client IP and per upstream host plus a fair scheduler for the total rate.
+
+    Rates are bytes per second, 0 turns that limit off. Shared by every event loop and thread of a
+    proxy process; open_flow() returns None while every limit is off, so unshaped relays cost nothing.
+    """
+
+    def __init__(self, client_rate=0, host_rate=0, total_rate=0):
+        self.lock = threading.Lock()
+        self.configure(client_rate, host_rate, total_rate)
+
+    def configure(self, client_rate, host_rate, total_rate):
+        """Sets new limits, dropping the buckets of the old ones."""
+        with self.lock:
+            self.client_rate = client_rate
+            self.host_rate = host_rate
+            self.scheduler = FairScheduler(total_rate) if total_rate else None
+            self.client_buckets = {} # client IP -> TokenBucket
+            self.host_buckets = {} # upstream host -> TokenBucket
+
+    @property
+    def enabled(self):
+        """Returns True if any limit is set."""
+        return bool(self.client_rate or self.host_rate or self.scheduler)
+
+    def open_flow(self, client, host):
+        """Returns a ShapedFlow for bytes between a client IP and an upstream host, None if nothing is limited."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            # Full buckets are dropped, a client coming back simply starts with a new full one
+            for buckets in (self.client_buckets, self.host_buckets):
+                for key in [key for key, bucket in buckets.items() if bucket.is_full(now)]:
+                    del buckets[key]
+        return ShapedFlow(self, client, host)
+
+    def reserve(self, flow, count):
+        """Charges count bytes of a flow to every bucket it belongs to, returns the longest wait."""
+        now = time.monotonic()
+        wait = 0.0
+        with self.lock:
+            if self.client_rate:
+                bucket = self.client_buckets.get(flow.client)
+                if bucket is None:
+                    bucket = self.client_buckets[flow.client] = TokenBucket(self.client_rate)
+                wait = bucket.reserve(count, now)
+            if self.host_rate and flow.host is not None: # Responses the proxy serves itself have no host
+                bucket = self.host_buckets.get(flow.host)
+                if bucket is None:
+                    bucket = self.host_buckets[flow.host] = TokenBucket(self.host_rate)
+                wait = max(wait, bucket.reserve(count, now))
+            if self.scheduler:
+                wait = max(wait, self.scheduler.reserve(flow, count, now))
+        return wait
+
+    def close_flow(self, flow):
+        """Removes a finished flow from the fair scheduler."""
+        with self.lock:
+            if self.scheduler:
+                self.scheduler.remove(flow)
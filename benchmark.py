@@ -0,0 +1,430 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import http.server
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import curl
+import generate_auth_list
+import pipeline
+from channel_auth import iter_channel_auth
+from http_client import HttpClient
+
+# --- Configuration ---
+RESULTS_FILE = "benchmarkResults.json" # Every run is appended here so results can be compared over time
+SCENARIOS = ['connect', 'http', 'harvest', 'activate', 'pipeline']
+RELAYS = ['splice'] # fproxy.py --relay implementations the proxy scenarios are run against
+CLIENTS = 32            # Concurrent proxy clients
+REQUESTS = 8            # Segments each proxy client fetches
+SEGMENT_SIZE = 4 * 1024 * 1024 # Bytes per fake HLS segment
+ORIGIN_DELAY = 0.0      # Seconds the stand-in origin waits before answering, to mimic a remote server
+PROXY_START_TIMEOUT = 10 # Seconds allowed for fproxy.py to start listening
+READ_CHUNK = 256 * 1024 # Bytes read at a time from proxied responses
+COMPARISON_IGNORED = {'scenarios', 'relays', 'output'} # Settings that do not change the measured load
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PAGE = '''<script>
+  var channelKey = "premium{channel_id}";
+  var __c = atob("{ts}");
+  var __d = atob("{rnd}");
+  var __e = atob("{sig}");
+</script>
+'''
+
+def atob_value(text):
+    """Returns text base64-encoded the way the channel pages embed it."""
+    return base64.b64encode(text.encode()).decode()
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for the HLS origin, the daddylivehd.php channel pages and auth.php."""
+    protocol_version = 'HTTP/1.1'
+    segment = b''
+    delay = 0.0
+
+    def send_body(self, body, content_type, send=True):
+        if self.delay:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send:
+            self.wfile.write(body)
+
+    def respond(self, send):
+        url = urlsplit(self.path)
+        if url.path.endswith('.m3u8'):
+            # A live playlist whose window moves every four seconds
+            sequence = int(time.time() // 4)
+            lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', f'#EXT-X-MEDIA-SEQUENCE:{sequence}']
+            for number in range(sequence, sequence + 3):
+                lines += ['#EXTINF:4.0,', f'{number}.ts']
+            self.send_body(('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl', send)
+        elif url.path.endswith('.ts'):
+            self.send_body(self.segment, 'video/mp2t', send)
+        elif url.path.endswith('daddylivehd.php'):
+            channel_id = parse_qs(url.query).get('id', [''])[0]
+            page = PAGE.format(channel_id=channel_id, ts=atob_value(str(int(time.time()))),
+                               rnd=atob_value(os.urandom(4).hex()), sig=atob_value(os.urandom(16).hex()))
+            self.send_body(page.encode(), 'text/html', send)
+        elif url.path.endswith('auth.php'):
+            self.send_body(b'', 'text/plain', send)
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def log_message(self, *args):
+        pass
+
+def serve_origin(port_pipe, segment_size, delay):
+    """Runs the stand-in origin until terminated, sending its port back through port_pipe."""
+    OriginHandler.segment = os.urandom(1024) * (segment_size // 1024) + os.urandom(segment_size % 1024)
+    OriginHandler.delay = delay
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OriginHandler)
+    server.daemon_threads = True
+    port_pipe.send(server.server_port)
+    server.serve_forever()
+
+def start_origin(segment_size=SEGMENT_SIZE, delay=ORIGIN_DELAY):
+    """Starts the stand-in origin in its own process, so it never competes with the clients for the GIL."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=serve_origin, args=(sender, segment_size, delay), daemon=True)
+    process.start()
+    return process, receiver.recv()
+
+def free_port():
+    """Returns a TCP port nothing listens on right now."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def process_tree(pid):
+    """Returns pid and the PIDs of all its descendants (Linux /proc)."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    tree = [pid]
+    for current in tree:
+        tree.extend(children.get(current, []))
+    return tree
+
+def process_usage(pid):
+    """Returns (CPU seconds, peak RSS in bytes) summed over a process and its workers, or (None, None)."""
+    if not os.path.isdir('/proc'):
+        return None, None
+    cpu_seconds = 0.0
+    peak_rss = 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu_seconds += (int(fields[11]) + int(fields[12])) / ticks # utime + stime
+            with open(f'/proc/{member}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak_rss += int(line.split()[1]) * 1024
+        except (OSError, IndexError, ValueError):
+            continue # The process exited between listing and reading
+    return cpu_seconds, peak_rss
+
+@contextlib.contextmanager
+def running_proxy(relay, proxy_args=()):
+    """Starts fproxy.py on a free port with the given relay implementation, yields (pid, port)."""
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'fproxy.py'), '--host', '127.0.0.1', '--port', str(port),
+               '--relay', relay, '--log-level', 'WARNING', *proxy_args]
+    process = subprocess.Popen(command, cwd=ROOT)
+    try:
+        deadline = time.monotonic() + PROXY_START_TIMEOUT
+        while True:
+            try:
+                # The metrics endpoint answers as soon as the proxy accepts, without an upstream
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1):
+                    break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"fproxy.py did not start listening on port {port}")
+                time.sleep(0.05)
+        yield process.pid, port
+    finally:
+        # SIGINT lets the parent stop its worker processes too
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of values, or None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize(name, duration, latencies, byte_count, errors, cpu_seconds=None, peak_rss=None, **extra):
+    """Builds one result record; latencies in seconds, reported in milliseconds."""
+    return {
+        'name': name,
+        'duration': round(duration, 3),
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / duration, 1) if duration else None,
+        'megabytes_per_second': round(byte_count / duration / 1e6, 1) if duration else None,
+        'p50_ms': None if not latencies else round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': None if not latencies else round(percentile(latencies, 0.99) * 1000, 2),
+        'cpu_seconds': None if cpu_seconds is None else round(cpu_seconds, 2),
+        'cpu_percent': None if cpu_seconds is None or not duration else round(cpu_seconds / duration * 100, 1),
+        'peak_rss_mb': None if peak_rss is None else round(peak_rss / 1e6, 1),
+        **extra,
+    }
+
+async def read_response(reader):
+    """Reads one Content-Length framed response, returns (status, body bytes read, keeps alive)."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {name.strip().lower(): value.strip()
+               for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+    remaining = int(headers.get('content-length', 0))
+    received = 0
+    while remaining:
+        chunk = await reader.read(min(remaining, READ_CHUNK))
+        if not chunk:
+            raise ConnectionResetError("Response body cut short")
+        remaining -= len(chunk)
+        received += len(chunk)
+    return status, received, headers.get('connection', '').lower() != 'close'
+
+async def proxy_client(scenario, proxy_port, origin, requests, latencies, totals):
+    """One client: fetches the playlist and then `requests` segments through the proxy over one connection."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', proxy_port)
+    try:
+        if scenario == 'connect':
+            writer.write(f"CONNECT {origin} HTTP/1.1\r\nHost: {origin}\r\n\r\n".encode())
+            await writer.drain()
+            await reader.readuntil(b'\r\n\r\n')
+            prefix = '' # Origin-form requests go straight to the origin through the tunnel
+        else:
+            prefix = f"http://{origin}" # Absolute-form requests are forwarded by the proxy
+        paths = ['/hls/premium51/mono.m3u8'] + [f'/hls/premium51/{number}.ts' for number in range(requests)]
+        for path in paths:
+            started = time.perf_counter()
+            writer.write(f"GET {prefix}{path} HTTP/1.1\r\nHost: {origin}\r\n\r\n".encode())
+            await writer.drain()
+            status, received, keep_alive = await read_response(reader)
+            if status != 200:
+                totals['errors'] += 1
+            elif path.endswith('.ts'):
+                latencies.append(time.perf_counter() - started)
+                totals['bytes'] += received
+            if not keep_alive:
+                break
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        totals['errors'] += 1
+    finally:
+        writer.close()
+
+async def run_proxy_clients(scenario, proxy_port, origin, clients, requests):
+    """Runs every client at once, returns (segment latencies, bytes, errors)."""
+    latencies = []
+    totals = {'bytes': 0, 'errors': 0}
+    await asyncio.gather(*(proxy_client(scenario, proxy_port, origin, requests, latencies, totals)
+                           for _ in range(clients)))
+    return latencies, totals['bytes'], totals['errors']
+
+def bench_proxy(scenario, relay, origin, args):
+    """Drives fproxy.py with concurrent CONNECT or plain HTTP clients."""
+    with running_proxy(relay, args.proxy_args.split()) as (pid, port):
+        cpu_before, _ = process_usage(pid)
+        started = time.perf_counter()
+        latencies, byte_count, errors = asyncio.run(
+            run_proxy_clients(scenario, port, origin, args.clients, args.requests))
+        duration = time.perf_counter() - started
+        cpu_after, peak_rss = process_usage(pid)
+    cpu_seconds = None if cpu_before is None else cpu_after - cpu_before
+    return summarize(f"{scenario}/{relay}", duration, latencies, byte_count, errors, cpu_seconds, peak_rss,
+                     clients=args.clients, segment_size=args.segment_size)
+
+def timed(function, latencies):
+    """Wraps function so the duration of every call is appended to latencies."""
+    def call(*args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return call
+
+def harvest(client, channel_ids, concurrency, latencies):
+    """Fetches every channel page like generate_auth_list.py, returns the auth lines and the error count."""
+    fetch = timed(generate_auth_list.fetch_channel_auth, latencies)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda channel_id: fetch(client, channel_id), channel_ids))
+    lines = [line for result in results if not isinstance(result, str) for line in result]
+    return lines, sum(1 for result in results if isinstance(result, str))
+
+def harvest_signatures(channel_ids):
+    """Harvests the signatures the activation scenario needs, outside of any measurement."""
+    client = HttpClient(generate_auth_list.REQUEST_HEADERS, rate_limit=0)
+    try:
+        lines, _ = harvest(client, channel_ids, generate_auth_list.CONCURRENCY, [])
+    finally:
+        client.close()
+    return list(iter_channel_auth(lines))
+
+def bench_scripts(scenario, channel_ids, channel_auth=()):
+    """Runs the harvest, activation (of the channel_auth signatures) or combined pipeline stage
+    against the stand-in pages."""
+    started_cpu = time.process_time()
+    latencies = []
+    errors = 0
+    # The scripts print a line per channel, which would measure the terminal rather than the scripts
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        if scenario == 'harvest':
+            client = HttpClient(generate_auth_list.REQUEST_HEADERS, rate_limit=0)
+            try:
+                _, errors = harvest(client, channel_ids, generate_auth_list.CONCURRENCY, latencies)
+            finally:
+                client.close()
+        elif scenario == 'activate':
+            urls = [channel.signature_url(pipeline.AUTH_BASE_URL) for channel in channel_auth]
+            records = curl.activate_urls(urls, concurrency=curl.CONCURRENCY, rate_limit=0)
+            latencies = [record['latency'] for record in records]
+            errors = sum(1 for record in records if record['status'] != 200)
+        else:
+            results = pipeline.run_pipeline(channel_ids, rate_limit=0)
+            latencies = [result.activation['latency'] for result in results if result.activation]
+            errors = sum(1 for result in results if not result.activated)
+        duration = time.perf_counter() - started
+    # The stand-in origin runs in another process, so this is the scripts' own cost
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return summarize(scenario, duration, latencies, 0, errors, time.process_time() - started_cpu, peak_rss,
+                     channels=len(channel_ids))
+
+def point_scripts_at(origin):
+    """Redirects the channel page and auth.php URLs of the scripts to the stand-in origin."""
+    generate_auth_list.AUTH_PAGE_URL = f"http://{origin}/premiumtv/daddylivehd.php?id={{channel_id}}"
+    pipeline.AUTH_BASE_URL = f"http://{origin}/auth.php"
+
+def previous_results(results_file):
+    """Returns the stored runs, oldest first."""
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, 'r') as f:
+        return json.load(f)
+
+def git_revision():
+    """Returns the checked out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_result(result, previous):
+    """Prints one result line, with the throughput change against the last stored run of the same name."""
+    rate = (f"{result['megabytes_per_second']:>8} MB/s" if result['megabytes_per_second']
+            else f"{result['requests_per_second']:>8} req/s")
+    change = ''
+    if previous and previous.get('requests_per_second') and result['requests_per_second']:
+        change = f"  ({(result['requests_per_second'] / previous['requests_per_second'] - 1) * 100:+.1f}% vs last run)"
+    print(f"{result['name']:<16} {rate}  p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms  "
+          f"cpu {result['cpu_percent']}%  rss {result['peak_rss_mb']} MB  errors {result['errors']}{change}")
+
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Benchmark fproxy.py and the channel scripts against local stand-ins")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS,
+                        help=f"What to measure (default: {' '.join(SCENARIOS)})")
+    parser.add_argument('--relays', nargs='+', choices=['splice', 'buffer', 'copy'], default=RELAYS,
+                        help=f"Relay implementations the proxy scenarios run against (default: {' '.join(RELAYS)})")
+    parser.add_argument('--proxy-args', default='',
+                        help="Extra fproxy.py arguments, e.g. \"--workers 4\" or \"--mode threaded\"")
+    parser.add_argument('--clients', type=int, default=CLIENTS,
+                        help=f"Concurrent proxy clients (default: {CLIENTS})")
+    parser.add_argument('--requests', type=int, default=REQUESTS,
+                        help=f"Segments each proxy client fetches (default: {REQUESTS})")
+    parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE,
+                        help=f"Bytes per fake HLS segment (default: {SEGMENT_SIZE})")
+    parser.add_argument('--channels', type=int,
+                        help="Channels used by the script scenarios (default: every channel in the ID files)")
+    parser.add_argument('--origin-delay', type=float, default=ORIGIN_DELAY,
+                        help=f"Seconds the stand-in origin waits before each response (default: {ORIGIN_DELAY})")
+    parser.add_argument('--output', default=RESULTS_FILE,
+                        help=f"JSON file the run is appended to (default: {RESULTS_FILE})")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    history = previous_results(args.output)
+    # Only runs with the same load are comparable, whichever scenarios and relays they covered
+    load = {name: value for name, value in vars(args).items() if name not in COMPARISON_IGNORED}
+    last_results = {result['name']: result for run in history
+                    if {name: run['settings'].get(name) for name in load} == load for result in run['results']}
+    channel_ids = generate_auth_list.read_channel_ids(generate_auth_list.INPUT_FILES)
+    if args.channels:
+        channel_ids = (channel_ids * (args.channels // max(1, len(channel_ids)) + 1))[:args.channels]
+    origin_process, origin_port = start_origin(args.segment_size, args.origin_delay)
+    origin = f"127.0.0.1:{origin_port}"
+    point_scripts_at(origin)
+    results = []
+    try:
+        for scenario in args.scenarios:
+            if scenario in ('connect', 'http'):
+                runs = [bench_proxy(scenario, relay, origin, args) for relay in args.relays]
+            elif scenario == 'activate':
+                runs = [bench_scripts(scenario, channel_ids, harvest_signatures(channel_ids))]
+            else:
+                runs = [bench_scripts(scenario, channel_ids)]
+            for result in runs:
+                print_result(result, last_results.get(result['name']))
+            results += runs
+    finally:
+        origin_process.terminate()
+        origin_process.join()
+
+    run = {
+        'started_at': int(time.time()),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(history + [run], f, indent=1)
+    print(f"\nResults appended to '{args.output}'.")
+
+if __name__ == "__main__":
+    main()
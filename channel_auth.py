@@ -0,0 +1,82 @@
+import base64
+import binascii
+import re
+from collections import namedtuple
+
+# One pattern for every variable of an auth block, either `var __c = atob("...")` or `var __c = "..."`
+AUTH_VARIABLE_PATTERN = re.compile(
+    r'var\s+(channelKey|__c|__d|__e)\s*=\s*(?:atob\(\s*"([^"]*)"\s*\)|"([^"]*)")')
+CHANNEL_KEY_PATTERN = re.compile(r'premium(\d+)')
+
+class ChannelAuth(namedtuple('ChannelAuth', 'channel_key auth_ts auth_rnd auth_sig')):
+    """Decoded auth variables of one channel: channelKey, __c (timestamp), __d (random), __e (signature)."""
+    __slots__ = ()
+
+    @property
+    def channel_id(self):
+        """Returns the digits of a premiumNNN channel key, or None for other keys."""
+        match = CHANNEL_KEY_PATTERN.fullmatch(self.channel_key)
+        return match.group(1) if match else None
+
+    def signature_url(self, base_url):
+        """Returns the auth.php URL that activates this channel's signature."""
+        return (f"{base_url}?channel_id={self.channel_key}"
+                f"&ts={self.auth_ts}"
+                f"&rnd={self.auth_rnd}"
+                f"&sig={self.auth_sig}")
+
+    def block_lines(self):
+        """Returns the block as channelAuth.txt lines, the inverse of iter_channel_auth()."""
+        encode = lambda value: base64.b64encode(value.encode('utf-8')).decode('ascii')
+        return [f'var channelKey = "{self.channel_key}";',
+                f'var __c = atob("{encode(self.auth_ts)}");',
+                f'var __d = atob("{encode(self.auth_rnd)}");',
+                f'var __e = atob("{encode(self.auth_sig)}");']
+
+def warn(channel_key, message):
+    """Default error callback, prints a warning and lets parsing continue."""
+    print(f"Warning: {message} for channelKey '{channel_key}'. Skipping this block.")
+
+def decode_value(encoded, plain):
+    """Returns the value of one variable, decoding atob() literals."""
+    if encoded is None:
+        return plain
+    return base64.b64decode(encoded, validate=True).decode('utf-8')
+
+def iter_channel_auth(lines, on_error=warn):
+    """Yields a ChannelAuth for every complete block in lines, in order, using constant memory.
+
+    A block starts at `var channelKey` and ends at the next one. Blocks missing a variable or
+    holding an undecodable value are reported through on_error(channel_key, message).
+    """
+    channel_key = None
+    values = {}
+    for line in lines:
+        match = AUTH_VARIABLE_PATTERN.search(line)
+        if not match:
+            continue
+        name, encoded, plain = match.groups()
+        if name == 'channelKey':
+            if channel_key is not None and values is not None:
+                on_error(channel_key, "Incomplete auth data block")
+            channel_key = plain if plain is not None else encoded
+            values = {}
+            continue
+        if channel_key is None or values is None or name in values:
+            continue # Outside a block, after a bad value, or a repeated variable
+        try:
+            values[name] = decode_value(encoded, plain)
+        except (binascii.Error, UnicodeDecodeError) as e:
+            on_error(channel_key, f"Base64 decoding error ({e})")
+            values = None
+            continue
+        if len(values) == 3:
+            yield ChannelAuth(channel_key, values['__c'], values['__d'], values['__e'])
+            channel_key = None
+    if channel_key is not None and values is not None:
+        on_error(channel_key, "Incomplete auth data block")
+
+def iter_channel_auth_file(file_path, on_error=warn):
+    """Yields the ChannelAuth records of a channelAuth.txt file."""
+    with open(file_path, 'r') as f:
+        yield from iter_channel_auth(f, on_error)
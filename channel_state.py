@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import time
+
+from channel_auth import ChannelAuth
+
+# --- Configuration ---
+STATE_FILE = "channelState.json" # Per-channel signatures and activation results, keyed by channelKey
+SIGNATURE_LIFETIME = 6 * 3600    # Seconds a signature is assumed to stay valid after its ts
+REFRESH_MARGIN = 15 * 60         # Refresh signatures this many seconds before they expire
+MIN_LIFETIME = 10 * 60           # Lower bound for lifetimes learned from expired signatures
+LIFETIME_SAMPLES = 20            # Most recent expiry observations kept
+
+class ChannelStateStore:
+    """JSON index of the last signature and activation result of every channel."""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.channels = {} # channelKey -> state dict
+        self.lifetime_samples = [] # Ages in seconds at which signatures were seen to expire
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            self.channels = state.get('channels', {})
+            self.lifetime_samples = state.get('lifetime_samples', [])
+
+    def get(self, channel_key):
+        """Returns the stored state of a channel, or None."""
+        return self.channels.get(channel_key)
+
+    def auth(self, channel_key):
+        """Returns the last harvested ChannelAuth of a channel, or None."""
+        state = self.channels.get(channel_key)
+        if not state or 'ts' not in state:
+            return None
+        return ChannelAuth(channel_key, state['ts'], state['rnd'], state['sig'])
+
+    def record(self, channel_key, auth=None, activation=None, error=None, now=None):
+        """Stores the outcome of harvesting and/or activating a channel."""
+        now = time.time() if now is None else now
+        state = self.channels.setdefault(channel_key, {})
+        if auth is not None:
+            state.update(ts=auth.auth_ts, rnd=auth.auth_rnd, sig=auth.auth_sig, harvested_at=int(now))
+        if activation is not None:
+            state.update(status=activation['status'], attempts=activation['attempts'],
+                         latency=activation['latency'], activated_at=int(now))
+        state['ok'] = activation is not None and activation['status'] == 200
+        state['error'] = error
+
+    def record_expiry(self, channel_key, now=None):
+        """Notes that a channel's stored signature was refused, learning how long signatures last."""
+        now = time.time() if now is None else now
+        state = self.channels.get(channel_key)
+        if state and state.get('ts', '').isdigit():
+            # The signature died somewhere after its last successful activation, which is the safe bound
+            last_valid = state.get('activated_at', now) if state.get('ok') else now
+            age = int(min(last_valid, now)) - int(state['ts'])
+            self.lifetime_samples = (self.lifetime_samples + [age])[-LIFETIME_SAMPLES:]
+        if state:
+            state['ok'] = False
+            state['error'] = 'signature expired'
+
+    def lifetime(self, default=SIGNATURE_LIFETIME):
+        """Returns how long signatures last: the shortest observed expiry age, or default without any."""
+        if not self.lifetime_samples:
+            return default
+        # The shortest observation is the safe one, the floor stops one odd refusal from causing a refresh storm
+        return max(MIN_LIFETIME, min(self.lifetime_samples))
+
+    def needs_refresh(self, channel_key, now=None, lifetime=SIGNATURE_LIFETIME, margin=REFRESH_MARGIN):
+        """Returns True if a channel has no working signature or its signature is about to expire."""
+        now = time.time() if now is None else now
+        state = self.channels.get(channel_key)
+        if not state or not state.get('ok'):
+            return True
+        try:
+            minted_at = int(state['ts'])
+        except (KeyError, ValueError):
+            return True
+        return now >= minted_at + lifetime - margin
+
+    def save(self):
+        """Writes the index through a temporary file, so a crash never leaves it half-written."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path))
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                json.dump({'saved_at': int(time.time()), 'lifetime_samples': self.lifetime_samples,
+                           'channels': self.channels}, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
@@ -1,70 +1,119 @@
-import subprocess
-import os
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlsplit
+
+from http_client import MAX_ATTEMPTS, REQUEST_TIMEOUT, HttpClient
 
 # --- Configuration ---
 AUTH_URLS_FILE = "signatureURLs.txt" # The file containing the list of auth.php URLs
+REPORT_FILE = "activationReport.json" # Machine-readable summary of the last run
+REQUEST_HEADERS = {
+    'Origin': "https://lefttoplay.xyz",
+    'Referer': "https://lefttoplay.xyz/",
+}
+CONCURRENCY = 32 # Signature URLs activated at the same time
+RATE_LIMIT = 0   # Requests per second to each host, 0 disables the limit
+
+def channel_of(url):
+    """Returns the channel_id query parameter of an auth.php URL, or the URL itself."""
+    return parse_qs(urlsplit(url).query).get('channel_id', [url])[0]
+
+def activate_url(client, method, url):
+    """Requests one signature URL and returns its result record for the report."""
+    record = {'channel_id': channel_of(url), 'url': url}
+    started = time.monotonic()
+    try:
+        response = client.request(method, url)
+    except Exception as e:
+        record.update(status=None, error=str(e) or type(e).__name__, attempts=client.max_attempts,
+                      latency=round(time.monotonic() - started, 3))
+        return record
+    record.update(status=response.status, reason=response.reason, attempts=response.attempts,
+                  latency=round(response.latency, 3))
+    return record
+
+def print_record(record):
+    """Prints the one-line outcome of an activation."""
+    if record['status'] == 200:
+        print(f"  SUCCESS. {record['channel_id']}: HTTP {record['status']} in {record['latency']}s")
+    elif record['status'] is None:
+        print(f"  FAILED. {record['channel_id']}: {record['error']}")
+    else:
+        print(f"  FAILED. {record['channel_id']}: HTTP {record['status']} {record['reason']}")
+
+def activate_urls(urls, method='HEAD', concurrency=CONCURRENCY, timeout=REQUEST_TIMEOUT,
+                  max_attempts=MAX_ATTEMPTS, rate_limit=RATE_LIMIT):
+    """Activates every URL concurrently over keep-alive connections, returns records in input order."""
+    client = HttpClient(REQUEST_HEADERS, timeout=timeout, max_attempts=max_attempts, rate_limit=rate_limit)
+    records = [None] * len(urls)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(activate_url, client, method, url): index for index, url in enumerate(urls)}
+            for future in as_completed(futures):
+                record = records[futures[future]] = future.result()
+                print_record(record)
+    finally:
+        client.close()
+    return records
 
-def execute_curl_commands_from_file(file_path):
+def write_report(file_path, records, duration):
+    """Writes the per-channel results plus totals as JSON."""
+    succeeded = sum(1 for record in records if record['status'] == 200)
+    report = {
+        'finished_at': int(time.time()),
+        'duration': round(duration, 3),
+        'total': len(records),
+        'succeeded': succeeded,
+        'failed': len(records) - succeeded,
+        'channels': records,
+    }
+    with open(file_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def execute_curl_commands_from_file(file_path, args):
     """
-    Reads a file containing URLs and executes a curl -I command for each URL.
+    Reads a file containing URLs and activates them all, writing a JSON report.
     """
-    print(f"Reading URLs from '{file_path}' and executing curl commands...\n")
-    
+    print(f"Reading URLs from '{file_path}' and activating them...\n")
+
     try:
         with open(file_path, 'r') as f:
             urls = [line.strip() for line in f if line.strip()] # Read non-empty lines
-        
-        if not urls:
-            print(f"No URLs found in '{file_path}'. Exiting.")
-            return
+    except FileNotFoundError:
+        print(f"Error: The file '{file_path}' was not found. Please ensure it exists in the same directory as the script.")
+        return None
 
-        for url in urls:
-            print(f"Executing curl for: {url}")
-            
-            # Construct the curl command as a list of strings
-            # -I performs a HEAD request
-            # -H adds custom headers
-            curl_cmd = [
-                "curl", "-I",
-                "-H", "user-agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:139.0) Gecko/20100101 Firefox/139.0",
-                "-H", "origin: https://lefttoplay.xyz",
-                "-H", "referer: https://lefttoplay.xyz/",
-                url
-            ]
-            
-            try:
-                # Execute the curl command
-                # capture_output=True captures stdout and stderr
-                # text=True decodes stdout/stderr as text
-                # check=False prevents it from raising an exception for non-zero exit codes (like 4xx/5xx HTTP errors)
-                result = subprocess.run(curl_cmd, capture_output=True, text=True, check=False)
-                
-                # Check the return code
-                if result.returncode == 0:
-                    # Attempt to extract HTTP status from the output headers
-                    status_line = result.stdout.splitlines()[0] if result.stdout else "No HTTP Status Line"
-                    print(f"  SUCCESS. {status_line}")
-                else:
-                    print(f"  FAILED. Curl exited with code: {result.returncode}")
-                    if result.stderr:
-                        print(f"  Stderr: {result.stderr.strip()}")
-                    if result.stdout:
-                        print(f"  Stdout (headers): {result.stdout.strip()}")
-                print("-" * 50) # Separator for clarity
+    if not urls:
+        print(f"No URLs found in '{file_path}'. Exiting.")
+        return None
 
-            except FileNotFoundError:
-                print(f"Error: 'curl' command not found. Please ensure curl is installed and in your system's PATH.")
-                break # Exit if curl is not found
-            except Exception as e:
-                print(f"An unexpected error occurred while executing curl for '{url}': {e}")
-                print("-" * 50)
+    started = time.monotonic()
+    records = activate_urls(urls, args.method, args.concurrency, args.timeout, args.attempts, args.rate_limit)
+    report = write_report(args.report, records, time.monotonic() - started)
+    print(f"\n{report['succeeded']} of {report['total']} URLs activated in {report['duration']}s, "
+          f"report saved to '{args.report}'.")
+    return report
 
-    except FileNotFoundError:
-        print(f"Error: The file '{file_path}' was not found. Please ensure it exists in the same directory as the script.")
-    except Exception as e:
-        print(f"An error occurred while reading '{file_path}': {e}")
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Activate every signature URL")
+    parser.add_argument('--method', choices=['HEAD', 'GET'], default='HEAD',
+                        help="Request method (default: HEAD, like curl -I)")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help=f"URLs activated at the same time (default: {CONCURRENCY})")
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT,
+                        help=f"Seconds allowed per connect and read (default: {REQUEST_TIMEOUT})")
+    parser.add_argument('--attempts', type=int, default=MAX_ATTEMPTS,
+                        help=f"Tries per URL on network errors and 429/5xx responses (default: {MAX_ATTEMPTS})")
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT,
+                        help=f"Requests per second to each host, 0 for no limit (default: {RATE_LIMIT})")
+    parser.add_argument('--report', default=REPORT_FILE, help=f"JSON summary file (default: {REPORT_FILE})")
+    return parser.parse_args()
 
 # --- Main execution ---
 if __name__ == "__main__":
-    execute_curl_commands_from_file(AUTH_URLS_FILE)
-    print("\nAll curl commands attempted.")
+    execute_curl_commands_from_file(AUTH_URLS_FILE, parse_arguments())
+    print("\nAll URLs attempted.")
@@ -0,0 +1,282 @@
+import argparse
+import calendar
+import functools
+import gzip
+import io
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from http_client import REQUEST_TIMEOUT, USER_AGENT
+
+# --- Configuration ---
+EPG_SOURCE_URL = "http://m3u4u.com/xml/dqr6yw74z4umv4rkyx1w" # Full XMLTV guide, the one fetch-epg.yml mirrors
+EPG_DATABASE = "epg.sqlite3" # Programmes indexed by channel, plus the validators of the last download
+REFRESH_INTERVAL = 6 * 3600 # Seconds before the source is asked again whether the guide changed
+RETRY_INTERVAL = 15 * 60 # Seconds before a failed refresh is tried again
+PAST_PROGRAMMES = 2 * 3600 # Seconds of finished programmes still included, so catch-up views are not empty
+INSERT_BATCH = 2000 # Programmes written to the database per executemany
+GZIP_LEVEL = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS channels (id TEXT PRIMARY KEY, xml TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS programmes (channel TEXT NOT NULL, start INTEGER NOT NULL, stop INTEGER NOT NULL,
+                                       xml TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS programmes_by_channel ON programmes (channel, stop);
+"""
+
+class EpgError(Exception):
+    """The guide could not be downloaded or parsed; the previous one stays in use."""
+
+@functools.lru_cache(maxsize=4096) # Guides repeat the same few start and stop times across all channels
+def parse_xmltv_time(value):
+    """Returns epoch seconds of an XMLTV date such as '20250101120000 +0100', None if it is not one."""
+    digits, _, offset = (value or '').strip().partition(' ')
+    digits = digits[:14].ljust(14, '0')
+    offset = offset.strip()
+    if not digits.isdigit() or (offset and not (len(offset) == 5 and offset[0] in '+-' and offset[1:].isdigit())):
+        return None
+    seconds = calendar.timegm((int(digits[:4]), int(digits[4:6]), int(digits[6:8]),
+                               int(digits[8:10]), int(digits[10:12]), int(digits[12:14])))
+    if offset:
+        shift = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+        seconds -= shift if offset[0] == '+' else -shift
+    return seconds
+
+def serialize(element):
+    """Returns an element and its children as an XML fragment, leaving out the whitespace that followed it.
+
+    A few times faster than ET.tostring, which matters at a hundred thousand programmes per guide.
+    """
+    attributes = ''.join(f' {name}={quoteattr(value)}' for name, value in element.attrib.items())
+    inner = escape(element.text or '') + ''.join(serialize(child) + escape(child.tail or '') for child in element)
+    return f'<{element.tag}{attributes}>{inner}</{element.tag}>' if inner else f'<{element.tag}{attributes} />'
+
+def iter_guide(stream):
+    """Yields ('channel', id, xml) and ('programme', channel, start, stop, xml) while parsing an XMLTV stream.
+
+    Elements are dropped as soon as they were yielded, so memory stays flat however large the guide is.
+    """
+    root = None
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = element
+            continue
+        if event != 'end':
+            continue
+        if element.tag == 'channel':
+            yield 'channel', element.get('id', ''), serialize(element)
+        elif element.tag == 'programme':
+            start = parse_xmltv_time(element.get('start'))
+            if start is not None:
+                stop = parse_xmltv_time(element.get('stop')) or start
+                yield 'programme', element.get('channel', ''), start, stop, serialize(element)
+        else:
+            continue # Children of a channel or programme are serialized with it
+        root.clear()
+
+class EpgStore:
+    """XMLTV guide kept in SQLite, rendered into gzip'd guides trimmed to the channels a playlist shows.
+
+    Shared by every event loop and thread of a proxy process; each operation opens its own
+    connection, and rendered guides are kept until the data or the cut-off hour changes.
+    """
+
+    def __init__(self, db_file=EPG_DATABASE, url=EPG_SOURCE_URL):
+        self.db_file = db_file
+        self.url = url # Source refresh() downloads from
+        self.refresh_lock = threading.Lock()
+        self.rendered = {} # tuple of tvg-ids -> (version, cut-off, gzip bytes)
+        self.lock = threading.Lock()
+        self.retry_at = 0 # Epoch seconds before which a failed refresh is not tried again
+        db = self.connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def connect(self):
+        """Opens a connection; WAL lets renders read the old guide while a new one is imported."""
+        db = sqlite3.connect(self.db_file, timeout=30)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def meta(self):
+        """Returns the stored metadata: etag, last_modified, fetched_at and imported_at."""
+        db = self.connect()
+        try:
+            return dict(db.execute('SELECT key, value FROM meta'))
+        finally:
+            db.close()
+
+    def set_meta(self, db, **values):
+        """Stores metadata values within the caller's transaction."""
+        db.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                       [(key, str(value)) for key, value in values.items() if value is not None])
+
+    def has_guide(self):
+        """Returns True once a guide was imported."""
+        return 'imported_at' in self.meta()
+
+    def is_stale(self, now=None):
+        """Returns True if the source was last asked more than REFRESH_INTERVAL ago and no failed refresh is backing off."""
+        now = time.time() if now is None else now
+        return now >= self.retry_at and float(self.meta().get('fetched_at', 0)) + REFRESH_INTERVAL <= now
+
+    def import_guide(self, stream, etag=None, last_modified=None):
+        """Replaces the stored guide with the one parsed from stream, returns (channels, programmes).
+
+        The whole import is one transaction, so a download that breaks off leaves the old guide in place.
+        """
+        db = self.connect()
+        try:
+            with db:
+                db.execute('DELETE FROM channels')
+                db.execute('DELETE FROM programmes')
+                channels = programmes = 0
+                batch = []
+                for item in iter_guide(stream):
+                    if item[0] == 'channel':
+                        db.execute('INSERT OR REPLACE INTO channels (id, xml) VALUES (?, ?)', item[1:])
+                        channels += 1
+                        continue
+                    batch.append(item[1:])
+                    if len(batch) >= INSERT_BATCH:
+                        db.executemany('INSERT INTO programmes VALUES (?, ?, ?, ?)', batch)
+                        programmes += len(batch)
+                        batch = []
+                db.executemany('INSERT INTO programmes VALUES (?, ?, ?, ?)', batch)
+                programmes += len(batch)
+                now = time.time()
+                db.execute("DELETE FROM meta WHERE key IN ('etag', 'last_modified')")
+                self.set_meta(db, etag=etag, last_modified=last_modified, fetched_at=now, imported_at=now)
+        finally:
+            db.close()
+        return channels, programmes
+
+    def mark_fetched(self):
+        """Records that the source was asked just now and had nothing new."""
+        db = self.connect()
+        try:
+            with db:
+                self.set_meta(db, fetched_at=time.time())
+        finally:
+            db.close()
+
+    def refresh(self):
+        """Fetches the guide if it is stale, returns what fetch_guide did or None if it was fresh.
+
+        Concurrent callers wait for the running refresh instead of starting their own.
+        """
+        with self.refresh_lock:
+            if not self.is_stale():
+                return None
+            try:
+                return fetch_guide(self, self.url)
+            except EpgError:
+                self.retry_at = time.time() + RETRY_INTERVAL
+                raise
+
+    def render(self, tvg_ids, now=None):
+        """Returns a gzip'd XMLTV guide with only the given channels and their current and future programmes."""
+        now = time.time() if now is None else now
+        cutoff = int(now - PAST_PROGRAMMES) // 3600 * 3600 # Whole hours, so renders can be reused
+        key = tuple(dict.fromkeys(tvg_ids))
+        version = self.meta().get('imported_at')
+        with self.lock:
+            cached = self.rendered.get(key)
+            if cached is not None and cached[:2] == (version, cutoff):
+                return cached[2]
+        body = io.BytesIO()
+        db = self.connect()
+        try:
+            with gzip.GzipFile(fileobj=body, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as output:
+                output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<tv generator-info-name="fproxy">\n')
+                known = []
+                for tvg_id in key:
+                    row = db.execute('SELECT xml FROM channels WHERE id = ?', (tvg_id,)).fetchone()
+                    if row is None:
+                        continue
+                    known.append(tvg_id)
+                    output.write(row[0].encode('utf-8') + b'\n')
+                for tvg_id in known:
+                    for (xml,) in db.execute('SELECT xml FROM programmes WHERE channel = ? AND stop > ? '
+                                             'ORDER BY start', (tvg_id, cutoff)):
+                        output.write(xml.encode('utf-8') + b'\n')
+                output.write(b'</tv>\n')
+        finally:
+            db.close()
+        body = body.getvalue()
+        with self.lock:
+            self.rendered = {cached_key: value for cached_key, value in self.rendered.items() if value[0] == version}
+            self.rendered[key] = (version, cutoff, body)
+        return body
+
+def fetch_guide(store, url=EPG_SOURCE_URL, timeout=REQUEST_TIMEOUT):
+    """Downloads the guide unless the source says it is unchanged, returns 'not modified' or (channels, programmes).
+
+    The response is parsed while it downloads, so the full XML never has to fit in memory or on disk.
+    """
+    meta = store.meta()
+    headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as response:
+            stream = io.BufferedReader(response)
+            # Guides come gzip'd either as .xml.gz files or through Content-Encoding
+            if stream.peek(2)[:2] == b'\x1f\x8b':
+                stream = gzip.GzipFile(fileobj=stream)
+            return store.import_guide(stream, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            store.mark_fetched()
+            return 'not modified'
+        raise EpgError(f"{url} answered {e.code} {e.reason}")
+    except (OSError, EOFError, ET.ParseError) as e:
+        raise EpgError(f"Could not load the guide from {url}: {e}")
+
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Download the XMLTV guide into the EPG database and trim it")
+    parser.add_argument('--url', default=EPG_SOURCE_URL, help=f"Guide to download (default: {EPG_SOURCE_URL})")
+    parser.add_argument('--database', default=EPG_DATABASE, help=f"EPG database (default: {EPG_DATABASE})")
+    parser.add_argument('--output', metavar='FILE',
+                        help="Also write a gzip'd guide trimmed to the channels of the catalog to this file")
+    parser.add_argument('--group', action='append',
+                        help="With --output, only include this group title, may be repeated (default: every group)")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    store = EpgStore(args.database)
+    try:
+        result = fetch_guide(store, args.url)
+    except EpgError as e:
+        print(f"Error: {e}")
+        if not store.has_guide():
+            return
+        print("Keeping the previously downloaded guide.")
+    else:
+        if result == 'not modified':
+            print(f"The guide at {args.url} is unchanged.")
+        else:
+            print(f"Stored {result[0]} channels and {result[1]} programmes in '{args.database}'.")
+    if args.output:
+        # Imported here so the guide can be refreshed without a channel catalog
+        from playlist import PlaylistIndex
+        tvg_ids = PlaylistIndex().tvg_ids(args.group)
+        with open(args.output, 'wb') as f:
+            f.write(store.render(tvg_ids))
+        print(f"Wrote the guide of {len(tvg_ids)} channels to '{args.output}' ({os.path.getsize(args.output)} bytes).")
+
+if __name__ == "__main__":
+    main()
@@ -3,81 +3,220 @@ import threading
 import select
 import sys
 import os
+import asyncio
+import argparse
+import multiprocessing
+import logging
+import logging.handlers
+import queue
+import atexit
+import json
+import sqlite3
+import time
+from urllib.parse import parse_qs, urlencode
+
+from proxy_http import (HOP_BY_HOP_HEADERS, HttpFramingError, HttpMessage, PeerTimeout, SocketStream,
+                        read_message_head, keeps_alive, is_upgrade_request, request_body_framing,
+                        response_body_framing, forward_body, read_body, format_authority, split_authority,
+                        split_target)
+from upstream_pool import DnsCache, UpstreamPool
+from upstream_health import HealthProber, MirrorRouter, UpstreamHealth
+from hls_cache import CachedResponse, HlsCache, UncacheableResponse, classify
+from proxy_metrics import ProxyMetrics
+from bandwidth import BandwidthShaper
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
 
 # --- Configuration ---
-HOST = '0.0.0.0'  # Listen on all available interfaces
+HOST = '0.0.0.0'  # Listen on all available interfaces ('::' for IPv6 as well)
 PORT = 8888       # Default proxy port
 BUFFER_SIZE = 4096 # Buffer size for relaying data
+SERVER_MODE = 'async' # 'async' (single event loop per worker) or 'threaded' (one thread per connection)
+WORKERS = 1       # Event-loop worker processes sharing PORT through SO_REUSEPORT
+LISTEN_BACKLOG = 1024 # Pending connections queued by the kernel in async mode
+CONNECT_TIMEOUT = 5 # Seconds allowed for connecting to the remote server
+RELAY_MODE = 'splice' # 'splice' (Linux zero-copy through a pipe), 'buffer' (reusable recv_into buffers) or 'copy'
+RELAY_CHUNK_SIZE = 256 * 1024 # Bytes moved per splice/recv_into call in 'splice' and 'buffer' modes
+SOCKET_RCVBUF = 0 # SO_RCVBUF for relayed sockets in bytes (0 keeps the kernel default)
+SOCKET_SNDBUF = 0 # SO_SNDBUF for relayed sockets in bytes (0 keeps the kernel default)
+TCP_NODELAY = True # Disable Nagle's algorithm on relayed sockets
+UPSTREAM_READ_TIMEOUT = 30 # Seconds to wait for upstream data on plain HTTP requests
+CLIENT_KEEPALIVE_TIMEOUT = 60 # Seconds an idle keep-alive client connection is kept open
+HLS_CACHE_ENABLED = False # Serve plain HTTP playlists, keys and segments through the shared in-memory cache
+REFRESH_CONCURRENCY = 4 # Requests the --refresh signature scheduler runs at once
+LAZY_AUTH_ENABLED = False # Harvest and activate a channel when a plain HTTP request for it comes through
+MIRRORS_ENABLED = False # Probe upstream hosts and route plain HTTP channel requests to the fastest healthy edge server
+CLIENT_RATE_LIMIT = 0 # Bytes per second relayed for one client IP (0 for no limit)
+HOST_RATE_LIMIT = 0 # Bytes per second relayed from one upstream host (0 for no limit)
+TOTAL_RATE_LIMIT = 0 # Bytes per second relayed in total, split fairly between active tunnels (0 for no limit)
+CONFIG_FILE = 'fproxy.json' # JSON object overriding any of these constants, e.g. {"PORT": 8080, "CLIENT_RATE_LIMIT": 2000000}
+LOG_LEVEL = 'INFO' # Messages below this level are dropped; DEBUG adds one line per connection event
+METRICS_PATH = '/metrics' # Prometheus endpoint, requested from the proxy itself (http://proxy:port/metrics)
+PLAYLIST_PATH = '/playlist.m3u8' # Playlist generated from the channel catalog (?group=...&valid=1 to filter)
+EPG_PATH = '/epg.xml.gz' # Guide trimmed to the playlist's channels, which served playlists point their players at
+EPG_SOURCE = '' # Full XMLTV guide EPG_PATH is trimmed from ('' for the one in epg.py)
 
 # --- Helper Functions ---
+LOGGER = logging.getLogger('fproxy')
+LOG_LISTENER = None # (pid, QueueListener) writing queued records to stdout
+METRICS = ProxyMetrics()
+SHAPER = BandwidthShaper() # Set up from the *_RATE_LIMIT constants by apply_settings
+
+def setup_logging(level):
+    """Queues log records for a background thread, so connection handlers never block on stdout."""
+    global LOG_LISTENER
+    if LOG_LISTENER is not None and LOG_LISTENER[0] == os.getpid():
+        LOGGER.setLevel(level)
+        return
+    # A forked worker inherits the parent's handler but not its listener thread, so it starts its own
+    for handler in list(LOGGER.handlers):
+        LOGGER.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, output)
+    LOGGER.addHandler(logging.handlers.QueueHandler(log_queue))
+    LOGGER.setLevel(level)
+    LOGGER.propagate = False
+    listener.start()
+    atexit.register(listener.stop) # Flushes what is still queued
+    LOG_LISTENER = (os.getpid(), listener)
+
 def log_message(level, message):
-    """Simple logging function."""
-    print(f"[{level}] {message}")
-
-def parse_http_request(data):
-    """Parses the first line of an HTTP request to get the method, host, and port."""
-    try:
-        first_line = data.decode('latin-1').splitlines()[0]
-        parts = first_line.split(' ')
-        if len(parts) < 2:
-            return None, None, None, None # Invalid request line
-
-        method = parts[0]
-        url = parts[1]
-
-        if method == 'CONNECT': # HTTPS request
-            # For CONNECT, URL is usually host:port
-            host_port = url.split(':')
-            host = host_port[0]
-            port = int(host_port[1]) if len(host_port) > 1 else 443 # Default HTTPS port
-            log_message("INFO", f"CONNECT request to {host}:{port}")
-            return method, host, port, None
-        else: # HTTP request
-            # Try to find Host header for HTTP/1.1 requests
-            host = None
-            port = 80 # Default HTTP port
-
-            # Parse URL for older HTTP versions or direct IP access
-            if url.startswith('http://'):
-                url_parts = url.split('/')
-                host_path = url_parts[2]
-                if ':' in host_path:
-                    host, port_str = host_path.split(':')
-                    port = int(port_str)
-                else:
-                    host = host_path
-                # Reconstruct path for request to origin server
-                path = '/' + '/'.join(url_parts[3:])
-                return method, host, port, path
-            else:
-                # For HTTP/1.0 or when no scheme is in URL (e.g., GET /path HTTP/1.0)
-                # We need to find the Host header in the full request
-                headers = data.decode('latin-1').split('\r\n')
-                for header in headers:
-                    if header.lower().startswith('host:'):
-                        host_header = header.split(':')[1].strip()
-                        if ':' in host_header:
-                            host, port_str = host_header.split(':')
-                            port = int(port_str)
-                        else:
-                            host = host_header
-                        break
-                # If host is still None, it's a malformed request or direct IP
-                if host is None:
-                    # Fallback: assume the URL is just the path and hope it's an HTTP/1.0 request
-                    # or an explicit full URL was given. This is less robust.
-                    log_message("WARNING", f"Could not find Host header for HTTP request: {first_line}. Assuming direct URL or 1.0.")
-                    return method, None, None, url # Cannot determine host/port reliably
-
-                log_message("INFO", f"HTTP request to {host}:{port}{url}")
-                return method, host, port, url # url here is the path, or full URL if scheme was present
-    except Exception as e:
-        log_message("ERROR", f"Error parsing HTTP request: {e} - Data: {data[:100]}")
-        return None, None, None, None
+    """Logs a message at a level name such as 'INFO' or 'ERROR'."""
+    LOGGER.log(logging.getLevelName(level), message)
+
+def parse_http_request(request):
+    """Returns the method, host, port and path of a parsed request head (host is None if unknown)."""
+    parts = request.start_line.split(' ')
+    if len(parts) != 3:
+        return None, None, None, None # Invalid request line
+    method, target = parts[0], parts[1]
+    if method == 'CONNECT':
+        # The target is host:port, or [address]:port for IPv6
+        host, port = split_authority(target, 443)
+        log_message("DEBUG", f"CONNECT request to {host}:{port}")
+        return method, host, port, None
+    host, port, path = split_target(target, request.get_header('Host'))
+    log_message("DEBUG", f"HTTP request to {host}:{port}{path}")
+    return method, host, port, path
 
-def relay_data(source_socket, destination_socket):
-    """Relays data between two sockets."""
+def get_relay_mode():
+    """Returns the relay mode to use, falling back when splice is unavailable."""
+    if RELAY_MODE == 'splice' and not hasattr(os, 'splice'):
+        return 'buffer' # os.splice needs Linux and Python 3.10+
+    return RELAY_MODE
+
+def tune_socket(sock):
+    """Applies the configured TCP_NODELAY and buffer sizes to a relayed socket."""
     try:
+        if TCP_NODELAY:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if SOCKET_RCVBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+        if SOCKET_SNDBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SNDBUF)
+    except OSError as e:
+        log_message("WARNING", f"Could not tune socket options: {e}")
+
+def open_splice_pipe():
+    """Creates the pipe used to move bytes between two sockets inside the kernel."""
+    pipe_read, pipe_write = os.pipe()
+    if fcntl is not None and hasattr(fcntl, 'F_SETPIPE_SZ'):
+        try:
+            fcntl.fcntl(pipe_write, fcntl.F_SETPIPE_SZ, RELAY_CHUNK_SIZE)
+        except OSError:
+            pass # Keep the default pipe size if the limit is lower
+    return pipe_read, pipe_write
+
+def pace(flow, count):
+    """Blocks until a shaped flow may send count more bytes."""
+    if flow is not None:
+        wait = flow.reserve(count)
+        if wait:
+            time.sleep(wait)
+
+async def pace_async(flow, count):
+    """Waits on the event loop until a shaped flow may send count more bytes."""
+    if flow is not None:
+        wait = flow.reserve(count)
+        if wait:
+            await asyncio.sleep(wait)
+
+def relay_chunk_size(flow):
+    """Returns the bytes moved per call, at most one shaping quantum so shaped tunnels take turns."""
+    return RELAY_CHUNK_SIZE if flow is None else min(RELAY_CHUNK_SIZE, flow.quantum)
+
+def make_forwarder(mode, source_socket, destination_socket, pipes, direction, flow=None):
+    """Returns a function moving one chunk from source to destination, False on EOF."""
+    chunk_size = relay_chunk_size(flow)
+    if mode == 'splice':
+        try:
+            pipe_read, pipe_write = open_splice_pipe()
+        except OSError as e:
+            # Typically EMFILE: every spliced tunnel costs two pipes (four descriptors)
+            log_message("WARNING", f"Could not create splice pipe, relaying with buffers instead: {e}")
+            return make_forwarder('buffer', source_socket, destination_socket, pipes, direction, flow)
+        pipes.extend((pipe_read, pipe_write))
+        source_fd, destination_fd = source_socket.fileno(), destination_socket.fileno()
+
+        def forward():
+            try:
+                pending = os.splice(source_fd, pipe_write, chunk_size, flags=os.SPLICE_F_MOVE)
+            except BlockingIOError:
+                return True # Spurious wakeup, select again
+            if not pending:
+                return False
+            METRICS.add_bytes(direction, pending)
+            pace(flow, pending)
+            while pending:
+                try:
+                    pending -= os.splice(pipe_read, destination_fd, pending, flags=os.SPLICE_F_MOVE)
+                except BlockingIOError:
+                    # Sockets with a timeout are non-blocking underneath, wait until writable
+                    _, writable, _ = select.select([], [destination_socket], [], CONNECT_TIMEOUT)
+                    if not writable:
+                        raise socket.timeout("Destination stopped accepting data")
+            return True
+        return forward
+
+    if mode == 'buffer':
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+
+        def forward():
+            received = source_socket.recv_into(buffer)
+            if not received:
+                return False
+            METRICS.add_bytes(direction, received)
+            pace(flow, received)
+            destination_socket.sendall(view[:received])
+            return True
+        return forward
+
+    def forward():
+        data = source_socket.recv(BUFFER_SIZE)
+        if not data:
+            return False
+        METRICS.add_bytes(direction, len(data))
+        pace(flow, len(data))
+        destination_socket.sendall(data)
+        return True
+    return forward
+
+def relay_data(source_socket, destination_socket, flow=None):
+    """Relays data between two sockets, paced by an optional ShapedFlow that is closed afterwards."""
+    pipes = []
+    METRICS.tunnel_opened()
+    try:
+        mode = get_relay_mode()
+        forwarders = {
+            source_socket: make_forwarder(mode, source_socket, destination_socket, pipes, 'upstream', flow),
+            destination_socket: make_forwarder(mode, destination_socket, source_socket, pipes, 'downstream', flow),
+        }
         while True:
             # Use select to wait for data on either socket
             rlist, _, _ = select.select([source_socket, destination_socket], [], [], 1)
@@ -86,21 +225,18 @@ def relay_data(source_socket, destination_socket):
                 continue
 
             for sock in rlist:
-                if sock == source_socket:
-                    data = source_socket.recv(BUFFER_SIZE)
-                    if not data:
-                        return # Client disconnected
-                    destination_socket.sendall(data)
-                elif sock == destination_socket:
-                    data = destination_socket.recv(BUFFER_SIZE)
-                    if not data:
-                        return # Destination disconnected
-                    source_socket.sendall(data)
+                if not forwarders[sock]():
+                    return # Client or destination disconnected
     except socket.error as e:
         log_message("WARNING", f"Socket error during data relay: {e}")
     except Exception as e:
         log_message("ERROR", f"Unexpected error during data relay: {e}")
     finally:
+        METRICS.tunnel_closed()
+        if flow is not None:
+            flow.close()
+        for fd in pipes:
+            os.close(fd)
         # Ensure sockets are closed if relay loop exits
         try:
             source_socket.shutdown(socket.SHUT_RDWR)
@@ -113,69 +249,502 @@ def relay_data(source_socket, destination_socket):
         except OSError:
             pass # Socket might already be closed
 
+# --- Plain HTTP Keep-Alive Handling ---
+DNS_CACHE = DnsCache()
+HEALTH = UpstreamHealth() # Connect latency and failures per upstream host, shared by the pool and the prober
+UPSTREAM_POOL = UpstreamPool(DNS_CACHE, CONNECT_TIMEOUT, on_connect=tune_socket, metrics=METRICS, health=HEALTH)
+MIRROR_ROUTER = None # Created on the first request when MIRRORS_ENABLED
+MIRROR_ROUTER_LOCK = threading.Lock()
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'} # Safe to retry (RFC 9110)
+HLS_CACHE = HlsCache() # Shared by every event loop and thread of this process
+CACHE_SKIPPED_HEADERS = HOP_BY_HOP_HEADERS | {'content-length', 'transfer-encoding'} # Re-added when serving
+LAZY_AUTHENTICATOR = None # Created on the first request when LAZY_AUTH_ENABLED
+LAZY_AUTHENTICATOR_LOCK = threading.Lock()
+PLAYLIST_INDEX = None # Loaded on the first playlist request
+PLAYLIST_INDEX_LOCK = threading.Lock()
+EPG_STORE = None # Opened on the first guide request
+EPG_STORE_LOCK = threading.Lock()
+
+def status_response(status_line):
+    """Returns a minimal response with an empty body for a proxy-generated status."""
+    return f"HTTP/1.1 {status_line}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode('latin-1')
+
+async def send_status(client, status_line):
+    """Sends a proxy-generated status to the client, ignoring clients that already left."""
+    try:
+        await client.sendall(status_response(status_line))
+    except (OSError, PeerTimeout):
+        pass # Client already disconnected or stopped reading
+
+async def read_request(client, client_address):
+    """Reads the next request head from a client, returns None when the connection should be closed."""
+    try:
+        # The head is buffered until its blank line, however many recv calls it takes
+        return await read_message_head(client)
+    except PeerTimeout:
+        if client.buffer:
+            log_message("WARNING", f"Client {client_address} stalled while sending a request head")
+            METRICS.count_error('client_timeout')
+            await send_status(client, "408 Request Timeout")
+        return None # Otherwise an idle keep-alive client
+    except HttpFramingError as e:
+        log_message("WARNING", f"Invalid HTTP request from {client_address}: {e}")
+        METRICS.count_error('bad_request')
+        await send_status(client, "400 Bad Request")
+        return None
+
+async def serve_http_connection(client, client_address, request):
+    """Serves plain HTTP requests on one client connection, starting with request, until it closes.
+
+    Pipelined requests wait in the client's buffer and are answered one after another, in order.
+    """
+    # Responses are paced like a tunnel, charged to the host each request goes to
+    client.flow = SHAPER.open_flow(client_address[0], None)
+    try:
+        while request is not None and await serve_http_request(client, client_address, request):
+            request = await read_request(client, client_address)
+    finally:
+        if client.flow is not None:
+            client.flow.close()
+
+async def serve_http_request(client, client_address, request):
+    """Forwards one request and its response, returns True if the client connection can be reused."""
+    parts = request.start_line.split(' ')
+    if len(parts) != 3 or parts[0] == 'CONNECT':
+        log_message("WARNING", f"Unexpected request line from {client_address}: {request.start_line[:50]}")
+        METRICS.count_error('bad_request')
+        await send_status(client, "400 Bad Request")
+        return False
+    method, target, version = parts
+    if target == METRICS_PATH and method == 'GET':
+        return await send_metrics(client, request, version)
+    if target.partition('?')[0] == PLAYLIST_PATH and method == 'GET':
+        return await send_playlist(client, client_address, request, version, target.partition('?')[2])
+    if target.partition('?')[0] == EPG_PATH and method == 'GET':
+        return await send_epg(client, client_address, request, version, target.partition('?')[2])
+    host, port, path = split_target(target, request.get_header('Host'))
+    if not host:
+        log_message("ERROR", f"Could not determine destination for request from {client_address}: {request.start_line[:50]}")
+        METRICS.count_error('bad_request')
+        await send_status(client, "400 Bad Request")
+        return False
+    if MIRRORS_ENABLED:
+        routed_host, routed_path = mirror_router().route(host, port, path)
+        if routed_host != host:
+            log_message("DEBUG", f"Routing {host}{path} to mirror {routed_host}{routed_path}")
+            # The Host header is added again for the mirror below
+            request.headers = [(name, value) for name, value in request.headers if name.lower() != 'host']
+            host, path = routed_host, routed_path
+    if client.flow is not None:
+        client.flow.host = host
+    try:
+        request_framing, request_length = request_body_framing(request)
+    except HttpFramingError as e:
+        log_message("WARNING", f"Invalid HTTP request from {client_address}: {e}")
+        METRICS.count_error('bad_request')
+        await send_status(client, "400 Bad Request")
+        return False
+
+    if LAZY_AUTH_ENABLED:
+        await authenticate_channel(path, client_address)
+
+    request.start_line = f"{method} {path} {version}"
+    host_header = [('Host', format_authority(host, port))] if request.get_header('Host') is None else []
+    try:
+        if is_upgrade_request(request):
+            await relay_upgrade_request(client, client_address, request, host_header, host, port)
+            return False
+        head = request.serialize(host_header + [('Connection', 'keep-alive')])
+        cached = None
+        kind = classify(host, path) if is_cacheable_request(request, method, request_framing) else None
+        if kind:
+            try:
+                cached, source = await HLS_CACHE.get_or_fetch(
+                    (host, port, path), kind, lambda: fetch_cacheable_response(head, host, port))
+            except UncacheableResponse as e:
+                log_message("INFO", f"Streaming {host}:{port}{path} uncached: {e}")
+        if cached is None:
+            upstream, response, status, response_framing, response_length = await send_upstream_request(
+                client, head, method, request_framing, request_length, host, port)
+    except PeerTimeout as e:
+        if e.peer == 'client':
+            log_message("WARNING", f"Client {client_address} stalled while sending a request body")
+            METRICS.count_error('client_timeout')
+            await send_status(client, "408 Request Timeout")
+        else:
+            log_message("ERROR", f"{host}:{port} did not respond in time for {client_address}")
+            METRICS.count_error('upstream_timeout')
+            await send_status(client, "504 Gateway Timeout")
+        return False
+    except HttpFramingError as e:
+        if e.peer == 'client':
+            log_message("WARNING", f"Invalid HTTP request body from {client_address}: {e}")
+            METRICS.count_error('bad_request')
+            await send_status(client, "400 Bad Request")
+        else:
+            log_message("ERROR", f"Invalid response from {host}:{port} for {client_address}: {e}")
+            METRICS.count_error('bad_response')
+            await send_status(client, "502 Bad Gateway")
+        return False
+    except socket.timeout:
+        log_message("ERROR", f"Connection to {host}:{port} timed out from {client_address}")
+        METRICS.count_error('timeout')
+        await send_status(client, "504 Gateway Timeout")
+        return False
+    except ConnectionRefusedError:
+        log_message("ERROR", f"Connection refused by {host}:{port} for {client_address}")
+        METRICS.count_error('refused')
+        await send_status(client, "502 Bad Gateway")
+        return False
+    except socket.gaierror:
+        log_message("ERROR", f"Could not resolve host {host} for {client_address}")
+        METRICS.count_error('gaierror')
+        await send_status(client, "504 Gateway Timeout")
+        return False
+    except OSError as e:
+        log_message("ERROR", f"Upstream error from {host}:{port} for {client_address}: {e}")
+        METRICS.count_error('os_error')
+        await send_status(client, "502 Bad Gateway")
+        return False
+
+    if cached is not None:
+        return await send_cached_response(client, client_address, request, version, cached, source)
+
+    # The response head goes out below, from here on errors can only close the connection
+    try:
+        client_reusable = keeps_alive(request, version) and response_framing != 'close'
+        upstream_reusable = response_framing != 'close' and keeps_alive(response, response.start_line.split(' ', 1)[0])
+        if not client_reusable:
+            connection_headers = [('Connection', 'close')]
+        elif version == 'HTTP/1.0':
+            connection_headers = [('Connection', 'keep-alive')]
+        else:
+            connection_headers = []
+        await client.sendall(response.serialize(connection_headers))
+        await forward_body(upstream, client, response_framing, response_length)
+    except (PeerTimeout, HttpFramingError, OSError) as e:
+        log_message("WARNING", f"Response from {host}:{port} to {client_address} aborted: {e}")
+        METRICS.count_error('aborted')
+        upstream.sock.close()
+        return False
+
+    if upstream_reusable and not upstream.buffer:
+        UPSTREAM_POOL.release(host, port, upstream.sock)
+    else:
+        upstream.sock.close()
+    return client_reusable
+
+async def send_upstream_request(client, head, method, request_framing, request_length, host, port):
+    """Sends a request upstream and returns the upstream stream plus its final response head and framing."""
+    # Pooled connections may have been closed by the server just now, so they are only used
+    # when the request can be replayed on a fresh connection
+    reuse = method in IDEMPOTENT_METHODS and request_framing == 'none'
+    upstream_socket, reused = await UPSTREAM_POOL.acquire(host, port, reuse)
+    upstream = SocketStream(upstream_socket, 'upstream', UPSTREAM_READ_TIMEOUT)
+    try:
+        log_message("DEBUG", f"Forwarding HTTP request to {host}:{port}{' (pooled connection)' if reused else ''}")
+        response = None
+        if reused:
+            try:
+                await upstream.sendall(head)
+                response = await read_message_head(upstream)
+            except (ConnectionResetError, BrokenPipeError, HttpFramingError):
+                response = None
+            if response is None:
+                upstream_socket.close()
+                upstream_socket = await UPSTREAM_POOL.connect(host, port)
+                upstream = SocketStream(upstream_socket, 'upstream', UPSTREAM_READ_TIMEOUT)
+        if response is None:
+            await upstream.sendall(head)
+            await forward_body(client, upstream, request_framing, request_length)
+            response = await read_message_head(upstream)
+
+        # Forward interim 1xx responses (e.g. 100 Continue) until the final one arrives
+        while True:
+            if response is None:
+                raise HttpFramingError(f"{host}:{port} closed the connection without a response", 'upstream')
+            try:
+                status = int(response.start_line.split(' ', 2)[1])
+            except (IndexError, ValueError):
+                raise HttpFramingError(f"Malformed status line: {response.start_line[:50]}", 'upstream')
+            if status >= 200:
+                break
+            if client is not None: # Cache fetches have no client to pass interim responses to
+                await client.sendall(response.serialize())
+            response = await read_message_head(upstream)
+
+        try:
+            response_framing, response_length = response_body_framing(response, method, status)
+        except HttpFramingError as e:
+            raise HttpFramingError(str(e), 'upstream')
+        return upstream, response, status, response_framing, response_length
+    except BaseException:
+        upstream_socket.close()
+        raise
+
+async def send_metrics(client, request, version):
+    """Answers a request for METRICS_PATH with this process's metrics in the Prometheus text format."""
+    extra = [
+        ('fproxy_threads', 'gauge', 'Threads in this process.', threading.active_count()),
+        ('fproxy_tasks', 'gauge', 'Tasks on the event loop serving this request.', len(asyncio.all_tasks())),
+        ('fproxy_hls_cache_hits_total', 'counter', 'HLS cache hits.', HLS_CACHE.hits),
+        ('fproxy_hls_cache_misses_total', 'counter', 'HLS cache misses fetched upstream.', HLS_CACHE.misses),
+        ('fproxy_hls_cache_coalesced_total', 'counter', 'HLS cache misses that waited for another fetch.', HLS_CACHE.coalesced),
+        ('fproxy_hls_cache_bytes', 'gauge', 'Body bytes held by the HLS cache.', HLS_CACHE.size),
+    ]
+    return await send_local_response(client, request, version, "200 OK", 'text/plain; version=0.0.4',
+                                     METRICS.render(extra).encode('utf-8'))
+
+async def send_local_response(client, request, version, status_line, content_type, body, headers=()):
+    """Answers a request the proxy serves itself, returns True if the client connection can be reused."""
+    client_reusable = keeps_alive(request, version)
+    extra = ''.join(f"{name}: {value}\r\n" for name, value in headers)
+    head = (f"HTTP/1.1 {status_line}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n{extra}"
+            f"Connection: {'keep-alive' if client_reusable else 'close'}\r\n\r\n").encode('latin-1')
+    try:
+        await client.sendall(head + body)
+    except (PeerTimeout, OSError):
+        return False
+    return client_reusable
+
+def playlist_index():
+    """Returns this process's PlaylistIndex, loading the channel catalog on first use."""
+    global PLAYLIST_INDEX
+    with PLAYLIST_INDEX_LOCK:
+        if PLAYLIST_INDEX is None:
+            # Imported here so the proxy alone needs none of the channel scripts
+            from playlist import PlaylistIndex
+            PLAYLIST_INDEX = PlaylistIndex()
+    return PLAYLIST_INDEX
+
+async def send_playlist(client, client_address, request, version, query):
+    """Answers a request for PLAYLIST_PATH with the playlist of the requested groups."""
+    parameters = parse_qs(query)
+    try:
+        index = playlist_index()
+    except (OSError, ValueError, KeyError) as e:
+        log_message("ERROR", f"Could not load the channel catalog for {client_address}: {e}")
+        return await send_local_response(client, request, version, "404 Not Found", 'text/plain', b'')
+    groups = parameters.get('group')
+    epg_url = None
+    if request.get_header('Host'):
+        # Players then load the trimmed guide from the proxy instead of the full one
+        epg_url = f"http://{request.get_header('Host')}{EPG_PATH}"
+        if groups:
+            epg_url += '?' + urlencode({'group': groups}, doseq=True)
+    body = index.render(groups, parameters.get('valid', ['0'])[0] == '1', epg_url=epg_url)
+    return await send_local_response(client, request, version, "200 OK", 'audio/x-mpegurl', body)
+
+def epg_store():
+    """Returns this process's EpgStore, opening the EPG database on first use."""
+    global EPG_STORE
+    with EPG_STORE_LOCK:
+        if EPG_STORE is None:
+            # Imported here so the proxy alone needs none of the channel scripts
+            from epg import EPG_SOURCE_URL, EpgStore
+            EPG_STORE = EpgStore(url=EPG_SOURCE or EPG_SOURCE_URL)
+    return EPG_STORE
+
+def refresh_epg(store):
+    """Asks the EPG source for a newer guide, logging the outcome (blocking)."""
+    from epg import EpgError
+    try:
+        result = store.refresh()
+    except EpgError as e:
+        log_message("WARNING", f"Could not refresh the EPG: {e}")
+        return
+    if result not in (None, 'not modified'):
+        log_message("INFO", f"Loaded the EPG: {result[0]} channels, {result[1]} programmes")
+
+def epg_guide(groups):
+    """Returns the gzip'd guide of the given groups' channels, None while there is none (blocking)."""
+    store = epg_store()
+    if store.is_stale():
+        if not store.has_guide():
+            refresh_epg(store) # Nothing to serve yet, so this request waits for the first download
+        elif not store.refresh_lock.locked():
+            # The stored guide is served meanwhile
+            threading.Thread(target=refresh_epg, args=(store,), name='epg-refresh', daemon=True).start()
+    if not store.has_guide():
+        return None
+    return store.render(playlist_index().tvg_ids(groups))
+
+async def send_epg(client, client_address, request, version, query):
+    """Answers a request for EPG_PATH with the guide trimmed to the requested groups' channels, gzip'd."""
+    try:
+        body = await asyncio.get_running_loop().run_in_executor(None, epg_guide, parse_qs(query).get('group'))
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        log_message("ERROR", f"Could not build the EPG for {client_address}: {e}")
+        body = None
+    if body is None:
+        # Without a guide of its own the proxy sends players to the full one
+        try:
+            location = playlist_index().epg_url
+        except (OSError, ValueError, KeyError):
+            return await send_local_response(client, request, version, "404 Not Found", 'text/plain', b'')
+        return await send_local_response(client, request, version, "302 Found", 'text/plain', b'',
+                                         [('Location', location)])
+    return await send_local_response(client, request, version, "200 OK", 'application/gzip', body)
+
+def lazy_authenticator():
+    """Returns this process's LazyAuthenticator, creating it on first use."""
+    global LAZY_AUTHENTICATOR
+    with LAZY_AUTHENTICATOR_LOCK:
+        if LAZY_AUTHENTICATOR is None:
+            # Imported here so the proxy alone needs none of the channel scripts
+            from lazy_auth import LazyAuthenticator
+            LAZY_AUTHENTICATOR = LazyAuthenticator()
+    return LAZY_AUTHENTICATOR
+
+def mirror_router():
+    """Returns this process's MirrorRouter, reading which servers carry which channel on first use."""
+    global MIRROR_ROUTER
+    with MIRROR_ROUTER_LOCK:
+        if MIRROR_ROUTER is None:
+            # Imported here so the proxy alone needs none of the channel scripts
+            from playlist import channel_servers
+            MIRROR_ROUTER = MirrorRouter(HEALTH, channel_servers())
+    return MIRROR_ROUTER
+
+def start_health_prober():
+    """Starts probing upstream hosts in this process when mirror routing is enabled."""
+    if MIRRORS_ENABLED:
+        HealthProber(HEALTH).start()
+
+async def authenticate_channel(path, client_address):
+    """Authenticates the channel a request is for before it is forwarded, if it is not already."""
+    authenticator = lazy_authenticator()
+    channel_id = authenticator.channel_of(path)
+    if channel_id is None:
+        return
+    try:
+        outcome = await authenticator.ensure(channel_id)
+    except Exception as e:
+        log_message("ERROR", f"Authenticating premium{channel_id} for {client_address} failed: {e}")
+        return
+    if outcome == 'failed':
+        log_message("WARNING", f"Could not authenticate premium{channel_id} for {client_address}, forwarding anyway")
+    elif outcome != 'valid':
+        log_message("INFO", f"Authenticated premium{channel_id} on demand for {client_address} ({outcome})")
+
+def is_cacheable_request(request, method, request_framing):
+    """Returns True if a response to request may be served from or stored in the HLS cache."""
+    return (HLS_CACHE_ENABLED and method == 'GET' and request_framing == 'none'
+            and request.get_header('Range') is None and request.get_header('Authorization') is None)
+
+async def fetch_cacheable_response(head, host, port):
+    """Fetches a complete response for the HLS cache, raising UncacheableResponse if the body is too large."""
+    upstream, response, status, response_framing, response_length = await send_upstream_request(
+        None, head, 'GET', 'none', 0, host, port)
+    try:
+        body = await read_body(upstream, response_framing, response_length, HLS_CACHE.max_object_size)
+    except BaseException:
+        upstream.sock.close()
+        raise
+    if body is None:
+        upstream.sock.close()
+        raise UncacheableResponse(f"body larger than {HLS_CACHE.max_object_size} bytes")
+    if response_framing != 'close' and keeps_alive(response, response.start_line.split(' ', 1)[0]) and not upstream.buffer:
+        UPSTREAM_POOL.release(host, port, upstream.sock)
+    else:
+        upstream.sock.close()
+    skipped = CACHE_SKIPPED_HEADERS | response.connection_tokens()
+    headers = [(name, value) for name, value in response.headers if name.lower() not in skipped]
+    return CachedResponse(response.start_line, headers, body)
+
+async def send_cached_response(client, client_address, request, version, cached, source):
+    """Sends a response held by the HLS cache, returns True if the client connection can be reused."""
+    client_reusable = keeps_alive(request, version)
+    extra_headers = [('Content-Length', str(len(cached.body))), ('X-Cache', source.upper())]
+    if not client_reusable:
+        extra_headers.append(('Connection', 'close'))
+    elif version == 'HTTP/1.0':
+        extra_headers.append(('Connection', 'keep-alive'))
+    if source != 'miss':
+        log_message("DEBUG", f"Serving cached response ({source}) to {client_address}")
+    head = HttpMessage(cached.status_line, cached.headers).serialize(extra_headers)
+    try:
+        await client.sendall(head + cached.body)
+    except (PeerTimeout, OSError) as e:
+        log_message("WARNING", f"Cached response to {client_address} aborted: {e}")
+        return False
+    return client_reusable
+
+async def relay_upgrade_request(client, client_address, request, host_header, host, port):
+    """Forwards a protocol switch request (e.g. WebSocket) and relays both directions raw."""
+    upstream_socket = await UPSTREAM_POOL.connect(host, port)
+    try:
+        head = request.serialize(host_header + [('Connection', 'Upgrade'), ('Upgrade', request.get_header('Upgrade'))])
+        upstream = SocketStream(upstream_socket, 'upstream', UPSTREAM_READ_TIMEOUT)
+        await upstream.sendall(head + bytes(client.buffer)) # Anything the client already sent past the head
+        client.buffer.clear()
+        log_message("INFO", f"Relaying {request.get_header('Upgrade')} upgrade from {client_address} to {host}:{port}")
+        await relay_data_async(asyncio.get_running_loop(), client.sock, upstream_socket,
+                               SHAPER.open_flow(client_address[0], host))
+    finally:
+        close_socket(upstream_socket)
+
 # --- Proxy Handler for each client ---
 def handle_client(client_socket, client_address):
     """Handles a single client connection."""
-    log_message("INFO", f"Handling connection from {client_address[0]}:{client_address[1]}")
+    METRICS.connection_accepted()
+    log_message("DEBUG", f"Handling connection from {client_address[0]}:{client_address[1]}")
     remote_socket = None
+    host, port = None, None
     try:
-        # Receive the first chunk of data to determine request type
-        first_data = client_socket.recv(BUFFER_SIZE)
-        if not first_data:
-            log_message("WARNING", "Client sent no initial data.")
+        # The request head is read the same way as in async mode, on a loop owned by this thread
+        client_socket.setblocking(False)
+        client = SocketStream(client_socket, 'client', CLIENT_KEEPALIVE_TIMEOUT)
+        request = asyncio.run(read_request(client, client_address))
+        if request is None:
+            log_message("DEBUG", f"Client {client_address} sent no request")
             return
 
-        method, host, port, path = parse_http_request(first_data)
+        method, host, port, path = parse_http_request(request)
 
-        if not host or not port:
-            log_message("ERROR", f"Could not determine destination for request from {client_address}: {first_data[:50]}...")
-            client_socket.sendall(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+        if method != 'CONNECT':
+            asyncio.run(serve_http_connection(client, client_address, request))
             return
 
-        remote_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        remote_socket.settimeout(5) # Set a timeout for connecting to the remote server
-        remote_socket.connect((host, port))
-        log_message("INFO", f"Connected to destination {host}:{port}")
-
-        if method == 'CONNECT':
-            # For HTTPS, respond with 200 OK to the client
-            client_socket.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
-            log_message("INFO", f"Sent 200 OK to {client_address} for CONNECT")
-            # Now, simply relay data between client and remote server
-            relay_data(client_socket, remote_socket)
-        else:
-            # For HTTP, forward the original request (potentially modified for Host header)
-            # Reconstruct the request to ensure it's sent correctly to the origin server
-            # For HTTP/1.1 proxies usually send only the path, but keep Host header
-            # For this simple proxy, we'll strip the http://host:port from the URL if present
-            # and send the modified request.
-            modified_request = first_data
-            if path and path.startswith('http://'):
-                # Android TV might send full URLs even when proxy is used.
-                # Remove the scheme and host:port part from the request line.
-                first_line = modified_request.decode('latin-1').splitlines()[0]
-                new_first_line = first_line.replace(f" {method} {path}", f" {method} {path.split('//')[1].split('/', 1)[-1]}")
-                modified_request = new_first_line.encode('latin-1') + modified_request.decode('latin-1').split('\r\n', 1)[1].encode('latin-1')
-
-            log_message("INFO", f"Forwarding HTTP request to {host}:{port}")
-            remote_socket.sendall(modified_request)
-            relay_data(client_socket, remote_socket)
+        client_socket.setblocking(True)
+        if not host:
+            log_message("ERROR", f"Could not determine destination for request from {client_address}: {request.start_line[:50]}")
+            METRICS.count_error('bad_request')
+            client_socket.sendall(status_response("400 Bad Request"))
+            return
+
+        remote_socket = asyncio.run(UPSTREAM_POOL.connect(host, port)) # Uses CONNECT_TIMEOUT and the DNS cache
+        remote_socket.setblocking(True)
+        log_message("DEBUG", f"Connected to destination {host}:{port}")
+
+        # For HTTPS, respond with 200 OK to the client
+        client_socket.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        log_message("DEBUG", f"Sent 200 OK to {client_address} for CONNECT")
+        if client.buffer:
+            remote_socket.sendall(client.buffer) # Data the client sent right behind the CONNECT head
+        # Now, simply relay data between client and remote server
+        relay_data(client_socket, remote_socket, SHAPER.open_flow(client_address[0], host))
 
     except socket.timeout:
         log_message("ERROR", f"Connection to {host}:{port} timed out from {client_address}")
+        METRICS.count_error('timeout')
         client_socket.sendall(b"HTTP/1.1 504 Gateway Timeout\r\n\r\n")
     except ConnectionRefusedError:
         log_message("ERROR", f"Connection refused by {host}:{port} for {client_address}")
+        METRICS.count_error('refused')
         client_socket.sendall(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
     except socket.gaierror:
         log_message("ERROR", f"Could not resolve host {host} for {client_address}")
+        METRICS.count_error('gaierror')
         client_socket.sendall(b"HTTP/1.1 504 Gateway Timeout\r\n\r\n")
     except OSError as e:
         log_message("ERROR", f"OS Error during client handling for {client_address}: {e}")
+        METRICS.count_error('os_error')
     except Exception as e:
         log_message("ERROR", f"Unhandled error in handle_client for {client_address}: {e}")
+        METRICS.count_error('unhandled')
     finally:
-        log_message("INFO", f"Closing connection from {client_address}")
+        log_message("DEBUG", f"Closing connection from {client_address}")
         if client_socket:
             try:
                 client_socket.shutdown(socket.SHUT_RDWR)
@@ -192,7 +761,7 @@ def handle_client(client_socket, client_address):
 # --- Main Proxy Server ---
 def start_proxy_server(host, port):
     """Starts the main proxy server."""
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
     try:
@@ -206,6 +775,7 @@ def start_proxy_server(host, port):
     while True:
         try:
             client_socket, client_address = server_socket.accept()
+            tune_socket(client_socket)
             client_handler = threading.Thread(
                 target=handle_client,
                 args=(client_socket, client_address)
@@ -220,6 +790,324 @@ def start_proxy_server(host, port):
 
     server_socket.close()
 
+# --- Event-Loop Proxy Server ---
+def close_socket(sock):
+    """Shuts down and closes a socket, ignoring errors from already closed sockets."""
+    if sock:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass # Socket might already be disconnected
+        try:
+            sock.close()
+        except OSError:
+            pass # Socket might already be closed
+
+async def wait_for_fd(loop, fd, writable=False):
+    """Waits until a file descriptor is readable (or writable) on the event loop."""
+    future = loop.create_future()
+    add, remove = (loop.add_writer, loop.remove_writer) if writable else (loop.add_reader, loop.remove_reader)
+    add(fd, lambda: future.done() or future.set_result(None))
+    try:
+        await future
+    finally:
+        remove(fd)
+
+async def pump_splice_async(loop, source_socket, destination_socket, direction, flow=None):
+    """Moves data from source_socket to destination_socket through a kernel pipe until EOF."""
+    try:
+        pipe_read, pipe_write = open_splice_pipe()
+    except OSError as e:
+        # Typically EMFILE: every spliced tunnel costs two pipes (four descriptors)
+        log_message("WARNING", f"Could not create splice pipe, relaying with buffers instead: {e}")
+        await pump_buffer_async(loop, source_socket, destination_socket, direction, flow)
+        return
+    source_fd, destination_fd = source_socket.fileno(), destination_socket.fileno()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    chunk_size = relay_chunk_size(flow)
+    try:
+        while True:
+            try:
+                pending = os.splice(source_fd, pipe_write, chunk_size, flags=flags)
+            except BlockingIOError:
+                await wait_for_fd(loop, source_fd)
+                continue
+            if not pending:
+                return # Peer disconnected
+            METRICS.add_bytes(direction, pending)
+            await pace_async(flow, pending)
+            while pending:
+                try:
+                    pending -= os.splice(pipe_read, destination_fd, pending, flags=flags)
+                except BlockingIOError:
+                    await wait_for_fd(loop, destination_fd, writable=True)
+    finally:
+        os.close(pipe_read)
+        os.close(pipe_write)
+
+async def pump_buffer_async(loop, source_socket, destination_socket, direction, flow=None):
+    """Copies data through one reusable buffer from source_socket to destination_socket until EOF."""
+    buffer = bytearray(relay_chunk_size(flow))
+    view = memoryview(buffer)
+    while True:
+        received = await loop.sock_recv_into(source_socket, buffer)
+        if not received:
+            return # Peer disconnected
+        METRICS.add_bytes(direction, received)
+        await pace_async(flow, received)
+        await loop.sock_sendall(destination_socket, view[:received])
+
+async def pump_async(loop, source_socket, destination_socket, direction, flow=None):
+    """Copies data from source_socket to destination_socket until EOF."""
+    while True:
+        data = await loop.sock_recv(source_socket, BUFFER_SIZE)
+        if not data:
+            return # Peer disconnected
+        METRICS.add_bytes(direction, len(data))
+        await pace_async(flow, len(data))
+        await loop.sock_sendall(destination_socket, data)
+
+ASYNC_PUMPS = {
+    'splice': pump_splice_async,
+    'buffer': pump_buffer_async,
+    'copy': pump_async,
+}
+
+async def relay_data_async(loop, source_socket, destination_socket, flow=None):
+    """Relays data between two non-blocking sockets on the event loop, paced by an optional ShapedFlow."""
+    pump = ASYNC_PUMPS[get_relay_mode()]
+    tasks = [
+        asyncio.ensure_future(pump(loop, source_socket, destination_socket, 'upstream', flow)),
+        asyncio.ensure_future(pump(loop, destination_socket, source_socket, 'downstream', flow)),
+    ]
+    METRICS.tunnel_opened()
+    try:
+        # Like relay_data, the tunnel ends as soon as either side disconnects
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if isinstance(error, OSError):
+                log_message("WARNING", f"Socket error during data relay: {error}")
+            elif error is not None:
+                log_message("ERROR", f"Unexpected error during data relay: {error}")
+    finally:
+        METRICS.tunnel_closed()
+        if flow is not None:
+            flow.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def send_error_async(loop, client_socket, response):
+    """Sends an error response to the client, ignoring clients that already left."""
+    try:
+        await loop.sock_sendall(client_socket, response)
+    except OSError:
+        pass # Client already disconnected
+
+async def handle_client_async(loop, client_socket, client_address):
+    """Handles a single client connection on the event loop."""
+    METRICS.connection_accepted()
+    log_message("DEBUG", f"Handling connection from {client_address[0]}:{client_address[1]}")
+    remote_socket = None
+    host, port = None, None
+    try:
+        client = SocketStream(client_socket, 'client', CLIENT_KEEPALIVE_TIMEOUT)
+        request = await read_request(client, client_address)
+        if request is None:
+            log_message("DEBUG", f"Client {client_address} sent no request")
+            return
+
+        method, host, port, path = parse_http_request(request)
+
+        if method != 'CONNECT':
+            # Plain HTTP requests are framed and forwarded through the upstream keep-alive pool
+            await serve_http_connection(client, client_address, request)
+            return
+
+        if not host:
+            log_message("ERROR", f"Could not determine destination for request from {client_address}: {request.start_line[:50]}")
+            METRICS.count_error('bad_request')
+            await send_status(client, "400 Bad Request")
+            return
+
+        remote_socket = await UPSTREAM_POOL.connect(host, port)
+        log_message("DEBUG", f"Connected to destination {host}:{port}")
+
+        await loop.sock_sendall(client_socket, b"HTTP/1.1 200 Connection established\r\n\r\n")
+        log_message("DEBUG", f"Sent 200 OK to {client_address} for CONNECT")
+        if client.buffer:
+            await loop.sock_sendall(remote_socket, client.buffer) # Data the client sent right behind the CONNECT head
+        await relay_data_async(loop, client_socket, remote_socket, SHAPER.open_flow(client_address[0], host))
+
+    except (asyncio.TimeoutError, socket.timeout):
+        log_message("ERROR", f"Connection to {host}:{port} timed out from {client_address}")
+        METRICS.count_error('timeout')
+        await send_error_async(loop, client_socket, b"HTTP/1.1 504 Gateway Timeout\r\n\r\n")
+    except ConnectionRefusedError:
+        log_message("ERROR", f"Connection refused by {host}:{port} for {client_address}")
+        METRICS.count_error('refused')
+        await send_error_async(loop, client_socket, b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
+    except socket.gaierror:
+        log_message("ERROR", f"Could not resolve host {host} for {client_address}")
+        METRICS.count_error('gaierror')
+        await send_error_async(loop, client_socket, b"HTTP/1.1 504 Gateway Timeout\r\n\r\n")
+    except OSError as e:
+        log_message("ERROR", f"OS Error during client handling for {client_address}: {e}")
+        METRICS.count_error('os_error')
+    except Exception as e:
+        log_message("ERROR", f"Unhandled error in handle_client_async for {client_address}: {e}")
+        METRICS.count_error('unhandled')
+    finally:
+        log_message("DEBUG", f"Closing connection from {client_address}")
+        close_socket(client_socket)
+        close_socket(remote_socket)
+
+def create_listen_socket(host, port, reuse_port=False):
+    """Creates a non-blocking listening socket, optionally shared through SO_REUSEPORT."""
+    server_socket = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker binds its own socket and the kernel load-balances accepts across them
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(LISTEN_BACKLOG)
+    server_socket.setblocking(False)
+    return server_socket
+
+async def serve_async(host, port, reuse_port=False):
+    """Accepts connections and multiplexes every tunnel on a single event loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        server_socket = create_listen_socket(host, port, reuse_port)
+        log_message("INFO", f"Proxy server (pid {os.getpid()}) listening on {host}:{port} in async mode")
+    except Exception as e:
+        log_message("CRITICAL", f"Failed to start server: {e}")
+        sys.exit(1)
+
+    client_tasks = set() # Strong references so running handlers are not garbage collected
+    try:
+        while True:
+            try:
+                client_socket, client_address = await loop.sock_accept(server_socket)
+            except OSError as e:
+                log_message("ERROR", f"Error accepting new connection: {e}")
+                continue
+            client_socket.setblocking(False)
+            tune_socket(client_socket)
+            task = loop.create_task(handle_client_async(loop, client_socket, client_address))
+            client_tasks.add(task)
+            task.add_done_callback(client_tasks.discard)
+    finally:
+        server_socket.close()
+
+def apply_settings(settings):
+    """Overrides configuration constants of this module, e.g. from the config file or the command line."""
+    globals().update(settings)
+    # Objects built from the constants at import time pick up the new values
+    UPSTREAM_POOL.connect_timeout = CONNECT_TIMEOUT
+    SHAPER.configure(CLIENT_RATE_LIMIT, HOST_RATE_LIMIT, TOTAL_RATE_LIMIT)
+
+def load_config(file_path):
+    """Returns the configuration constants a JSON config file overrides, {} if the file does not exist."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(config, dict):
+        raise ValueError(f"{file_path} must hold a JSON object of setting names and values")
+    for name, value in config.items():
+        default = globals().get(name)
+        if not name.isupper() or not isinstance(default, (bool, int, float, str)):
+            raise ValueError(f"{file_path}: unknown setting {name}")
+        # JSON has no separate int and float, but a number must not stand in for a bool or a string
+        if type(value) is not type(default) and not (type(default) is float and type(value) is int):
+            raise ValueError(f"{file_path}: {name} must be of type {type(default).__name__}, not {value!r}")
+    return config
+
+def run_event_loop_worker(host, port, reuse_port, settings):
+    """Runs one event-loop worker until interrupted."""
+    # Worker processes do not inherit overrides made in the parent under the spawn/forkserver start methods
+    apply_settings(settings)
+    setup_logging(LOG_LEVEL)
+    start_health_prober()
+    try:
+        asyncio.run(serve_async(host, port, reuse_port))
+    except KeyboardInterrupt:
+        log_message("INFO", f"Proxy worker {os.getpid()} shutting down...")
+
+def start_event_loop_server(host, port, workers=WORKERS, settings=None):
+    """Starts the event-loop proxy with one or more worker processes."""
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        log_message("WARNING", "SO_REUSEPORT is not available on this platform, running a single worker.")
+        workers = 1
+    if workers <= 1:
+        run_event_loop_worker(host, port, False, settings or {})
+        return
+
+    processes = []
+    for _ in range(workers):
+        process = multiprocessing.Process(target=run_event_loop_worker, args=(host, port, True, settings or {}))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log_message("INFO", "Proxy server shutting down...")
+        for process in processes:
+            process.terminate()
+
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Python Forward Proxy")
+    parser.add_argument('--config', default=CONFIG_FILE,
+                        help=f"JSON file overriding the configuration constants, options below override it (default: {CONFIG_FILE})")
+    parser.add_argument('--host', default=HOST, help=f"Address to listen on (default: {HOST})")
+    parser.add_argument('--port', type=int, default=PORT, help=f"Port to listen on (default: {PORT})")
+    parser.add_argument('--mode', choices=['async', 'threaded'], default=SERVER_MODE,
+                        help=f"Connection handling model (default: {SERVER_MODE})")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help=f"Event-loop worker processes in async mode (default: {WORKERS})")
+    parser.add_argument('--relay', choices=['splice', 'buffer', 'copy'], default=RELAY_MODE,
+                        help=f"How tunnel bytes are moved between sockets (default: {RELAY_MODE})")
+    parser.add_argument('--hls-cache', action='store_true', default=HLS_CACHE_ENABLED,
+                        help="Cache plain HTTP playlists, keys and segments shared by several clients")
+    parser.add_argument('--lazy-auth', action='store_true', default=LAZY_AUTH_ENABLED,
+                        help="Authenticate channels when they are first played instead of all up front")
+    parser.add_argument('--mirrors', action='store_true', default=MIRRORS_ENABLED,
+                        help="Probe upstream hosts and send plain HTTP channel requests to the fastest healthy edge server")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default=LOG_LEVEL,
+                        help=f"Lowest level of messages printed (default: {LOG_LEVEL})")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Keep channel signatures activated from a background scheduler in this process")
+    parser.add_argument('--refresh-concurrency', type=int, default=REFRESH_CONCURRENCY,
+                        help=f"Requests the refresh scheduler runs at once (default: {REFRESH_CONCURRENCY})")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    # The config file is applied first, so its values become the defaults of the other options
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument('--config', default=CONFIG_FILE)
+    try:
+        config = load_config(config_parser.parse_known_args()[0].config)
+    except (OSError, ValueError) as e: # json.JSONDecodeError is a ValueError
+        sys.exit(f"Invalid config file: {e}")
+    apply_settings(config)
+    args = parse_arguments()
+    settings = {**config, 'RELAY_MODE': args.relay, 'HLS_CACHE_ENABLED': args.hls_cache, 'LAZY_AUTH_ENABLED': args.lazy_auth,
+                'MIRRORS_ENABLED': args.mirrors, 'LOG_LEVEL': args.log_level}
+    apply_settings(settings)
+    setup_logging(LOG_LEVEL)
     log_message("INFO", "Starting Python Forward Proxy")
-    start_proxy_server(HOST, PORT)
+    if args.refresh:
+        # Imported here so the proxy alone needs none of the channel scripts
+        from refresh_scheduler import RefreshScheduler
+        RefreshScheduler(concurrency=args.refresh_concurrency, snapshot=True).start()
+    if args.mode == 'threaded':
+        start_health_prober()
+        start_proxy_server(args.host, args.port)
+    else:
+        start_event_loop_server(args.host, args.port, args.workers, settings)
@@ -1,58 +1,111 @@
-import subprocess
-import re
+import argparse
 import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# List of input files containing channel IDs
-input_files = ['nfs.txt', 'wind.txt', 'zeko.txt', 'dokko1.txt', 'rf.txt']
+from channel_auth import AUTH_VARIABLE_PATTERN, iter_channel_auth, iter_channel_auth_file
+from http_client import RATE_LIMIT, HttpClient
 
-# Clear or create channelAuth.txt
-with open('channelAuth.txt', 'w') as f:
-    f.write('')
+# --- Configuration ---
+INPUT_FILES = ['nfs.txt', 'wind.txt', 'zeko.txt', 'dokko1.txt', 'rf.txt'] # Files containing channel IDs
+OUTPUT_FILE = 'channelAuth.txt'
+AUTH_PAGE_URL = "https://lefttoplay.xyz/premiumtv/daddylivehd.php?id={channel_id}"
+REQUEST_HEADERS = {
+    'Origin': "https://allupplay.xyz",
+    'Referer': "https://allupplay.xyz/",
+}
+CONCURRENCY = 16 # Channel pages fetched at the same time
 
 # Function to extract numbers from premiumXXXX
 def extract_channel_id(line):
     match = re.search(r'premium(\d+)', line)
     return match.group(1) if match else None
 
-# Function to parse channelAuth.txt and extract variables
+# Function to parse channelAuth.txt into {channel_id: ChannelAuth}
 def parse_channel_auth():
-    channel_data = {}
-    current_id = None
-    with open('channelAuth.txt', 'r') as f:
-        for line in f:
-            line = line.strip()
-            if 'var channelKey' in line:
-                match = re.search(r'var channelKey = "premium(\d+)"', line)
-                if match:
-                    current_id = match.group(1)
-                    channel_data[current_id] = {}
-            elif current_id and 'var __c' in line:
-                match = re.search(r'var __c = "(\d+)"', line)
-                if match:
-                    channel_data[current_id]['__c'] = match.group(1)
-            elif current_id and 'var __d' in line:
-                match = re.search(r'var __d = "(\d+)"', line)
-                if match:
-                    channel_data[current_id]['__d'] = match.group(1)
-            elif current_id and 'var __e' in line:
-                match = re.search(r'var __e = "([a-f0-9]+)"', line)
-                if match:
-                    channel_data[current_id]['__e'] = match.group(1)
-    return channel_data
-
-# Step 1: Execute first curl command for each channel ID
-for file_name in input_files:
-    if os.path.exists(file_name):
+    return {channel.channel_id: channel for channel in iter_channel_auth_file(OUTPUT_FILE)}
+
+def read_channel_ids(file_names):
+    """Returns the channel IDs listed in the input files, in file order and without duplicates."""
+    channel_ids = []
+    seen = set()
+    for file_name in file_names:
+        if not os.path.exists(file_name):
+            print(f"File {file_name} not found.")
+            continue
         with open(file_name, 'r') as f:
             for line in f:
                 channel_id = extract_channel_id(line.strip())
-                if channel_id:
-                    curl_cmd = (
-                        f'curl -i -H "user-agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:139.0) Gecko/20100101 Firefox/139.0" '
-                        f'-H "origin: https://allupplay.xyz" -H "referer: https://allupplay.xyz/" '
-                        f'"https://lefttoplay.xyz/premiumtv/daddylivehd.php?id={channel_id}" | '
-                        f'grep -E "var channelKey|var __c|var __d|var __e" >>channelAuth.txt'
-                    )
-                    subprocess.run(curl_cmd, shell=True)
-    else:
-        print(f"File {file_name} not found.")
+                if channel_id and channel_id not in seen:
+                    seen.add(channel_id)
+                    channel_ids.append(channel_id)
+    return channel_ids
+
+def fetch_channel_auth(client, channel_id):
+    """Fetches the channel page and returns its auth block lines, or an error message string."""
+    try:
+        response = client.request('GET', AUTH_PAGE_URL.format(channel_id=channel_id), REQUEST_HEADERS)
+    except Exception as e:
+        return f"request failed: {e}"
+    if response.status != 200:
+        return f"HTTP {response.status} {response.reason} after {response.attempts} attempt(s)"
+    lines = [line for line in response.body.decode('utf-8', 'replace').splitlines() if AUTH_VARIABLE_PATTERN.search(line)]
+    errors = []
+    if not any(iter_channel_auth(lines, lambda channel_key, message: errors.append(message))):
+        return errors[0] if errors else "no auth variables in the page"
+    return lines
+
+def write_atomically(file_path, lines):
+    """Writes lines to file_path through a temporary file, so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path))
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def harvest_channel_auth(channel_ids, concurrency=CONCURRENCY, rate_limit=RATE_LIMIT):
+    """Fetches every channel concurrently, returns (auth lines in channel order, {channel_id: error})."""
+    client = HttpClient(REQUEST_HEADERS, rate_limit=rate_limit)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda channel_id: fetch_channel_auth(client, channel_id), channel_ids))
+    finally:
+        client.close()
+    auth_lines = []
+    failures = {}
+    for channel_id, result in zip(channel_ids, results):
+        if isinstance(result, str):
+            failures[channel_id] = result
+        else:
+            auth_lines.extend(result)
+    return auth_lines, failures
+
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Fetch the auth variables of every channel")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help=f"Channel pages fetched at the same time (default: {CONCURRENCY})")
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT,
+                        help=f"Requests per second to each host, 0 for no limit (default: {RATE_LIMIT})")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    channel_ids = read_channel_ids(INPUT_FILES)
+    started = time.monotonic()
+    auth_lines, failures = harvest_channel_auth(channel_ids, args.concurrency, args.rate_limit)
+    write_atomically(OUTPUT_FILE, auth_lines)
+    for channel_id, error in failures.items():
+        print(f"Warning: premium{channel_id}: {error}")
+    print(f"Fetched {len(channel_ids) - len(failures)} of {len(channel_ids)} channels into '{OUTPUT_FILE}' "
+          f"in {time.monotonic() - started:.1f}s.")
+
+if __name__ == "__main__":
+    main()
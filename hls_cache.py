@@ -0,0 +1,156 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# --- Configuration ---
+CACHE_MAX_BYTES = 256 * 1024 * 1024 # Total body bytes kept across all cached objects
+CACHE_MAX_OBJECT_SIZE = 16 * 1024 * 1024 # Larger responses are passed through uncached
+PLAYLIST_TTL = 2        # Seconds a live playlist is cached when it has no EXT-X-TARGETDURATION
+PLAYLIST_TTL_MAX = 6    # Upper bound for live playlists, whatever their target duration
+VOD_PLAYLIST_TTL = 300  # Seconds a playlist with EXT-X-ENDLIST is cached
+KEY_TTL = 300           # Seconds an AES key is cached
+SEGMENT_TTL = 120       # Seconds a media segment is cached (segments never change once published)
+
+KEY_HOSTS = {'key2.keylocking.ru'} # Hosts serving the #EXT-X-KEY URIs of tivimate_playlist.m3u8
+SEGMENT_EXTENSIONS = ('.ts', '.aac', '.m4s', '.mp4', '.m4a', '.vtt')
+
+TARGET_DURATION_PATTERN = re.compile(rb'#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)')
+
+class UncacheableResponse(Exception):
+    """Raised by a fetch function when the response must be served without caching."""
+
+class CachedResponse:
+    """A complete upstream response kept in memory."""
+
+    def __init__(self, status_line, headers, body):
+        self.status_line = status_line
+        self.headers = headers # List of (name, value) pairs without framing headers
+        self.body = body
+
+    @property
+    def status(self):
+        """Returns the numeric status code."""
+        return int(self.status_line.split(' ', 2)[1])
+
+def classify(host, path):
+    """Returns 'playlist', 'key', 'segment' or None for a request that is not cacheable."""
+    path_only = path.split('?', 1)[0].lower()
+    if host in KEY_HOSTS or path_only.endswith('.key'):
+        return 'key'
+    if path_only.endswith(('.m3u8', '.m3u')):
+        return 'playlist'
+    if path_only.endswith(SEGMENT_EXTENSIONS):
+        return 'segment'
+    return None
+
+def time_to_live(kind, response):
+    """Returns how many seconds a response of the given kind may be served from the cache."""
+    cache_control = ''
+    for name, value in response.headers:
+        if name.lower() == 'cache-control':
+            cache_control += value.lower()
+    if 'no-store' in cache_control or 'private' in cache_control:
+        return 0
+    if kind == 'key':
+        return KEY_TTL
+    if kind == 'segment':
+        return SEGMENT_TTL
+    if b'#EXT-X-ENDLIST' in response.body:
+        return VOD_PLAYLIST_TTL
+    match = TARGET_DURATION_PATTERN.search(response.body)
+    if not match:
+        return PLAYLIST_TTL
+    # A live playlist changes at most once per target duration, half of it keeps clients in step
+    return min(PLAYLIST_TTL_MAX, float(match.group(1)) / 2)
+
+class HlsCache:
+    """Byte-capped LRU cache of playlists, keys and segments with request coalescing.
+
+    Safe to share between event loops running in different threads: in-flight fetches are
+    tracked with concurrent.futures.Future objects that every loop can await.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_object_size=CACHE_MAX_OBJECT_SIZE):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.entries = OrderedDict() # key -> (expires_at, CachedResponse), least recently used first
+        self.in_flight = {} # key -> Future of the running upstream fetch
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        """Returns a fresh cached response or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self.remove_locked(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, response, ttl):
+        """Stores a response for ttl seconds, evicting least recently used entries beyond max_bytes."""
+        size = len(response.body)
+        if ttl <= 0 or size > self.max_object_size:
+            return
+        with self.lock:
+            self.remove_locked(key)
+            self.entries[key] = (time.monotonic() + ttl, response)
+            self.size += size
+            while self.size > self.max_bytes and self.entries:
+                self.remove_locked(next(iter(self.entries)))
+
+    def remove_locked(self, key):
+        """Drops an entry, the caller holds the lock."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1].body)
+
+    async def get_or_fetch(self, key, kind, fetch):
+        """Returns (response, source) where source is 'hit', 'miss' or 'coalesced'.
+
+        fetch is a coroutine function returning a CachedResponse. Concurrent misses for the same
+        key wait for the first caller's fetch instead of going upstream themselves.
+        """
+        response = self.get(key)
+        if response is not None:
+            with self.lock:
+                self.hits += 1
+            return response, 'hit'
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return await asyncio.wrap_future(future), 'coalesced'
+
+        try:
+            response = await fetch()
+        except BaseException as e:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                e = ConnectionAbortedError("The shared upstream fetch was cancelled")
+            future.set_exception(e)
+            future.exception() # Mark as retrieved when nobody else was waiting
+            raise
+        if response.status == 200:
+            self.put(key, response, time_to_live(kind, response))
+        with self.lock:
+            self.in_flight.pop(key, None)
+        future.set_result(response)
+        return response, 'miss'
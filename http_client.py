@@ -0,0 +1,117 @@
+import http.client
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# --- Configuration ---
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:139.0) Gecko/20100101 Firefox/139.0"
+REQUEST_TIMEOUT = 10  # Seconds allowed for connecting and for each read
+MAX_ATTEMPTS = 3      # Tries per request before giving up
+BACKOFF_BASE = 0.5    # Seconds slept before the first retry, doubled on every further retry
+RATE_LIMIT = 20       # Requests started per second and host, 0 disables the limit
+RETRY_STATUSES = {429, 500, 502, 503, 504} # Responses worth retrying, anything else is final
+
+class HttpResponse:
+    """Status, headers and body of a finished request, plus how it went."""
+
+    def __init__(self, status, reason, headers, body, attempts, latency):
+        self.status = status
+        self.reason = reason
+        self.headers = headers # http.client.HTTPMessage
+        self.body = body
+        self.attempts = attempts
+        self.latency = latency # Seconds spent on the last attempt
+
+class HostRateLimiter:
+    """Spaces out request starts per host so no host sees more than `rate` requests a second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = {} # host -> monotonic time of the next free slot
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        """Blocks until a request to host may start."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class HttpClient:
+    """Thread-safe HTTP(S) client keeping one keep-alive connection per thread and host.
+
+    Meant to be shared by the threads of a ThreadPoolExecutor: every thread reuses its own
+    connections, so a pool of N threads holds at most N connections to each host.
+    """
+
+    def __init__(self, headers=None, timeout=REQUEST_TIMEOUT, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, rate_limit=RATE_LIMIT):
+        self.headers = {'User-Agent': USER_AGENT}
+        self.headers.update(headers or {})
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.local = threading.local()
+        self.all_connections = [] # Every connection opened by any thread, for close()
+        self.lock = threading.Lock()
+
+    def connection(self, scheme, netloc):
+        """Returns this thread's connection to scheme://netloc, opening it if needed."""
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = connection
+            with self.lock:
+                self.all_connections.append(connection)
+        return connection
+
+    def request(self, method, url, headers=None):
+        """Performs a request with retries, returns the final HttpResponse.
+
+        Network errors and RETRY_STATUSES responses are retried with exponential backoff; the
+        last error is raised if every attempt failed without a response.
+        """
+        parts = urlsplit(url)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.wait(parts.hostname)
+            connection = self.connection(parts.scheme, parts.netloc)
+            started = time.monotonic()
+            try:
+                connection.request(method, target, headers=request_headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close() # Reopened on the next attempt
+                if attempt == self.max_attempts:
+                    raise
+            else:
+                if response.will_close:
+                    connection.close()
+                result = HttpResponse(response.status, response.reason, response.headers, body,
+                                      attempt, time.monotonic() - started)
+                if response.status not in RETRY_STATUSES or attempt == self.max_attempts:
+                    return result
+            # Jitter keeps a batch of failed requests from retrying in lockstep
+            time.sleep(self.backoff_base * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+    def close(self):
+        """Closes every connection opened by this client."""
+        with self.lock:
+            connections, self.all_connections = self.all_connections, []
+        for connection in connections:
+            connection.close()
@@ -0,0 +1,87 @@
+import asyncio
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import curl
+import generate_auth_list
+import pipeline
+from channel_state import REFRESH_MARGIN, STATE_FILE, ChannelStateStore
+from http_client import HttpClient
+
+# --- Configuration ---
+FAILURE_BACKOFF = 30 # Seconds before a channel that failed to authenticate is tried again
+
+CHANNEL_PATTERN = re.compile(r'premium(\d+)') # Stream paths (/zeko/premium51/mono.m3u8) and key URIs (name=premium51)
+
+def channel_from_path(path):
+    """Returns the channel ID a request path refers to, or None."""
+    match = CHANNEL_PATTERN.search(path)
+    return match.group(1) if match else None
+
+class LazyAuthenticator:
+    """Harvests and activates a channel the first time it is played, then remembers it until expiry.
+
+    Shared by every event loop and thread of a proxy process. Concurrent requests for a channel
+    that is not authenticated yet wait for one harvest+activation instead of each running their own.
+    """
+
+    def __init__(self, state_file=STATE_FILE, margin=REFRESH_MARGIN):
+        store = ChannelStateStore(state_file)
+        self.lifetime = store.lifetime()
+        self.margin = margin
+        self.valid_until = {} # channel_id -> epoch seconds after which the channel is authenticated again
+        self.failed_until = {} # channel_id -> epoch seconds before which a failed channel is not retried
+        # Channels a previous pipeline or refresh run left activated are reused until they expire
+        for channel_key, state in store.channels.items():
+            channel_id = channel_from_path(channel_key)
+            if channel_id and state.get('ok') and state.get('ts', '').isdigit():
+                self.valid_until[channel_id] = int(state['ts']) + self.lifetime - margin
+        self.in_flight = {} # channel_id -> Future of the running authentication
+        self.lock = threading.Lock()
+        self.harvest_client = HttpClient(generate_auth_list.REQUEST_HEADERS)
+        self.activation_client = HttpClient(curl.REQUEST_HEADERS, rate_limit=curl.RATE_LIMIT)
+
+    def channel_of(self, path):
+        """Returns the channel ID a proxied request path refers to, or None."""
+        return channel_from_path(path)
+
+    def authenticate(self, channel_id):
+        """Harvests and activates one channel (blocking), returns its pipeline.ChannelResult."""
+        result = pipeline.harvest_channel(self.harvest_client, channel_id)
+        if result.auth is not None:
+            pipeline.activate_channel(self.activation_client, 'HEAD', result)
+        return result
+
+    async def ensure(self, channel_id):
+        """Makes sure a channel is authenticated, returns 'valid', 'authenticated', 'coalesced' or 'failed'."""
+        now = time.time()
+        with self.lock:
+            if self.valid_until.get(channel_id, 0) > now:
+                return 'valid'
+            if self.failed_until.get(channel_id, 0) > now:
+                return 'failed'
+            future = self.in_flight.get(channel_id)
+            leader = future is None
+            if leader:
+                future = self.in_flight[channel_id] = Future()
+        if not leader:
+            return 'coalesced' if await asyncio.wrap_future(future) else 'failed'
+
+        activated = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, self.authenticate, channel_id)
+            activated = result.activated
+            with self.lock:
+                if activated:
+                    minted_at = int(result.auth.auth_ts) if result.auth.auth_ts.isdigit() else int(now)
+                    self.valid_until[channel_id] = minted_at + self.lifetime - self.margin
+                    self.failed_until.pop(channel_id, None)
+                else:
+                    self.failed_until[channel_id] = time.time() + FAILURE_BACKOFF
+        finally:
+            with self.lock:
+                self.in_flight.pop(channel_id, None)
+            future.set_result(activated)
+        return 'authenticated' if activated else 'failed'
@@ -0,0 +1,143 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import curl
+import generate_auth_list
+from channel_auth import iter_channel_auth
+from channel_state import REFRESH_MARGIN, SIGNATURE_LIFETIME, STATE_FILE, ChannelStateStore
+from generate_signature_urls import AUTH_BASE_URL
+from http_client import RATE_LIMIT, HttpClient
+
+# --- Configuration ---
+AUTH_SNAPSHOT_FILE = generate_auth_list.OUTPUT_FILE # channelAuth.txt
+SIGNATURE_SNAPSHOT_FILE = "signatureURLs.txt"
+HARVEST_CONCURRENCY = generate_auth_list.CONCURRENCY # Channel pages fetched at the same time
+ACTIVATION_CONCURRENCY = curl.CONCURRENCY # Signature URLs activated at the same time
+
+class ChannelResult:
+    """Everything the pipeline learned about one channel."""
+
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+        self.channel_key = f"premium{channel_id}"
+        self.lines = [] # Auth block lines as they appear in channelAuth.txt
+        self.auth = None # ChannelAuth once the page was fetched and parsed
+        self.url = None # Signature URL built from auth
+        self.activation = None # curl.activate_url() record once activated
+        self.error = None # Why the channel was not activated
+
+    @property
+    def activated(self):
+        """Returns True if the signature URL was accepted."""
+        return self.activation is not None and self.activation['status'] == 200
+
+def harvest_channel(client, channel_id):
+    """Fetches and parses one channel page, returns its ChannelResult with auth or error set."""
+    result = ChannelResult(channel_id)
+    lines = generate_auth_list.fetch_channel_auth(client, channel_id)
+    if isinstance(lines, str):
+        result.error = lines
+        return result
+    result.lines = lines
+    result.auth = next(iter_channel_auth(lines), None)
+    result.url = result.auth.signature_url(AUTH_BASE_URL)
+    return result
+
+def activate_channel(client, method, result):
+    """Activates a harvested channel's signature URL, returns the same ChannelResult."""
+    result.activation = curl.activate_url(client, method, result.url)
+    if not result.activated:
+        result.error = result.activation.get('error') or f"HTTP {result.activation['status']}"
+    curl.print_record(result.activation)
+    return result
+
+def run_pipeline(channel_ids, harvest_concurrency=HARVEST_CONCURRENCY,
+                 activation_concurrency=ACTIVATION_CONCURRENCY, rate_limit=RATE_LIMIT, method='HEAD'):
+    """Harvests, signs and activates every channel, streaming each one to activation as soon as
+    its page arrives. Returns the ChannelResults in channel_ids order."""
+    harvest_client = HttpClient(generate_auth_list.REQUEST_HEADERS, rate_limit=rate_limit)
+    activation_client = HttpClient(curl.REQUEST_HEADERS, rate_limit=curl.RATE_LIMIT)
+    try:
+        with ThreadPoolExecutor(max_workers=harvest_concurrency) as harvesters, \
+                ThreadPoolExecutor(max_workers=activation_concurrency) as activators:
+            harvests = [harvesters.submit(harvest_channel, harvest_client, channel_id) for channel_id in channel_ids]
+            activations = []
+            for future in as_completed(harvests):
+                result = future.result()
+                if result.auth is not None:
+                    activations.append(activators.submit(activate_channel, activation_client, method, result))
+                else:
+                    print(f"  FAILED. premium{result.channel_id}: {result.error}")
+            for future in activations:
+                future.result()
+        return [future.result() for future in harvests]
+    finally:
+        harvest_client.close()
+        activation_client.close()
+
+def record_results(store, results):
+    """Stores every channel's new signature and activation outcome in the state store."""
+    now = time.time()
+    for result in results:
+        store.record(result.channel_key, result.auth, result.activation, result.error, now)
+
+def select_stale_channels(store, channel_ids, lifetime=SIGNATURE_LIFETIME, margin=REFRESH_MARGIN):
+    """Returns the channels that failed last time, were never harvested or are about to expire."""
+    now = time.time()
+    return [channel_id for channel_id in channel_ids
+            if store.needs_refresh(f"premium{channel_id}", now, lifetime, margin)]
+
+def write_snapshots(store, channel_ids, results, duration, report_file=curl.REPORT_FILE):
+    """Writes channelAuth.txt and signatureURLs.txt for every known channel, plus this run's report."""
+    channels = [store.auth(f"premium{channel_id}") for channel_id in channel_ids]
+    channels = [auth for auth in channels if auth is not None]
+    if not channels:
+        return # Keep whatever the files held rather than replacing them with empty ones
+    generate_auth_list.write_atomically(AUTH_SNAPSHOT_FILE, [line for auth in channels for line in auth.block_lines()])
+    generate_auth_list.write_atomically(SIGNATURE_SNAPSHOT_FILE, [auth.signature_url(AUTH_BASE_URL) for auth in channels])
+    curl.write_report(report_file, [result.activation for result in results if result.activation], duration)
+
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Harvest, sign and activate every channel in one pass")
+    parser.add_argument('--concurrency', type=int, default=HARVEST_CONCURRENCY,
+                        help=f"Channel pages fetched at the same time (default: {HARVEST_CONCURRENCY})")
+    parser.add_argument('--activation-concurrency', type=int, default=ACTIVATION_CONCURRENCY,
+                        help=f"Signature URLs activated at the same time (default: {ACTIVATION_CONCURRENCY})")
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT,
+                        help=f"Page requests per second, 0 for no limit (default: {RATE_LIMIT})")
+    parser.add_argument('--method', choices=['HEAD', 'GET'], default='HEAD',
+                        help="Activation request method (default: HEAD)")
+    parser.add_argument('--snapshot', action='store_true',
+                        help=f"Also write {AUTH_SNAPSHOT_FILE}, {SIGNATURE_SNAPSHOT_FILE} and {curl.REPORT_FILE}")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only refresh channels that failed last time or whose signature is about to expire")
+    parser.add_argument('--state', default=STATE_FILE, help=f"Channel state file (default: {STATE_FILE})")
+    parser.add_argument('--lifetime', type=int,
+                        help=f"Seconds a signature stays valid after its ts (default: learned from refused "
+                             f"signatures, else {SIGNATURE_LIFETIME})")
+    parser.add_argument('--margin', type=int, default=REFRESH_MARGIN,
+                        help=f"Seconds before expiry a signature is refreshed (default: {REFRESH_MARGIN})")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    store = ChannelStateStore(args.state)
+    all_channel_ids = generate_auth_list.read_channel_ids(generate_auth_list.INPUT_FILES)
+    channel_ids = all_channel_ids
+    if args.incremental:
+        channel_ids = select_stale_channels(store, all_channel_ids, args.lifetime or store.lifetime(), args.margin)
+        print(f"Refreshing {len(channel_ids)} of {len(all_channel_ids)} channels.")
+    started = time.monotonic()
+    results = run_pipeline(channel_ids, args.concurrency, args.activation_concurrency, args.rate_limit, args.method)
+    duration = time.monotonic() - started
+    record_results(store, results)
+    store.save()
+    if args.snapshot:
+        write_snapshots(store, all_channel_ids, results, duration)
+    activated = sum(1 for result in results if result.activated)
+    print(f"\n{activated} of {len(results)} channels activated in {duration:.1f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+import generate_auth_list
+from channel_state import STATE_FILE, ChannelStateStore
+
+# --- Configuration ---
+CATALOG_FILE = "channels.json" # Compact channel catalog the playlist is generated from
+PLAYLIST_FILE = "tivimate_playlist.m3u8"
+EPG_URL = "https://raw.githubusercontent.com/phosani/daddylive-m3u/refs/heads/main/epg.xml"
+STREAM_URL = "https://{server}new.newkso.ru/{server}/{channel}/mono.m3u8"
+STREAM_HEADERS = '|Referer="https://lefttoplay.xyz/"|Origin="https://lefttoplay.xyz"' # Request headers players send
+KEY_URI = "https://key2.keylocking.ru/wmsxx.php?test=true|name={channel}|number=1"
+STATE_CHECK_INTERVAL = 5 # Seconds between checks of the state file for new signatures
+
+STREAM_PATTERN = re.compile(r'^https://(\w+)new\.newkso\.ru/\1/([^/]+)/mono\.m3u8$')
+KEY_PATTERN = re.compile(r'^#EXT-X-KEY:METHOD=AES-128,URI="([^"]*)",IV=(0x[0-9a-fA-F]+),KEYFORMAT="identity"$')
+ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)="([^"]*)"?')
+SIGNED_CHANNEL_PATTERN = re.compile(r'^premium\d+$') # Channels whose key needs an activated signature
+
+def render_entry(channel):
+    """Returns the playlist lines of one catalog channel: #EXT-X-KEY (if encrypted), #EXTINF and URL."""
+    lines = []
+    if 'iv' in channel:
+        uri = channel.get('key_uri') or KEY_URI.format(channel=channel['id'])
+        lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="{uri}",IV={channel["iv"]},KEYFORMAT="identity"')
+    attributes = {
+        'tvg-id': channel.get('tvg_id', ''),
+        'tvg-name': channel.get('tvg_name', channel['name']),
+        'tvg-logo': channel.get('logo', ''),
+        'group-title': channel.get('group', ''),
+        **channel.get('attrs', {}),
+    }
+    lines.append('#EXTINF:-1 ' + ' '.join(f'{name}="{value}"' for name, value in attributes.items())
+                 + f' ,{channel["name"]}')
+    lines.append(channel.get('url') or STREAM_URL.format(server=channel['server'], channel=channel['id']) + STREAM_HEADERS)
+    return '\n'.join(lines) + '\n'
+
+def playlist_header(epg_url):
+    """Returns the #EXTM3U line pointing players at the EPG."""
+    return f'#EXTM3U url-tvg="{epg_url}"\n'
+
+def parse_extinf(line):
+    """Returns the catalog fields of an #EXTINF line."""
+    attribute_text, _, name = line.rpartition(',')
+    attributes = dict(ATTRIBUTE_PATTERN.findall(attribute_text))
+    channel = {'name': name.strip()}
+    for attribute, field in (('tvg-id', 'tvg_id'), ('tvg-name', 'tvg_name'), ('tvg-logo', 'logo'),
+                             ('group-title', 'group')):
+        value = attributes.pop(attribute, '')
+        if value and not (field == 'tvg_name' and value == channel['name']):
+            channel[field] = value
+    if attributes:
+        channel['attrs'] = attributes
+    return channel
+
+def parse_playlist(lines):
+    """Turns the lines of an existing M3U playlist into catalog channels, returns (epg_url, channels)."""
+    epg_url = EPG_URL
+    channels = []
+    key = None
+    channel = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('#EXTM3U'):
+            match = re.search(r'url-tvg="([^"]*)"', line)
+            epg_url = match.group(1) if match else epg_url
+        elif line.startswith('#EXT-X-KEY'):
+            key = KEY_PATTERN.match(line)
+            if key is None:
+                print(f"Warning: skipping unsupported key line: {line[:80]}")
+        elif line.startswith('#EXTINF'):
+            channel = parse_extinf(line)
+        elif line and not line.startswith('#') and channel is not None:
+            stream_url, _, headers = line.partition('|')
+            match = STREAM_PATTERN.match(stream_url)
+            if match and '|' + headers == STREAM_HEADERS:
+                channel = {'id': match.group(2), **channel, 'server': match.group(1)}
+            else:
+                channel['url'] = line
+            if key is not None:
+                if 'id' not in channel or key.group(1) != KEY_URI.format(channel=channel['id']):
+                    channel['key_uri'] = key.group(1)
+                channel['iv'] = key.group(2)
+            channels.append(channel)
+            key = channel = None
+    return epg_url, channels
+
+def load_catalog(file_path=CATALOG_FILE):
+    """Returns (epg_url, channels) from a catalog file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        catalog = json.load(f)
+    return catalog.get('epg_url', EPG_URL), catalog['channels']
+
+def write_catalog(file_path, epg_url, channels):
+    """Writes the catalog with one channel per line, so diffs show which channels changed."""
+    lines = ['{', f'  "epg_url": {json.dumps(epg_url)},', '  "channels": [']
+    lines += [f'    {json.dumps(channel, ensure_ascii=False)}' + (',' if index < len(channels) - 1 else '')
+              for index, channel in enumerate(channels)]
+    lines += ['  ]', '}']
+    generate_auth_list.write_atomically(file_path, lines)
+
+def requires_signature(channel):
+    """Returns True if a channel's decryption key only works after its signature was activated."""
+    return 'iv' in channel and bool(SIGNED_CHANNEL_PATTERN.match(channel.get('id', '')))
+
+def unharvested_channels(channels, input_files=generate_auth_list.INPUT_FILES):
+    """Returns the IDs of signed catalog channels missing from the channel lists, whose keys never unlock."""
+    listed = {f"premium{channel_id}" for channel_id in generate_auth_list.read_channel_ids(input_files)}
+    return [channel['id'] for channel in channels if requires_signature(channel) and channel['id'] not in listed]
+
+def channel_servers(catalog_file=CATALOG_FILE, input_files=generate_auth_list.INPUT_FILES):
+    """Returns {channel key: set of edge server names} from the catalog and the per-server channel lists."""
+    servers = {}
+    if os.path.exists(catalog_file):
+        for channel in load_catalog(catalog_file)[1]:
+            if 'server' in channel:
+                servers.setdefault(channel['id'], set()).add(channel['server'])
+    for file_name in input_files:
+        server = os.path.splitext(os.path.basename(file_name))[0] # zeko.txt lists what zekonew carries
+        for channel_id in generate_auth_list.read_channel_ids([file_name]):
+            servers.setdefault(f"premium{channel_id}", set()).add(server)
+    return servers
+
+class PlaylistIndex:
+    """Pre-rendered playlist entries indexed by channel ID, joined on demand into filtered playlists.
+
+    Validity comes from the channel state file, which is re-read whenever the pipeline or the
+    refresh scheduler saves it.
+    """
+
+    def __init__(self, catalog_file=CATALOG_FILE, state_file=STATE_FILE):
+        self.epg_url, self.channels = load_catalog(catalog_file)
+        self.header = playlist_header(self.epg_url).rstrip('\n').encode('utf-8')
+        self.entries = [render_entry(channel).encode('utf-8') for channel in self.channels]
+        self.groups_lower = [channel.get('group', '').lower() for channel in self.channels]
+        self.signed = [requires_signature(channel) for channel in self.channels]
+        self.by_id = {channel['id']: index for index, channel in enumerate(self.channels) if 'id' in channel}
+        self.state_file = state_file
+        self.state_mtime = None
+        self.state_checked_at = 0
+        self.valid_until = {} # channel ID -> epoch seconds its activated signature is assumed to last until
+        self.lock = threading.Lock()
+
+    def entry(self, channel_id):
+        """Returns (catalog channel, rendered entry bytes) for a channel ID, or None."""
+        index = self.by_id.get(channel_id)
+        return None if index is None else (self.channels[index], self.entries[index])
+
+    def groups(self):
+        """Returns the group titles in catalog order."""
+        return list(dict.fromkeys(channel.get('group', '') for channel in self.channels))
+
+    def tvg_ids(self, groups=None):
+        """Returns the EPG IDs of the channels in the given group titles (all if None), in catalog order."""
+        wanted = None if not groups else {group.lower() for group in groups}
+        return list(dict.fromkeys(channel['tvg_id'] for channel, group in zip(self.channels, self.groups_lower)
+                                  if channel.get('tvg_id') and (wanted is None or group in wanted)))
+
+    def refresh_state(self, now):
+        """Reloads signature expiry times if the state file changed since the last check."""
+        with self.lock:
+            if now - self.state_checked_at < STATE_CHECK_INTERVAL:
+                return
+            self.state_checked_at = now
+            try:
+                mtime = os.stat(self.state_file).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self.state_mtime:
+                return
+            self.state_mtime = mtime
+            store = ChannelStateStore(self.state_file)
+            lifetime = store.lifetime()
+            self.valid_until = {channel_key: int(state['ts']) + lifetime
+                                for channel_key, state in store.channels.items()
+                                if state.get('ok') and state.get('ts', '').isdigit()}
+
+    def is_valid(self, channel, now):
+        """Returns True if a channel plays right now: it needs no signature or its signature is active."""
+        return not requires_signature(channel) or self.valid_until.get(channel['id'], 0) > now
+
+    def render(self, groups=None, valid_only=False, now=None, epg_url=None):
+        """Returns playlist bytes for the given group titles (all if None), optionally only playable channels.
+
+        epg_url replaces the catalog's guide in the header, e.g. with the trimmed one the proxy serves.
+        """
+        now = time.time() if now is None else now
+        if valid_only:
+            self.refresh_state(now)
+        wanted = None if not groups else {group.lower() for group in groups}
+        valid_until = self.valid_until
+        parts = [self.header if epg_url is None else playlist_header(epg_url).rstrip('\n').encode('utf-8')]
+        for channel, entry, group, signed in zip(self.channels, self.entries, self.groups_lower, self.signed):
+            if wanted is not None and group not in wanted:
+                continue
+            if valid_only and signed and valid_until.get(channel['id'], 0) <= now:
+                continue
+            parts.append(entry)
+        # Every entry ends with a newline, so joining with another one leaves a blank line between entries
+        return b'\n'.join(parts)
+
+def parse_arguments():
+    """Parses command line overrides for the configuration constants."""
+    parser = argparse.ArgumentParser(description="Generate the M3U playlist from the channel catalog")
+    parser.add_argument('--catalog', default=CATALOG_FILE, help=f"Channel catalog (default: {CATALOG_FILE})")
+    parser.add_argument('--output', default=PLAYLIST_FILE, help=f"Playlist to write (default: {PLAYLIST_FILE})")
+    parser.add_argument('--group', action='append',
+                        help="Only include this group title, may be repeated (default: every group)")
+    parser.add_argument('--valid-only', action='store_true',
+                        help=f"Only include channels whose signature is currently activated in {STATE_FILE}")
+    parser.add_argument('--import', dest='import_file', metavar='PLAYLIST',
+                        help="Rebuild the catalog from an existing playlist instead of generating one")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    if args.import_file:
+        with open(args.import_file, 'r', encoding='utf-8') as f:
+            epg_url, channels = parse_playlist(f)
+        write_catalog(args.catalog, epg_url, channels)
+        print(f"Imported {len(channels)} channels from '{args.import_file}' into '{args.catalog}'.")
+        return
+    index = PlaylistIndex(args.catalog)
+    for channel_id in unharvested_channels(index.channels):
+        print(f"Warning: {channel_id} is encrypted but missing from {', '.join(generate_auth_list.INPUT_FILES)}, "
+              f"so its signature is never activated.")
+    playlist = index.render(args.group, args.valid_only)
+    with open(args.output, 'wb') as f:
+        f.write(playlist)
+    print(f"Wrote {playlist.count(b'#EXTINF')} of {len(index.channels)} channels to '{args.output}'.")
+
+if __name__ == "__main__":
+    main()
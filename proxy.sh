@@ -10,14 +10,7 @@ cd /mnt/c/users/rf17/downloads/dl
 
 echo "Diretório alterado para $(pwd)"
 
-echo "Executando generate_auth_list.py..."
-python3 generate_auth_list.py
-
-echo "Executando generate_signature_urls.py..."
-python3 generate_signature_urls.py
-
-echo "Executando curl.py..."
-python3 curl.py
-
-echo "Executando fproxy.py..."
-python3 fproxy.py
+# O proxy ativa todos os canais ao iniciar e renova as assinaturas em segundo plano
+# antes que expirem (os arquivos .txt ficam como snapshot)
+echo "Executando fproxy.py --refresh..."
+python3 fproxy.py --refresh
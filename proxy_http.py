@@ -0,0 +1,314 @@
+import asyncio
+
+# --- Configuration ---
+MAX_HEAD_SIZE = 64 * 1024 # Largest request/response head (start line + headers) accepted
+READ_SIZE = 64 * 1024     # Bytes requested per recv while streaming bodies
+
+# Headers that only apply to a single connection and are never forwarded
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'upgrade'}
+
+class HttpFramingError(Exception):
+    """Raised when an HTTP message cannot be framed safely."""
+
+    def __init__(self, message, peer=None):
+        super().__init__(message)
+        self.peer = peer # 'client', 'upstream' or None when not tied to a connection
+
+class PeerTimeout(Exception):
+    """Raised when a peer does not send or accept data within its timeout."""
+
+    def __init__(self, peer):
+        super().__init__(f"{peer} timed out")
+        self.peer = peer
+
+class SocketStream:
+    """Non-blocking socket with a read buffer and per-operation timeouts, used on an event loop."""
+
+    def __init__(self, sock, peer, timeout, initial=b''):
+        self.sock = sock
+        self.peer = peer
+        self.timeout = timeout
+        self.buffer = bytearray(initial)
+        self.flow = None # Optional bandwidth.ShapedFlow pacing what is sent to the peer
+
+    async def fill(self):
+        """Reads more data into the buffer, returns False on EOF."""
+        loop = asyncio.get_running_loop()
+        try:
+            data = await asyncio.wait_for(loop.sock_recv(self.sock, READ_SIZE), self.timeout)
+        except asyncio.TimeoutError:
+            raise PeerTimeout(self.peer)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    async def sendall(self, data):
+        """Sends all of data, raising PeerTimeout if the peer stops reading."""
+        if self.flow is None:
+            await self.send_now(data)
+            return
+        # Shaped sends go out one quantum at a time, each after its bucket wait
+        view = memoryview(data)
+        for start in range(0, len(view), self.flow.quantum):
+            chunk = view[start:start + self.flow.quantum]
+            wait = self.flow.reserve(len(chunk))
+            if wait:
+                await asyncio.sleep(wait)
+            await self.send_now(chunk)
+
+    async def send_now(self, data):
+        """Sends all of data without pacing, raising PeerTimeout if the peer stops reading."""
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.sock_sendall(self.sock, data), self.timeout)
+        except asyncio.TimeoutError:
+            raise PeerTimeout(self.peer)
+
+    async def read_until(self, delimiter, limit):
+        """Returns bytes up to and including delimiter, None on a clean EOF before any data."""
+        start = 0
+        while True:
+            index = self.buffer.find(delimiter, start)
+            if index != -1:
+                end = index + len(delimiter)
+                data = bytes(self.buffer[:end])
+                del self.buffer[:end]
+                return data
+            if len(self.buffer) > limit:
+                raise HttpFramingError(f"Message head larger than {limit} bytes", self.peer)
+            start = max(0, len(self.buffer) - len(delimiter) + 1)
+            if not await self.fill():
+                if self.buffer:
+                    raise HttpFramingError("Connection closed in the middle of a message", self.peer)
+                return None
+
+    async def read_some(self, limit):
+        """Returns up to limit bytes, preferring already buffered data. Empty bytes means EOF."""
+        if not self.buffer and not await self.fill():
+            return b''
+        data = bytes(self.buffer[:limit])
+        del self.buffer[:limit]
+        return data
+
+class HttpMessage:
+    """Parsed start line and headers of a request or response."""
+
+    def __init__(self, start_line, headers):
+        self.start_line = start_line
+        self.headers = headers # List of (name, value) pairs in arrival order
+
+    def get_header(self, name):
+        """Returns the last value of a header (case-insensitive), or None."""
+        name = name.lower()
+        value = None
+        for header_name, header_value in self.headers:
+            if header_name.lower() == name:
+                value = header_value
+        return value
+
+    def connection_tokens(self):
+        """Returns the lower-cased tokens of the Connection and Proxy-Connection headers."""
+        tokens = set()
+        for header_name, header_value in self.headers:
+            if header_name.lower() in ('connection', 'proxy-connection'):
+                tokens.update(token.strip().lower() for token in header_value.split(','))
+        return tokens
+
+    def serialize(self, extra_headers=()):
+        """Returns the head bytes without hop-by-hop headers, plus extra_headers."""
+        # Headers named by Connection are hop-by-hop too (RFC 9110 section 7.6.1)
+        skipped = HOP_BY_HOP_HEADERS | self.connection_tokens()
+        lines = [self.start_line]
+        for header_name, header_value in self.headers:
+            if header_name.lower() not in skipped:
+                lines.append(f"{header_name}: {header_value}")
+        for header_name, header_value in extra_headers:
+            lines.append(f"{header_name}: {header_value}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+async def read_message_head(stream):
+    """Reads one message head from stream, returns an HttpMessage or None on EOF."""
+    head = await stream.read_until(b'\r\n\r\n', MAX_HEAD_SIZE)
+    if head is None:
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    while lines and not lines[0]:
+        lines.pop(0) # Tolerate stray CRLFs between pipelined messages
+    if not lines:
+        raise HttpFramingError("Empty message head", stream.peer)
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(':')
+        if not separator:
+            raise HttpFramingError(f"Malformed header line: {line[:50]}", stream.peer)
+        headers.append((name.strip(), value.strip()))
+    return HttpMessage(lines[0], headers)
+
+def keeps_alive(message, version):
+    """Returns True if the peer that sent message expects the connection to stay open."""
+    tokens = message.connection_tokens()
+    if version == 'HTTP/1.0':
+        return 'keep-alive' in tokens
+    return 'close' not in tokens
+
+def is_upgrade_request(request):
+    """Returns True if the request asks to switch protocols (e.g. WebSocket)."""
+    return 'upgrade' in request.connection_tokens() and request.get_header('Upgrade') is not None
+
+def request_body_framing(request):
+    """Returns ('chunked', None), ('length', n) or ('none', 0) for a request body."""
+    transfer_encoding = request.get_header('Transfer-Encoding')
+    if transfer_encoding and transfer_encoding.lower().endswith('chunked'):
+        return 'chunked', None
+    content_length = request.get_header('Content-Length')
+    if content_length:
+        return 'length', parse_content_length(content_length)
+    return 'none', 0
+
+def response_body_framing(response, request_method, status):
+    """Returns the framing of a response body, adding ('close', None) for read-until-EOF."""
+    if request_method == 'HEAD' or 100 <= status < 200 or status in (204, 304):
+        return 'none', 0
+    transfer_encoding = response.get_header('Transfer-Encoding')
+    if transfer_encoding:
+        if transfer_encoding.lower().endswith('chunked'):
+            return 'chunked', None
+        return 'close', None
+    content_length = response.get_header('Content-Length')
+    if content_length:
+        return 'length', parse_content_length(content_length)
+    return 'close', None
+
+def parse_content_length(value):
+    """Parses a Content-Length header value."""
+    try:
+        length = int(value.split(',')[0].strip())
+    except ValueError:
+        raise HttpFramingError(f"Invalid Content-Length: {value}")
+    if length < 0:
+        raise HttpFramingError(f"Invalid Content-Length: {value}")
+    return length
+
+async def forward_body(source, destination, framing, length):
+    """Streams a message body from source to destination according to its framing."""
+    if framing == 'length':
+        remaining = length
+        while remaining:
+            data = await source.read_some(min(remaining, READ_SIZE))
+            if not data:
+                raise HttpFramingError("Connection closed before the whole body was received", source.peer)
+            await destination.sendall(data)
+            remaining -= len(data)
+    elif framing == 'chunked':
+        await forward_chunked_body(source, destination)
+    elif framing == 'close':
+        while True:
+            data = await source.read_some(READ_SIZE)
+            if not data:
+                return
+            await destination.sendall(data)
+
+async def forward_chunked_body(source, destination):
+    """Forwards a chunked body verbatim, including the chunk framing and trailers."""
+    while True:
+        size_line = await source.read_until(b'\r\n', MAX_HEAD_SIZE)
+        if size_line is None:
+            raise HttpFramingError("Connection closed inside a chunked body", source.peer)
+        try:
+            chunk_size = int(size_line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise HttpFramingError(f"Invalid chunk size line: {size_line[:50]}", source.peer)
+        await destination.sendall(size_line)
+        if chunk_size == 0:
+            break
+        await forward_body(source, destination, 'length', chunk_size + 2) # Data plus its CRLF
+    # Trailers end with an empty line
+    while True:
+        trailer_line = await source.read_until(b'\r\n', MAX_HEAD_SIZE)
+        if trailer_line is None:
+            raise HttpFramingError("Connection closed inside chunked trailers", source.peer)
+        await destination.sendall(trailer_line)
+        if trailer_line == b'\r\n':
+            return
+
+async def read_exactly(source, length):
+    """Returns exactly length bytes from source, raising HttpFramingError on an early EOF."""
+    data = bytearray()
+    while len(data) < length:
+        chunk = await source.read_some(min(length - len(data), READ_SIZE))
+        if not chunk:
+            raise HttpFramingError("Connection closed before the whole body was received", source.peer)
+        data += chunk
+    return bytes(data)
+
+async def read_body(source, framing, length, limit):
+    """Returns a whole message body with chunked framing removed, or None if it is larger than limit.
+
+    After None the body is only partially read, so the connection cannot be reused.
+    """
+    if framing == 'length':
+        return await read_exactly(source, length) if length <= limit else None
+    body = bytearray()
+    if framing == 'close':
+        while len(body) <= limit:
+            data = await source.read_some(READ_SIZE)
+            if not data:
+                return bytes(body)
+            body += data
+        return None
+    if framing == 'chunked':
+        while True:
+            size_line = await source.read_until(b'\r\n', MAX_HEAD_SIZE)
+            if size_line is None:
+                raise HttpFramingError("Connection closed inside a chunked body", source.peer)
+            try:
+                chunk_size = int(size_line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpFramingError(f"Invalid chunk size line: {size_line[:50]}", source.peer)
+            if chunk_size == 0:
+                break
+            if len(body) + chunk_size > limit:
+                return None
+            body += await read_exactly(source, chunk_size)
+            if await read_exactly(source, 2) != b'\r\n':
+                raise HttpFramingError("Chunk data not followed by CRLF", source.peer)
+        while True:
+            trailer_line = await source.read_until(b'\r\n', MAX_HEAD_SIZE)
+            if trailer_line is None:
+                raise HttpFramingError("Connection closed inside chunked trailers", source.peer)
+            if trailer_line == b'\r\n':
+                return bytes(body)
+    return b''
+
+def split_authority(authority, default_port):
+    """Returns (host, port) of a host[:port] authority; IPv6 literals ([::1]:8080) lose their brackets."""
+    if authority.startswith('['):
+        host, bracket, rest = authority[1:].partition(']')
+        if not bracket or (rest and not (rest.startswith(':') and rest[1:].isdigit())):
+            return None, None
+        return host, int(rest[1:]) if rest else default_port
+    host, separator, port = authority.rpartition(':')
+    if not separator or ':' in host or not port.isdigit():
+        return authority, default_port # No port, or an unbracketed IPv6 address
+    return host, int(port)
+
+def format_authority(host, port, default_port=80):
+    """Returns host[:port] for a Host header, bracketing IPv6 literals and leaving out the default port."""
+    if ':' in host:
+        host = f"[{host}]"
+    return host if port == default_port else f"{host}:{port}"
+
+def split_target(target, host_header, default_port=80):
+    """Returns (host, port, path) for an absolute-form URL or an origin-form path plus Host header."""
+    if target[:7].lower() == 'http://':
+        authority, slash, rest = target[len('http://'):].partition('/')
+        path = slash + rest if slash else '/'
+    else:
+        authority, path = host_header, target
+    if not authority:
+        return None, None, path
+    host, port = split_authority(authority, default_port)
+    return host or None, port, path
@@ -0,0 +1,126 @@
+import threading
+from collections import defaultdict
+
+# --- Configuration ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Histogram upper bounds in seconds
+
+class Histogram:
+    """Cumulative Prometheus-style histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Adds one observation, the caller holds the metrics lock."""
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels=''):
+        """Returns the exposition lines of this histogram."""
+        separator = ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.total:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+def escape_label(value):
+    """Escapes a label value for the text exposition format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class ProxyMetrics:
+    """Thread-safe counters, gauges and histograms of one proxy process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.active_tunnels = 0
+        self.tunnels = 0
+        self.relayed_bytes = {'upstream': 0, 'downstream': 0} # upstream = client to server
+        self.errors = defaultdict(int) # error type -> count
+        self.connect_seconds = defaultdict(Histogram) # upstream host -> connect latency
+        self.dns_seconds = Histogram()
+
+    def connection_accepted(self):
+        """Counts a client connection."""
+        with self.lock:
+            self.connections += 1
+
+    def tunnel_opened(self):
+        """Counts a raw tunnel (CONNECT or protocol upgrade) that starts relaying."""
+        with self.lock:
+            self.active_tunnels += 1
+            self.tunnels += 1
+
+    def tunnel_closed(self):
+        """Counts a tunnel that stopped relaying."""
+        with self.lock:
+            self.active_tunnels -= 1
+
+    def add_bytes(self, direction, count):
+        """Adds bytes relayed in one direction ('upstream' or 'downstream')."""
+        with self.lock:
+            self.relayed_bytes[direction] += count
+
+    def count_error(self, kind):
+        """Counts an error by type, e.g. 'timeout', 'refused' or 'gaierror'."""
+        with self.lock:
+            self.errors[kind] += 1
+
+    def observe_connect(self, host, seconds):
+        """Records how long connecting to an upstream host took."""
+        with self.lock:
+            self.connect_seconds[host].observe(seconds)
+
+    def observe_dns(self, seconds):
+        """Records how long a DNS resolution (cache miss) took."""
+        with self.lock:
+            self.dns_seconds.observe(seconds)
+
+    def render(self, extra=()):
+        """Returns every metric in the Prometheus text format.
+
+        extra holds (name, type, help, value) tuples for values owned elsewhere, e.g. task counts.
+        """
+        with self.lock:
+            lines = [
+                '# HELP fproxy_connections_total Client connections accepted.',
+                '# TYPE fproxy_connections_total counter',
+                f'fproxy_connections_total {self.connections}',
+                '# HELP fproxy_active_tunnels Tunnels currently relaying.',
+                '# TYPE fproxy_active_tunnels gauge',
+                f'fproxy_active_tunnels {self.active_tunnels}',
+                '# HELP fproxy_tunnels_total Tunnels opened.',
+                '# TYPE fproxy_tunnels_total counter',
+                f'fproxy_tunnels_total {self.tunnels}',
+                '# HELP fproxy_relayed_bytes_total Bytes relayed through tunnels by direction.',
+                '# TYPE fproxy_relayed_bytes_total counter',
+            ]
+            for direction, count in self.relayed_bytes.items():
+                lines.append(f'fproxy_relayed_bytes_total{{direction="{direction}"}} {count}')
+            lines += ['# HELP fproxy_errors_total Failed client requests by error type.',
+                      '# TYPE fproxy_errors_total counter']
+            for kind, count in sorted(self.errors.items()):
+                lines.append(f'fproxy_errors_total{{type="{escape_label(kind)}"}} {count}')
+            lines += ['# HELP fproxy_upstream_connect_seconds Time to connect to upstream hosts.',
+                      '# TYPE fproxy_upstream_connect_seconds histogram']
+            for host, histogram in sorted(self.connect_seconds.items()):
+                lines += histogram.render('fproxy_upstream_connect_seconds', f'host="{escape_label(host)}"')
+            lines += ['# HELP fproxy_dns_seconds Time spent resolving upstream hosts on DNS cache misses.',
+                      '# TYPE fproxy_dns_seconds histogram']
+            lines += self.dns_seconds.render('fproxy_dns_seconds')
+        for name, metric_type, help_text, value in extra:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
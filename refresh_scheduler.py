@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import curl
+import generate_auth_list
+import pipeline
+from channel_state import REFRESH_MARGIN, STATE_FILE, ChannelStateStore
+from http_client import HttpClient
+
+# --- Configuration ---
+REFRESH_CONCURRENCY = 4 # Requests the scheduler runs at once, kept small so the proxy keeps the CPU
+REACTIVATE_FRACTION = 0.25 # Re-activate a working signature after this fraction of the signature lifetime
+RETRY_DELAY = 60        # Seconds before channels that failed to refresh are tried again
+MIN_SLEEP = 10          # Shortest pause between two scheduler passes
+MAX_SLEEP = 15 * 60     # Longest pause, so new channels and clock jumps are picked up
+JITTER = 0.1            # Fraction of each pause that is randomised, spreading refreshes out
+
+class RefreshScheduler(threading.Thread):
+    """Background thread that keeps every channel's signature activated while the proxy runs.
+
+    Working signatures are re-activated periodically. A refused re-activation is recorded as an
+    expiry, which teaches the state store how long signatures last; channels are re-harvested
+    `margin` seconds before that lifetime runs out, or right away when they failed.
+    """
+
+    def __init__(self, state_file=STATE_FILE, concurrency=REFRESH_CONCURRENCY, margin=REFRESH_MARGIN,
+                 snapshot=False):
+        super().__init__(name='refresh-scheduler', daemon=True)
+        self.store = ChannelStateStore(state_file)
+        self.concurrency = max(2, concurrency)
+        self.margin = margin
+        self.snapshot = snapshot
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Runs scheduler passes until stop() is called."""
+        delay = 0
+        while not self.stopping.wait(delay):
+            try:
+                delay = self.run_pass()
+            except Exception as e:
+                print(f"[ERROR] Signature refresh pass failed: {e}")
+                delay = RETRY_DELAY
+            print(f"[INFO] Next signature refresh pass in {delay:.0f}s")
+
+    def stop(self):
+        """Asks the thread to finish after the current pass."""
+        self.stopping.set()
+
+    def run_pass(self, now=None):
+        """Re-activates and re-harvests whatever is due, returns the seconds until the next pass."""
+        now = time.time() if now is None else now
+        channel_ids = generate_auth_list.read_channel_ids(generate_auth_list.INPUT_FILES)
+        lifetime = self.store.lifetime()
+        harvest = [channel_id for channel_id in channel_ids
+                   if self.store.needs_refresh(f"premium{channel_id}", now, lifetime, self.margin)]
+        due = set(harvest)
+        reactivate = [channel_id for channel_id in channel_ids
+                      if channel_id not in due and self.reactivation_due(f"premium{channel_id}", now, lifetime)]
+        if reactivate:
+            print(f"[INFO] Re-activating {len(reactivate)} signatures")
+            harvest += self.reactivate(reactivate, now)
+        if harvest:
+            print(f"[INFO] Refreshing {len(harvest)} of {len(channel_ids)} channels")
+            # The budget is split between the two pipeline stages
+            harvest_concurrency = self.concurrency // 2
+            results = pipeline.run_pipeline(harvest, harvest_concurrency, self.concurrency - harvest_concurrency)
+            pipeline.record_results(self.store, results)
+        if reactivate or harvest:
+            self.store.save()
+            if self.snapshot:
+                pipeline.write_snapshots(self.store, channel_ids, [], 0)
+        return self.next_delay(channel_ids, time.time())
+
+    def reactivation_due(self, channel_key, now, lifetime):
+        """Returns True if a working signature was last activated long enough ago."""
+        state = self.store.get(channel_key)
+        return bool(state) and now - state.get('activated_at', 0) >= lifetime * REACTIVATE_FRACTION
+
+    def reactivate(self, channel_ids, now):
+        """Re-activates stored signatures, returns the channels whose signature was refused."""
+        client = HttpClient(curl.REQUEST_HEADERS, rate_limit=curl.RATE_LIMIT)
+        keys = [f"premium{channel_id}" for channel_id in channel_ids]
+        urls = [self.store.auth(key).signature_url(pipeline.AUTH_BASE_URL) for key in keys]
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                records = list(executor.map(lambda url: curl.activate_url(client, 'HEAD', url), urls))
+        finally:
+            client.close()
+        refused = []
+        for channel_id, key, record in zip(channel_ids, keys, records):
+            if record['status'] == 200:
+                self.store.record(key, activation=record, now=now)
+            elif record['status'] in (401, 403):
+                self.store.record_expiry(key, now)
+                refused.append(channel_id)
+            else:
+                # Network trouble says nothing about the signature, try again on the next pass
+                self.store.get(key)['error'] = record.get('error') or f"HTTP {record['status']}"
+        return refused
+
+    def next_delay(self, channel_ids, now):
+        """Returns the jittered seconds until the earliest re-activation, refresh or retry is due."""
+        lifetime = self.store.lifetime()
+        due_times = []
+        for channel_id in channel_ids:
+            state = self.store.get(f"premium{channel_id}")
+            if not state or not state.get('ok'):
+                due_times.append(now + RETRY_DELAY)
+                continue
+            due_times.append(state.get('activated_at', 0) + lifetime * REACTIVATE_FRACTION)
+            if state.get('ts', '').isdigit():
+                due_times.append(int(state['ts']) + lifetime - self.margin)
+        delay = min(due_times, default=now + MAX_SLEEP) - now
+        delay = min(MAX_SLEEP, max(MIN_SLEEP, delay))
+        return delay * random.uniform(1 - JITTER, 1 + JITTER)
@@ -0,0 +1,70 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from bandwidth import ACTIVE_WINDOW, BandwidthShaper, FairScheduler, TokenBucket
+from proxy_http import SocketStream
+
+def test_token_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(1000, burst_seconds=1)
+    assert bucket.reserve(1000, now=100) == 0 # A new bucket is full
+    assert bucket.reserve(500, now=100) == pytest.approx(0.5)
+    assert bucket.reserve(500, now=100) == pytest.approx(1.0) # Reservations queue up behind each other
+    assert bucket.reserve(100, now=102) == 0 # Refilled while idle
+
+def test_token_bucket_credit_is_capped():
+    bucket = TokenBucket(1000, burst_seconds=1)
+    bucket.reserve(1000, now=0)
+    assert not bucket.is_full(now=0.5)
+    assert bucket.is_full(now=2)
+    assert bucket.reserve(1500, now=1000) == pytest.approx(0.5) # Idle for long, still only one second of credit
+
+def test_fair_scheduler_splits_the_rate_between_active_flows():
+    scheduler = FairScheduler(1000)
+    busy, live = object(), object()
+    scheduler.reserve(busy, 1000, now=0) # Spends busy's burst alone
+    assert scheduler.reserve(busy, 1000, now=0) == pytest.approx(1.0)
+    scheduler.reserve(live, 0, now=0)
+    # With two active flows each gets half the rate
+    assert scheduler.reserve(busy, 500, now=0) == pytest.approx(2.0)
+    assert scheduler.reserve(live, 500, now=0) == 0 # live still has its burst
+    # Once live goes quiet, busy has the whole rate again: one second of credit plus 2000 bytes at 1000/s
+    assert scheduler.reserve(busy, 3000, now=ACTIVE_WINDOW + 1) == pytest.approx(2.0)
+
+def test_shaper_charges_client_and_host_buckets():
+    shaper = BandwidthShaper(client_rate=1000, host_rate=4000)
+    first = shaper.open_flow('10.0.0.2', 'a.example')
+    second = shaper.open_flow('10.0.0.2', 'b.example')
+    other = shaper.open_flow('10.0.0.3', 'a.example')
+    first.reserve(1000)
+    assert second.reserve(1000) == pytest.approx(1.0, abs=0.05) # Same client, its bucket is empty
+    assert other.reserve(1000) == 0 # Another client, and the host bucket still has credit
+    first.close()
+
+def test_shaper_is_off_without_limits():
+    shaper = BandwidthShaper()
+    assert shaper.open_flow('10.0.0.2', 'a.example') is None
+    shaper.configure(0, 0, 1000)
+    assert shaper.open_flow('10.0.0.2', 'a.example') is not None
+
+def test_shaped_stream_sends_at_the_configured_rate():
+    async def transfer():
+        sender, receiver = socket.socketpair()
+        sender.setblocking(False)
+        receiver.setblocking(False)
+        stream = SocketStream(sender, 'client', 5)
+        stream.flow = BandwidthShaper(client_rate=200_000).open_flow('10.0.0.2', None)
+        stream.flow.quantum = 20_000
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        sending = asyncio.ensure_future(stream.sendall(b'x' * 300_000)) # 200 kB burst, then 0.5 s of pacing
+        received = 0
+        while received < 300_000:
+            received += len(await loop.sock_recv(receiver, 65536))
+        await sending
+        sender.close()
+        receiver.close()
+        return time.monotonic() - started
+    assert 0.4 < asyncio.run(transfer()) < 2
@@ -0,0 +1,38 @@
+import argparse
+
+import pytest
+
+import benchmark
+import generate_auth_list
+import pipeline
+
+@pytest.fixture(scope='module')
+def origin():
+    process, port = benchmark.start_origin(segment_size=100_000)
+    yield f"127.0.0.1:{port}"
+    process.terminate()
+    process.join()
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 0.5) == 50
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile([7], 0.99) == 7
+    assert benchmark.percentile([], 0.5) is None
+
+def test_script_scenarios_run_against_the_stand_in_pages(origin, monkeypatch):
+    monkeypatch.setattr(generate_auth_list, 'AUTH_PAGE_URL', f"http://{origin}/premiumtv/daddylivehd.php?id={{channel_id}}")
+    monkeypatch.setattr(pipeline, 'AUTH_BASE_URL', f"http://{origin}/auth.php")
+    signatures = benchmark.harvest_signatures(['1', '2', '3'])
+    assert [channel.channel_id for channel in signatures] == ['1', '2', '3']
+    result = benchmark.bench_scripts('activate', ['1', '2', '3'], signatures)
+    assert result['requests'] == 3 and result['errors'] == 0
+    assert benchmark.bench_scripts('pipeline', ['1', '2'])['errors'] == 0
+
+@pytest.mark.parametrize('scenario', ['connect', 'http'])
+def test_proxy_scenarios_relay_every_segment(origin, scenario):
+    args = argparse.Namespace(proxy_args='', clients=2, requests=3, segment_size=100_000)
+    result = benchmark.bench_proxy(scenario, 'buffer', origin, args)
+    assert result['name'] == f"{scenario}/buffer"
+    assert result['requests'] == 6 and result['errors'] == 0
+    assert result['p99_ms'] >= result['p50_ms'] > 0
@@ -0,0 +1,35 @@
+from channel_auth import ChannelAuth, iter_channel_auth
+
+BLOCKS = '''<script>
+  var channelKey = "premium1";
+  var __c = atob("MTc1MDk2NzUxNw==");
+  var __e = atob("NjJlNg==");
+  var __d = atob("MTYyNTYxODQ=");
+var channelKey = "premium2";
+var __c = "1750967518";
+var __d = "f3e549c5";
+var __e = "d2a8";
+var channelKey = "premium3";
+var __c = atob("MTc1MDk2NzUxNw==");
+var channelKey = "premium4";
+var __c = atob("not base64!");
+var __d = atob("ZjNlNTQ5YzU=");
+var __e = atob("ZDJh");
+'''.splitlines()
+
+def test_iter_channel_auth_decodes_both_literal_forms_and_reports_bad_blocks():
+    errors = []
+    channels = list(iter_channel_auth(BLOCKS, lambda channel_key, message: errors.append(channel_key)))
+    assert channels == [ChannelAuth('premium1', '1750967517', '16256184', '62e6'),
+                        ChannelAuth('premium2', '1750967518', 'f3e549c5', 'd2a8')]
+    assert errors == ['premium3', 'premium4']
+    assert channels[0].channel_id == '1'
+
+def test_signature_url():
+    channel = ChannelAuth('premium51', '1750967517', 'f3e549c5', 'd2a8')
+    assert channel.signature_url("https://top2new.newkso.ru/auth.php") == (
+        "https://top2new.newkso.ru/auth.php?channel_id=premium51&ts=1750967517&rnd=f3e549c5&sig=d2a8")
+
+def test_block_lines_round_trip():
+    channel = ChannelAuth('premium51', '1750967517', 'f3e549c5', 'd2a8')
+    assert list(iter_channel_auth(channel.block_lines())) == [channel]
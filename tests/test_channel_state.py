@@ -0,0 +1,32 @@
+from channel_auth import ChannelAuth
+from channel_state import ChannelStateStore
+
+AUTH = ChannelAuth('premium1', '1000', 'f3e549c5', 'd2a8')
+OK = {'status': 200, 'attempts': 1, 'latency': 0.1}
+FORBIDDEN = {'status': 403, 'attempts': 1, 'latency': 0.1}
+
+def test_needs_refresh(tmp_path):
+    store = ChannelStateStore(str(tmp_path / 'state.json'))
+    assert store.needs_refresh('premium1', now=1000)
+    store.record('premium1', AUTH, OK, now=1000)
+    assert not store.needs_refresh('premium1', now=1500, lifetime=1000, margin=100)
+    assert store.needs_refresh('premium1', now=1900, lifetime=1000, margin=100) # Within the margin
+    store.record('premium1', AUTH, FORBIDDEN, 'HTTP 403', now=1000)
+    assert store.needs_refresh('premium1', now=1000, lifetime=1000, margin=100)
+
+def test_failed_harvest_keeps_the_last_signature(tmp_path):
+    store = ChannelStateStore(str(tmp_path / 'state.json'))
+    store.record('premium1', AUTH, OK, now=1000)
+    store.record('premium1', error='HTTP 404', now=2000)
+    assert store.auth('premium1') == AUTH
+    assert store.get('premium1')['ok'] is False
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / 'state.json')
+    store = ChannelStateStore(path)
+    store.record('premium1', AUTH, OK, now=1000)
+    store.save()
+    reloaded = ChannelStateStore(path)
+    assert reloaded.auth('premium1') == AUTH
+    assert reloaded.get('premium1')['status'] == 200
+    assert list(tmp_path.iterdir()) == [tmp_path / 'state.json'] # No temporary files left behind
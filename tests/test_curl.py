@@ -0,0 +1,33 @@
+import http.server
+import threading
+
+from curl import activate_urls, channel_of
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Accepts every signature except the one for premium2."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.send_response(403 if 'channel_id=premium2&' in self.path else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def test_channel_of():
+    assert channel_of("https://top2new.newkso.ru/auth.php?channel_id=premium51&ts=1&rnd=a&sig=b") == 'premium51'
+    assert channel_of("https://example.com/") == "https://example.com/"
+
+def test_activate_urls_reports_every_url_in_input_order():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        urls = [f"http://127.0.0.1:{server.server_port}/auth.php?channel_id=premium{i}&ts=1" for i in range(1, 6)]
+        records = activate_urls(urls, concurrency=3)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert [record['channel_id'] for record in records] == [f'premium{i}' for i in range(1, 6)]
+    assert [record['status'] for record in records] == [200, 403, 200, 200, 200]
+    assert all(record['attempts'] == 1 for record in records)
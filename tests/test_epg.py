@@ -0,0 +1,81 @@
+import gzip
+import http.server
+import io
+import threading
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import epg
+
+GUIDE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<tv generator-info-name="test">
+  <channel id="WABC.us"><display-name>ABC</display-name></channel>
+  <channel id="Other.us"><display-name>Other</display-name></channel>
+  <programme start="20250101070000 +0000" stop="20250101080000 +0000" channel="WABC.us"><title>Old News</title></programme>
+  <programme start="20250101120000 +0000" stop="20250101130000 +0000" channel="WABC.us"><title>Noon &amp; Co</title></programme>
+  <programme start="20250101120000 +0000" stop="20250101130000 +0000" channel="Other.us"><title>Elsewhere</title></programme>
+</tv>
+'''
+NOON = 1735732800 # 2025-01-01 12:00 UTC
+
+@pytest.fixture
+def store(tmp_path):
+    return epg.EpgStore(str(tmp_path / 'epg.sqlite3'))
+
+def test_parse_xmltv_time():
+    assert epg.parse_xmltv_time('20250101120000 +0000') == NOON
+    assert epg.parse_xmltv_time('20250101130000 +0100') == NOON
+    assert epg.parse_xmltv_time('202501011200') == NOON # No seconds and no offset means UTC
+    assert epg.parse_xmltv_time('soon') is None
+
+def test_serialize_keeps_children_attributes_and_escapes():
+    element = ET.fromstring('<programme channel="A&amp;E"><title lang="en">Q &lt; A</title><icon src="x" />tail</programme>')
+    fragment = epg.serialize(element)
+    assert fragment == '<programme channel="A&amp;E"><title lang="en">Q &lt; A</title><icon src="x" />tail</programme>'
+
+def test_render_trims_to_the_requested_channels(store):
+    assert store.import_guide(io.BytesIO(GUIDE), etag='"v1"') == (2, 3)
+    guide = gzip.decompress(store.render(['WABC.us', 'Missing.us'], now=NOON + 600)).decode('utf-8')
+    assert '<channel id="WABC.us">' in guide and 'Other.us' not in guide
+    assert 'Noon &amp; Co' in guide
+    assert 'Old News' not in guide # Ended more than PAST_PROGRAMMES before now
+    assert store.render(['WABC.us', 'Missing.us'], now=NOON + 600) is store.render(['WABC.us', 'Missing.us'], now=NOON + 900)
+
+def test_broken_download_keeps_the_previous_guide(store):
+    store.import_guide(io.BytesIO(GUIDE))
+    with pytest.raises(ET.ParseError):
+        store.import_guide(io.BytesIO(GUIDE[:300]))
+    assert b'Noon' in gzip.decompress(store.render(['WABC.us'], now=NOON))
+
+class GuideHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = gzip.compress(GUIDE)
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_fetch_guide_is_conditional(store):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GuideHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/epg.xml.gz'
+    try:
+        assert epg.fetch_guide(store, url) == (2, 3)
+        assert epg.fetch_guide(store, url) == 'not modified'
+        assert GuideHandler.requests[-1]['If-None-Match'] == '"v1"'
+        assert not store.is_stale()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,66 @@
+import asyncio
+
+from hls_cache import (PLAYLIST_TTL, PLAYLIST_TTL_MAX, SEGMENT_TTL, VOD_PLAYLIST_TTL, CachedResponse,
+                       HlsCache, classify, time_to_live)
+
+def response(body, *headers):
+    """Returns a 200 response with the given body and (name, value) headers."""
+    return CachedResponse('HTTP/1.1 200 OK', list(headers), body)
+
+def test_classify():
+    assert classify('example.com', '/premium51/mono.m3u8?x=1') == 'playlist'
+    assert classify('key2.keylocking.ru', '/wmsxx.php?test=true&name=premium51') == 'key'
+    assert classify('example.com', '/a/segment12.TS') == 'segment'
+    assert classify('example.com', '/index.html') is None
+
+def test_time_to_live():
+    assert time_to_live('playlist', response(b'#EXTM3U\n#EXT-X-TARGETDURATION:4\n')) == 2
+    assert time_to_live('playlist', response(b'#EXTM3U\n#EXT-X-TARGETDURATION:60\n')) == PLAYLIST_TTL_MAX
+    assert time_to_live('playlist', response(b'#EXTM3U\n')) == PLAYLIST_TTL
+    assert time_to_live('playlist', response(b'#EXTM3U\n#EXT-X-ENDLIST\n')) == VOD_PLAYLIST_TTL
+    assert time_to_live('segment', response(b'data')) == SEGMENT_TTL
+    assert time_to_live('segment', response(b'data', ('Cache-Control', 'no-store'))) == 0
+
+def test_put_evicts_least_recently_used_beyond_max_bytes():
+    cache = HlsCache(max_bytes=10, max_object_size=8)
+    cache.put('a', response(b'aaaa'), 60)
+    cache.put('b', response(b'bbbb'), 60)
+    assert cache.get('a') is not None # 'b' is now the least recently used
+    cache.put('c', response(b'cccc'), 60)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.size == 8
+    cache.put('d', response(b'd' * 9), 60) # Larger than max_object_size
+    assert cache.get('d') is None and cache.size == 8
+
+def test_concurrent_misses_share_one_fetch():
+    cache = HlsCache()
+    fetches = []
+
+    async def fetch():
+        fetches.append(1)
+        await asyncio.sleep(0.05)
+        return response(b'#EXTM3U\n#EXT-X-TARGETDURATION:6\n')
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch('key', 'playlist', fetch) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(fetches) == 1
+    assert sorted(source for _, source in results) == ['coalesced'] * 4 + ['miss']
+    assert asyncio.run(cache.get_or_fetch('key', 'playlist', fetch))[1] == 'hit'
+    assert (cache.hits, cache.misses, cache.coalesced) == (1, 1, 4)
+
+def test_failed_fetch_is_shared_and_not_cached():
+    cache = HlsCache()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        raise ConnectionRefusedError()
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch('key', 'segment', fetch) for _ in range(3)),
+                                    return_exceptions=True)
+
+    assert all(isinstance(result, ConnectionRefusedError) for result in asyncio.run(run()))
+    assert not cache.in_flight and cache.get('key') is None
@@ -0,0 +1,63 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from http_client import HostRateLimiter, HttpClient
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Answers /flaky with 503 on every other request and anything else with the path."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        server.connections.add(self.client_address)
+        status = 503 if self.path == '/flaky' and server.requests % 2 else 200
+        body = self.path.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = 0
+    server.connections = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_requests_reuse_the_connection(server):
+    client = HttpClient(rate_limit=0)
+    url = f"http://127.0.0.1:{server.server_port}"
+    bodies = [client.request('GET', f"{url}/{i}").body for i in range(3)]
+    client.close()
+    assert bodies == [b'/0', b'/1', b'/2']
+    assert len(server.connections) == 1
+
+def test_retry_statuses_are_retried(server):
+    client = HttpClient(rate_limit=0, backoff_base=0.01)
+    response = client.request('GET', f"http://127.0.0.1:{server.server_port}/flaky")
+    client.close()
+    assert (response.status, response.attempts) == (200, 2)
+
+def test_network_errors_are_raised_after_the_last_attempt():
+    client = HttpClient(rate_limit=0, max_attempts=2, backoff_base=0.01, timeout=1)
+    with pytest.raises(OSError):
+        client.request('GET', "http://127.0.0.1:1/")
+
+def test_rate_limiter_spaces_requests_per_host():
+    limiter = HostRateLimiter(20)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.wait('a')
+    limiter.wait('b') # Other hosts are not held up
+    assert 0.19 <= time.monotonic() - started < 0.3
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from channel_auth import ChannelAuth
+from lazy_auth import LazyAuthenticator, channel_from_path
+from pipeline import ChannelResult
+
+def test_channel_from_path():
+    assert channel_from_path('/zeko/premium51/mono.m3u8') == '51'
+    assert channel_from_path('/wmsxx.php?test=true|name=premium302|number=1') == '302'
+    assert channel_from_path('/index.html') is None
+
+def make_authenticator(tmp_path, activated):
+    """Returns an authenticator whose harvest+activation is a counted stand-in."""
+    authenticator = LazyAuthenticator(str(tmp_path / 'state.json'))
+    calls = []
+
+    def authenticate(channel_id):
+        calls.append(channel_id)
+        time.sleep(0.05)
+        result = ChannelResult(channel_id)
+        result.auth = ChannelAuth(result.channel_key, str(int(time.time())), 'f3e549c5', 'd2a8')
+        result.activation = {'status': 200 if activated else 403}
+        return result
+
+    authenticator.authenticate = authenticate
+    return authenticator, calls
+
+def test_concurrent_requests_share_one_authentication(tmp_path):
+    authenticator, calls = make_authenticator(tmp_path, activated=True)
+
+    async def run():
+        return await asyncio.gather(*(authenticator.ensure('51') for _ in range(4)))
+
+    assert sorted(asyncio.run(run())) == ['authenticated'] + ['coalesced'] * 3
+    assert calls == ['51']
+    assert asyncio.run(authenticator.ensure('51')) == 'valid'
+
+def test_failed_channels_back_off(tmp_path):
+    authenticator, calls = make_authenticator(tmp_path, activated=False)
+    assert asyncio.run(authenticator.ensure('51')) == 'failed'
+    assert asyncio.run(authenticator.ensure('51')) == 'failed'
+    assert calls == ['51'] # The second request did not go upstream again
@@ -0,0 +1,55 @@
+import http.server
+import threading
+
+import pytest
+
+import generate_auth_list
+import pipeline
+
+PAGE = '''<script>
+  var channelKey = "premium{0}";
+  var __c = atob("MTc1MDk2NzUxNw==");
+  var __d = atob("ZjNlNTQ5YzU=");
+  var __e = atob("ZDJh");
+</script>
+'''
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves channel pages (missing for channel 2) and accepts every signature but premium3's."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        channel_id = self.path.rsplit('=', 1)[1]
+        body = PAGE.format(channel_id).encode()
+        self.send_response(404 if channel_id == '2' else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(403 if 'channel_id=premium3&' in self.path else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def origin(monkeypatch):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(generate_auth_list, 'AUTH_PAGE_URL', base + "/daddylivehd.php?id={channel_id}")
+    monkeypatch.setattr(pipeline, 'AUTH_BASE_URL', base + "/auth.php")
+    yield base
+    server.shutdown()
+    server.server_close()
+
+def test_run_pipeline_harvests_signs_and_activates_each_channel(origin):
+    results = pipeline.run_pipeline(['1', '2', '3', '4'], 2, 2, rate_limit=0)
+    assert [result.channel_id for result in results] == ['1', '2', '3', '4']
+    assert [result.activated for result in results] == [True, False, False, True]
+    assert results[1].error.startswith('HTTP 404') and results[1].activation is None
+    assert results[2].error == 'HTTP 403'
+    assert results[0].url == origin + "/auth.php?channel_id=premium1&ts=1750967517&rnd=f3e549c5&sig=d2a"
+    assert len(results[3].lines) == 4
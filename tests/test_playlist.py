@@ -0,0 +1,66 @@
+import json
+
+import playlist
+from channel_state import ChannelStateStore
+from channel_auth import ChannelAuth
+
+PLAYLIST = '''#EXTM3U url-tvg="https://example.com/epg.xml"
+#EXT-X-KEY:METHOD=AES-128,URI="https://key2.keylocking.ru/wmsxx.php?test=true|name=premium51|number=1",IV=0x30303030303030303030303068418f96,KEYFORMAT="identity"
+#EXTINF:-1 tvg-id="WABC.us" tvg-name="ABC" tvg-logo="https://example.com/abc.png" group-title="USA (DADDY LIVE)" ,ABC
+https://zekonew.newkso.ru/zeko/premium51/mono.m3u8|Referer="https://lefttoplay.xyz/"|Origin="https://lefttoplay.xyz"
+
+#EXT-X-KEY:METHOD=AES-128,URI="https://key2.keylocking.ru/wmsxx.php?test=true&name=ustvdisney&number=1",IV=0x303030303030303030303030683d8a17,KEYFORMAT="identity"
+#EXTINF:-1 tvg-id="DisneyChannel.us" tvg-name="Disney Channel" tvg-logo="" group-title="USA (DADDY LIVE)" ,Disney Channel
+https://wikinew.newkso.ru/wiki/ustvdisney/mono.m3u8|Referer="https://lefttoplay.xyz/"|Origin="https://lefttoplay.xyz"
+
+#EXTINF:-1 tvg-id="BBCFour.uk" tvg-name="BBC 4" tvg-logo="" group-title="UK (DADDY LIVE)" channel-number="446" ,BBC Four
+https://ddy6new.newkso.ru/ddy6/premium295/mono.m3u8|Referer="https://lefttoplay.xyz/"|Origin="https://lefttoplay.xyz"
+
+#EXT-X-KEY:METHOD=AES-128,URI="https://key2.keylocking.ru/wmsxx.php?test=true|name=premium70|number=1",IV=0x30303030303030303030303068418f96,KEYFORMAT="identity"
+#EXTINF:-1 tvg-id="" tvg-name="Sky" tvg-logo="" group-title="UK (DADDY LIVE)" ,Sky
+https://windnew.newkso.ru/wind/premium70/mono.m3u8|Referer="https://lefttoplay.xyz/"|Origin="https://lefttoplay.xyz"
+'''
+
+def test_parse_playlist_builds_compact_catalog_entries():
+    epg_url, channels = playlist.parse_playlist(PLAYLIST.splitlines())
+    assert epg_url == "https://example.com/epg.xml"
+    assert channels[0] == {'id': 'premium51', 'name': 'ABC', 'tvg_id': 'WABC.us', 'logo': 'https://example.com/abc.png',
+                           'group': 'USA (DADDY LIVE)', 'server': 'zeko', 'iv': '0x30303030303030303030303068418f96'}
+    assert channels[1]['key_uri'].endswith('&name=ustvdisney&number=1')
+    assert channels[2]['tvg_name'] == 'BBC 4' and channels[2]['attrs'] == {'channel-number': '446'}
+    assert 'iv' not in channels[2]
+
+def test_catalog_round_trip_reproduces_playlist(tmp_path):
+    catalog = tmp_path / 'channels.json'
+    playlist.write_catalog(catalog, *playlist.parse_playlist(PLAYLIST.splitlines()))
+    assert len(json.loads(catalog.read_text())['channels']) == 4
+    index = playlist.PlaylistIndex(catalog, tmp_path / 'missing.json')
+    assert index.render().decode() == PLAYLIST
+    assert index.entry('premium70')[1].decode().startswith('#EXT-X-KEY')
+    assert index.entry('premium1') is None
+
+def test_render_filters_groups_and_unsigned_channels(tmp_path):
+    catalog = tmp_path / 'channels.json'
+    playlist.write_catalog(catalog, *playlist.parse_playlist(PLAYLIST.splitlines()))
+    state_file = tmp_path / 'state.json'
+    store = ChannelStateStore(state_file)
+    store.record('premium70', ChannelAuth('premium70', '1000', 'a', 'b'), {'status': 200, 'attempts': 1, 'latency': 5})
+    store.save()
+    index = playlist.PlaylistIndex(catalog, state_file)
+    uk = index.render(['uk (daddy live)']).decode()
+    assert uk.count('#EXTINF') == 2 and 'premium51' not in uk
+    valid = index.render(valid_only=True, now=2000).decode()
+    # premium51 has no activated signature; Disney and BBC Four need none
+    assert [line.rsplit(',', 1)[1] for line in valid.splitlines() if line.startswith('#EXTINF')] == \
+        ['Disney Channel', 'BBC Four', 'Sky']
+    index.state_checked_at = 0
+    assert 'premium70' not in index.render(valid_only=True, now=1000 + 7 * 3600).decode() # Expired
+
+def test_tvg_ids_and_epg_url_override(tmp_path):
+    catalog = tmp_path / 'channels.json'
+    playlist.write_catalog(catalog, *playlist.parse_playlist(PLAYLIST.splitlines()))
+    index = playlist.PlaylistIndex(catalog, tmp_path / 'missing.json')
+    assert index.tvg_ids() == ['WABC.us', 'DisneyChannel.us', 'BBCFour.uk'] # Sky has no EPG ID
+    assert index.tvg_ids(['UK (DADDY LIVE)']) == ['BBCFour.uk']
+    rendered = index.render(epg_url='http://proxy:8888/epg.xml.gz').decode()
+    assert rendered.splitlines()[0] == '#EXTM3U url-tvg="http://proxy:8888/epg.xml.gz"'
@@ -0,0 +1,142 @@
+import asyncio
+import socket
+
+import pytest
+
+from proxy_http import (HttpFramingError, HttpMessage, SocketStream, format_authority, forward_chunked_body,
+                        read_body, read_message_head, request_body_framing, response_body_framing,
+                        split_authority, split_target)
+
+def make_stream(data, peer='client', close=True):
+    """Returns a SocketStream whose peer already sent data (and closed, if close is set)."""
+    reader_socket, writer_socket = socket.socketpair()
+    reader_socket.setblocking(False)
+    writer_socket.sendall(data)
+    if close:
+        writer_socket.close()
+    return SocketStream(reader_socket, peer, 1)
+
+class CollectingStream:
+    """Destination stream that records everything sent to it."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    async def sendall(self, data):
+        """Records data."""
+        self.data += data
+
+def message(*headers):
+    """Returns a message with the given (name, value) headers."""
+    return HttpMessage('GET / HTTP/1.1', list(headers))
+
+def test_read_message_head_parses_start_line_and_headers():
+    stream = make_stream(b'\r\nGET /a HTTP/1.1\r\nHost: example.com\r\nX-Spaced :  value \r\n\r\nrest')
+    head = asyncio.run(read_message_head(stream))
+    assert head.start_line == 'GET /a HTTP/1.1'
+    assert head.headers == [('Host', 'example.com'), ('X-Spaced', 'value')]
+    assert bytes(stream.buffer) == b'rest' # Pipelined bytes stay buffered
+
+def test_read_message_head_returns_none_on_clean_eof():
+    assert asyncio.run(read_message_head(make_stream(b''))) is None
+
+def test_read_message_head_rejects_truncated_and_malformed_heads():
+    with pytest.raises(HttpFramingError) as error:
+        asyncio.run(read_message_head(make_stream(b'GET / HTTP/1.1\r\nHost: a')))
+    assert error.value.peer == 'client'
+    with pytest.raises(HttpFramingError):
+        asyncio.run(read_message_head(make_stream(b'GET / HTTP/1.1\r\nno colon\r\n\r\n')))
+
+def test_serialize_strips_hop_by_hop_and_connection_named_headers():
+    head = HttpMessage('GET / HTTP/1.1', [('Host', 'a'), ('Connection', 'close, X-Private'),
+                                          ('X-Private', '1'), ('Proxy-Connection', 'keep-alive'),
+                                          ('Accept', '*/*')])
+    assert head.serialize([('Connection', 'keep-alive')]) == (
+        b'GET / HTTP/1.1\r\nHost: a\r\nAccept: */*\r\nConnection: keep-alive\r\n\r\n')
+
+def test_request_body_framing():
+    assert request_body_framing(message()) == ('none', 0)
+    assert request_body_framing(message(('Content-Length', '12'))) == ('length', 12)
+    assert request_body_framing(message(('Transfer-Encoding', 'gzip, chunked'),
+                                        ('Content-Length', '12'))) == ('chunked', None)
+    with pytest.raises(HttpFramingError):
+        request_body_framing(message(('Content-Length', '-1')))
+    with pytest.raises(HttpFramingError):
+        request_body_framing(message(('Content-Length', 'abc')))
+
+def test_response_body_framing():
+    sized = message(('Content-Length', '5'))
+    assert response_body_framing(sized, 'GET', 200) == ('length', 5)
+    assert response_body_framing(sized, 'HEAD', 200) == ('none', 0)
+    assert response_body_framing(sized, 'GET', 204) == ('none', 0)
+    assert response_body_framing(sized, 'GET', 304) == ('none', 0)
+    assert response_body_framing(sized, 'GET', 100) == ('none', 0)
+    assert response_body_framing(message(('Transfer-Encoding', 'chunked')), 'GET', 200) == ('chunked', None)
+    assert response_body_framing(message(('Transfer-Encoding', 'gzip')), 'GET', 200) == ('close', None)
+    assert response_body_framing(message(), 'GET', 200) == ('close', None)
+
+def test_forward_chunked_body_copies_framing_and_trailers_verbatim():
+    body = b'5;ext=1\r\nhello\r\n3\r\nabc\r\n0\r\nX-Trailer: 1\r\n\r\n'
+    source = make_stream(body + b'NEXT')
+    destination = CollectingStream()
+    asyncio.run(forward_chunked_body(source, destination))
+    assert bytes(destination.data) == body
+    assert bytes(source.buffer) == b'NEXT'
+
+def test_forward_chunked_body_rejects_bad_chunk_size_and_truncation():
+    with pytest.raises(HttpFramingError):
+        asyncio.run(forward_chunked_body(make_stream(b'zz\r\n', peer='upstream'), CollectingStream()))
+    with pytest.raises(HttpFramingError) as error:
+        asyncio.run(forward_chunked_body(make_stream(b'5\r\nhel', peer='upstream'), CollectingStream()))
+    assert error.value.peer == 'upstream'
+
+def test_read_body_removes_chunked_framing_and_enforces_limit():
+    chunked = b'5;ext=1\r\nhello\r\n3\r\nabc\r\n0\r\nX-Trailer: 1\r\n\r\nNEXT'
+    source = make_stream(chunked, peer='upstream')
+    assert asyncio.run(read_body(source, 'chunked', None, 100)) == b'helloabc'
+    assert bytes(source.buffer) == b'NEXT'
+    assert asyncio.run(read_body(make_stream(chunked), 'chunked', None, 6)) is None
+    assert asyncio.run(read_body(make_stream(b'0123456789'), 'length', 4, 100)) == b'0123'
+    assert asyncio.run(read_body(make_stream(b'0123456789'), 'length', 10, 4)) is None
+    assert asyncio.run(read_body(make_stream(b'0123456789'), 'close', None, 100)) == b'0123456789'
+    assert asyncio.run(read_body(make_stream(b'0123456789'), 'close', None, 4)) is None
+
+def test_split_target():
+    assert split_target('http://example.com/a/b?c=1', None) == ('example.com', 80, '/a/b?c=1')
+    assert split_target('http://example.com:8080', None) == ('example.com', 8080, '/')
+    assert split_target('/path', 'example.com:81') == ('example.com', 81, '/path')
+    assert split_target('/path', 'example.com') == ('example.com', 80, '/path')
+    assert split_target('/path', None) == (None, None, '/path')
+    assert split_target('http://[::1]:8080/a', None) == ('::1', 8080, '/a')
+    assert split_target('/path', '[2001:db8::1]') == ('2001:db8::1', 80, '/path')
+    assert split_target('/path', '[::1') == (None, None, '/path')
+
+def test_split_authority():
+    assert split_authority('example.com:443', 443) == ('example.com', 443)
+    assert split_authority('example.com', 443) == ('example.com', 443)
+    assert split_authority('[::1]:8443', 443) == ('::1', 8443)
+    assert split_authority('[::1]', 443) == ('::1', 443)
+    assert split_authority('::1', 443) == ('::1', 443)
+    assert split_authority('[::1]x', 443) == (None, None)
+
+def test_format_authority():
+    assert format_authority('example.com', 80) == 'example.com'
+    assert format_authority('example.com', 8080) == 'example.com:8080'
+    assert format_authority('::1', 8080) == '[::1]:8080'
+
+def test_read_message_head_waits_for_headers_split_across_recvs():
+    reader_socket, writer_socket = socket.socketpair()
+    reader_socket.setblocking(False)
+    stream = SocketStream(reader_socket, 'client', 1)
+
+    async def read_in_pieces():
+        task = asyncio.ensure_future(read_message_head(stream))
+        for piece in (b'GET /a HTTP/1.1\r\n', b'Ho', b'st: example.com\r\n', b'\r\nGET /b HTTP/1.1\r\n'):
+            writer_socket.sendall(piece)
+            await asyncio.sleep(0.01)
+        return await task
+
+    request = asyncio.run(read_in_pieces())
+    assert request.get_header('Host') == 'example.com'
+    assert bytes(stream.buffer) == b'GET /b HTTP/1.1\r\n' # The pipelined request stays buffered
+    writer_socket.close()
@@ -0,0 +1,35 @@
+from proxy_metrics import Histogram, ProxyMetrics, escape_label
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.observe(value)
+    assert histogram.render('latency', 'host="a"') == [
+        'latency_bucket{host="a",le="0.1"} 1',
+        'latency_bucket{host="a",le="1"} 3',
+        'latency_bucket{host="a",le="+Inf"} 4',
+        'latency_sum{host="a"} 4.250000',
+        'latency_count{host="a"} 4',
+    ]
+
+def test_escape_label():
+    assert escape_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+def test_render_counts_and_extra_metrics():
+    metrics = ProxyMetrics()
+    metrics.connection_accepted()
+    metrics.tunnel_opened()
+    metrics.add_bytes('downstream', 100)
+    metrics.count_error('refused')
+    metrics.count_error('refused')
+    metrics.observe_connect('example.com', 0.02)
+    metrics.tunnel_closed()
+    lines = metrics.render([('fproxy_tasks', 'gauge', 'Running tasks.', 3)]).splitlines()
+    assert 'fproxy_connections_total 1' in lines
+    assert 'fproxy_active_tunnels 0' in lines
+    assert 'fproxy_tunnels_total 1' in lines
+    assert 'fproxy_relayed_bytes_total{direction="downstream"} 100' in lines
+    assert 'fproxy_errors_total{type="refused"} 2' in lines
+    assert 'fproxy_upstream_connect_seconds_count{host="example.com"} 1' in lines
+    assert 'fproxy_dns_seconds_count 0' in lines
+    assert lines[-3:] == ['# HELP fproxy_tasks Running tasks.', '# TYPE fproxy_tasks gauge', 'fproxy_tasks 3']
@@ -0,0 +1,76 @@
+import base64
+import http.server
+import threading
+import time
+
+import pytest
+
+import generate_auth_list
+import pipeline
+from channel_state import MIN_LIFETIME
+from refresh_scheduler import REACTIVATE_FRACTION, RefreshScheduler
+
+PAGE = '''var channelKey = "premium{0}";
+var __c = atob("{1}");
+var __d = atob("ZjNlNTQ5YzU=");
+var __e = atob("ZDJh");
+'''
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves channel pages and accepts every signature except those in server.refused."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.harvested.append(self.path.rsplit('=', 1)[1])
+        minted_at = base64.b64encode(str(int(time.time())).encode()).decode()
+        body = PAGE.format(self.path.rsplit('=', 1)[1], minted_at).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        refused = any(f'channel_id=premium{channel_id}&' in self.path for channel_id in self.server.refused)
+        self.send_response(403 if refused else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.harvested = []
+    server.refused = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    (tmp_path / 'channels.txt').write_text('premium1/\npremium2/\n')
+    monkeypatch.setattr(generate_auth_list, 'INPUT_FILES', [str(tmp_path / 'channels.txt')])
+    monkeypatch.setattr(generate_auth_list, 'AUTH_PAGE_URL', base + "/daddylivehd.php?id={channel_id}")
+    monkeypatch.setattr(pipeline, 'AUTH_BASE_URL', base + "/auth.php")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_refused_reactivation_teaches_lifetime_and_reharvests(server, tmp_path):
+    scheduler = RefreshScheduler(str(tmp_path / 'state.json'))
+    scheduler.run_pass()
+    assert sorted(server.harvested) == ['1', '2']
+
+    # Nothing is due right after a full refresh
+    server.harvested.clear()
+    scheduler.run_pass()
+    assert server.harvested == []
+
+    server.refused.add('1')
+    state = dict(scheduler.store.get('premium1'))
+    later = state['activated_at'] + scheduler.store.lifetime() * REACTIVATE_FRACTION
+    server.harvested.clear()
+    scheduler.run_pass(now=later)
+    assert server.harvested == ['1'] # Only the refused channel is harvested again
+    # The refused signature was last known good when it was activated
+    assert scheduler.store.lifetime_samples == [state['activated_at'] - int(state['ts'])]
+    assert scheduler.store.lifetime() == MIN_LIFETIME
+    assert scheduler.store.get('premium1')['error'] == 'HTTP 403' # The server refuses every premium1 signature
+    assert scheduler.store.get('premium2')['ok']
@@ -0,0 +1,80 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from upstream_health import FAILURE_THRESHOLD, MirrorRouter, UpstreamHealth
+from upstream_pool import connect_to_addresses, interleave_families
+
+@pytest.fixture
+def listener():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    yield (socket.AF_INET, server.getsockname())
+    server.close()
+
+@pytest.fixture
+def stalled_listener():
+    """A listener whose accept queue is full, so further connects hang like an overloaded server."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    clients = []
+    for _ in range(3):
+        client = socket.socket()
+        client.setblocking(False)
+        client.connect_ex(server.getsockname())
+        clients.append(client)
+    time.sleep(0.1)
+    yield (socket.AF_INET, server.getsockname())
+    for client in clients:
+        client.close()
+    server.close()
+
+def test_interleave_families():
+    addresses = [(socket.AF_INET6, 'a'), (socket.AF_INET6, 'b'), (socket.AF_INET, 'c'), (socket.AF_INET, 'd')]
+    assert [address for _, address in interleave_families(addresses)] == ['a', 'c', 'b', 'd']
+
+def test_connect_races_past_a_stalled_address(stalled_listener, listener):
+    async def race():
+        started = time.monotonic()
+        sock = await connect_to_addresses([stalled_listener, listener], 5, delay=0.1)
+        elapsed = time.monotonic() - started
+        peer = sock.getpeername()
+        sock.close()
+        return peer, elapsed
+
+    peer, elapsed = asyncio.run(race())
+    assert peer == listener[1] and elapsed < 1
+
+def test_connect_timeout_bounds_the_whole_race(stalled_listener):
+    started = time.monotonic()
+    with pytest.raises(socket.timeout):
+        asyncio.run(connect_to_addresses([stalled_listener, stalled_listener], 0.3, delay=0.1))
+    assert time.monotonic() - started < 1
+
+def test_health_marks_hosts_down_and_recovers():
+    health = UpstreamHealth()
+    health.record('a', 443, 0.1)
+    for _ in range(FAILURE_THRESHOLD):
+        health.record('a', 443, None)
+    assert health.is_down('a') and not health.is_down('unknown')
+    health.record('a', 443, 0.1, probe=True)
+    assert not health.is_down('a')
+    assert health.get('a').error_rate > 0
+
+def test_router_moves_channels_off_down_servers_only():
+    health = UpstreamHealth()
+    router = MirrorRouter(health, {'premium51': {'zeko', 'nfs'}})
+    path = '/zeko/premium51/mono.m3u8?x=1'
+    # Nothing is known about the mirror yet, so the requested server is kept
+    assert router.route('zekonew.newkso.ru', 80, path) == ('zekonew.newkso.ru', path)
+    health.record('zekonew.newkso.ru', 80, 0.05)
+    health.record('nfsnew.newkso.ru', 80, 0.04)
+    assert router.route('zekonew.newkso.ru', 80, path) == ('zekonew.newkso.ru', path) # Not enough faster
+    for _ in range(FAILURE_THRESHOLD):
+        health.record('zekonew.newkso.ru', 80, None)
+    assert router.route('zekonew.newkso.ru', 80, path) == ('nfsnew.newkso.ru', '/nfs/premium51/mono.m3u8?x=1')
+    assert router.route('example.com', 80, path) == ('example.com', path)
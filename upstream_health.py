@@ -0,0 +1,170 @@
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+LATENCY_WEIGHT = 0.3      # Weight of the newest sample in the moving averages
+FAILURE_THRESHOLD = 2     # Consecutive failed connects after which a host counts as down
+PROBE_INTERVAL = 15       # Seconds between two probes of the same host
+PROBE_TIMEOUT = 2         # Seconds a probe connect may take before the host counts as failing
+PROBE_CONCURRENCY = 8     # Hosts probed at the same time
+HOST_IDLE_TIMEOUT = 10 * 60 # Hosts nobody connected to for this long are no longer probed
+SWITCH_FACTOR = 2         # A channel moves to a healthy mirror only if it is this many times faster
+
+EDGE_PATTERN = re.compile(r'^(\w+)new\.newkso\.ru$') # Stream edge hosts, named after their server
+EDGE_PATH_PATTERN = re.compile(r'^/(\w+)/(premium\d+)/') # /zeko/premium51/mono.m3u8
+
+class HostHealth:
+    """Moving averages of one upstream host's connect latency and failure rate."""
+
+    def __init__(self, port):
+        self.port = port # Port probes connect to, the last one clients used
+        self.latency = None # Seconds, None until the first successful connect
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.last_used = time.monotonic()
+        self.last_probe = 0.0
+
+    @property
+    def healthy(self):
+        """Returns True unless the last FAILURE_THRESHOLD connects all failed."""
+        return self.consecutive_failures < FAILURE_THRESHOLD
+
+    def score(self):
+        """Returns the expected connect time, penalised by the failure rate; lower is better."""
+        return (self.latency if self.latency is not None else PROBE_TIMEOUT) * (1 + 4 * self.error_rate)
+
+class UpstreamHealth:
+    """Thread-safe latency and error tracking per upstream host, fed by real connects and by probes."""
+
+    def __init__(self):
+        self.hosts = {} # host -> HostHealth
+        self.lock = threading.Lock()
+
+    def record(self, host, port, latency=None, probe=False):
+        """Records a connect that took latency seconds, or failed when latency is None."""
+        with self.lock:
+            health = self.hosts.get(host)
+            if health is None:
+                health = self.hosts[host] = HostHealth(port)
+            if probe:
+                health.last_probe = time.monotonic()
+            else:
+                health.port = port
+                health.last_used = time.monotonic()
+            failed = latency is None
+            health.error_rate += LATENCY_WEIGHT * (failed - health.error_rate)
+            if failed:
+                health.consecutive_failures += 1
+            else:
+                health.consecutive_failures = 0
+                health.latency = latency if health.latency is None else \
+                    health.latency + LATENCY_WEIGHT * (latency - health.latency)
+
+    def watch(self, host, port):
+        """Makes sure a host is probed even before any client connects to it, e.g. a mirror."""
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostHealth(port)
+
+    def get(self, host):
+        """Returns the HostHealth of a host, or None if it was never seen."""
+        return self.hosts.get(host)
+
+    def is_down(self, host):
+        """Returns True if the most recent connects to a known host all failed."""
+        health = self.hosts.get(host)
+        return health is not None and not health.healthy
+
+    def due_for_probe(self, now):
+        """Returns the (host, port) pairs to probe now, forgetting hosts nobody used for a long time."""
+        with self.lock:
+            for host in [host for host, health in self.hosts.items() if now - health.last_used > HOST_IDLE_TIMEOUT]:
+                del self.hosts[host]
+            return [(host, health.port) for host, health in self.hosts.items()
+                    if now - health.last_probe >= PROBE_INTERVAL]
+
+    def snapshot(self):
+        """Returns (host, latency, error rate, healthy) for every tracked host, for the metrics endpoint."""
+        with self.lock:
+            return [(host, health.latency, health.error_rate, health.healthy) for host, health in self.hosts.items()]
+
+def probe(host, port, timeout=PROBE_TIMEOUT):
+    """Returns the seconds a TCP connect to host:port took, or None if it failed."""
+    started = time.monotonic()
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+    except OSError:
+        return None
+    return time.monotonic() - started
+
+class HealthProber(threading.Thread):
+    """Background thread that keeps probing every tracked host, so dead hosts are known before a client waits on them."""
+
+    def __init__(self, health):
+        super().__init__(name='health-prober', daemon=True)
+        self.health = health
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Probes due hosts until stop() is called."""
+        with ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY) as executor:
+            while not self.stopping.wait(1):
+                targets = self.health.due_for_probe(time.monotonic())
+                for (host, port), latency in zip(targets, executor.map(lambda target: probe(*target), targets)):
+                    self.health.record(host, port, latency, probe=True)
+
+    def stop(self):
+        """Asks the thread to finish after the current round of probes."""
+        self.stopping.set()
+
+class MirrorRouter:
+    """Routes channel paths on the newkso edge servers to the fastest healthy server carrying the channel.
+
+    A channel sticks to the server it was routed to until that server goes down or a healthy mirror
+    is SWITCH_FACTOR times faster, so a player does not bounce between servers mid-stream.
+    """
+
+    def __init__(self, health, channel_servers):
+        self.health = health
+        self.channel_servers = channel_servers # channel key -> set of server names carrying it
+        self.routes = {} # channel key -> server currently used
+        self.lock = threading.Lock()
+
+    def route(self, host, port, path):
+        """Returns (host, path) to request instead, the same ones when no better mirror is known."""
+        host_match = EDGE_PATTERN.match(host)
+        path_match = EDGE_PATH_PATTERN.match(path)
+        if not host_match or not path_match or host_match.group(1) != path_match.group(1):
+            return host, path
+        requested, channel_key = path_match.groups()
+        servers = self.channel_servers.get(channel_key, set()) | {requested}
+        for server in servers:
+            self.health.watch(f"{server}new.newkso.ru", port) # Probed from now on
+        with self.lock:
+            current = self.routes.get(channel_key, requested)
+            chosen = self.choose(current, servers)
+            self.routes[channel_key] = chosen
+        if chosen == requested:
+            return host, path
+        return f"{chosen}new.newkso.ru", f"/{chosen}/{channel_key}/{path[path_match.end():]}"
+
+    def choose(self, current, servers):
+        """Returns the server to use: the current one unless it is down or clearly slower than a mirror."""
+        measured = []
+        for server in servers:
+            health = self.health.get(f"{server}new.newkso.ru")
+            # Mirrors are only used once a probe or a connect showed they work
+            if health is not None and health.healthy and health.latency is not None:
+                measured.append((health.score(), server))
+        if not measured:
+            return current
+        best_score, best = min(measured)
+        current_health = self.health.get(f"{current}new.newkso.ru")
+        if current_health is None or current_health.latency is None:
+            return current if current_health is None or current_health.healthy else best
+        if not current_health.healthy or best_score * SWITCH_FACTOR < current_health.score():
+            return best
+        return current
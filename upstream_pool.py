@@ -0,0 +1,209 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+
+# --- Configuration ---
+DNS_CACHE_TTL = 300         # Seconds a resolved address list is reused
+POOL_MAX_IDLE_PER_HOST = 8  # Idle keep-alive connections kept per upstream host:port
+POOL_IDLE_TIMEOUT = 30      # Seconds an idle upstream connection is kept before eviction
+POOL_SWEEP_INTERVAL = 10    # Minimum seconds between sweeps of expired idle connections
+HAPPY_EYEBALLS_DELAY = 0.25 # Seconds before connecting to the next address while earlier attempts are pending
+DOWN_CONNECT_TIMEOUT = 2    # Connect timeout for hosts whose recent connects all failed
+
+class DnsCache:
+    """Thread-safe getaddrinfo cache with a fixed time-to-live per entry."""
+
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {} # (host, port) -> (expires_at, [(family, sockaddr), ...])
+        self.lock = threading.Lock()
+
+    def lookup(self, host, port):
+        """Returns the cached addresses for host:port, or None on a miss or expiry."""
+        with self.lock:
+            entry = self.entries.get((host, port))
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def resolve(self, host, port):
+        """Returns the addresses for host:port, resolving through the system resolver on a miss."""
+        addresses = self.lookup(host, port)
+        if addresses is not None:
+            return addresses
+        # AF_UNSPEC returns IPv6 as well as IPv4 addresses, in the resolver's order of preference
+        infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        addresses = [(info[0], info[4]) for info in infos]
+        with self.lock:
+            self.entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host, port):
+        """Drops a cached entry, e.g. after every cached address refused the connection."""
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+def interleave_families(addresses):
+    """Reorders (family, sockaddr) pairs to alternate address families, keeping the resolver's first choice first."""
+    families = {}
+    for family, address in addresses:
+        families.setdefault(family, []).append((family, address))
+    queues = list(families.values())
+    ordered = []
+    while queues:
+        ordered += [queue.pop(0) for queue in queues]
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+async def connect_to_addresses(addresses, timeout, delay=HAPPY_EYEBALLS_DELAY):
+    """Races connects to the addresses happy-eyeballs style (RFC 8305), returns the first connected socket.
+
+    The next address is tried every `delay` seconds, or right away when an attempt fails, and timeout
+    bounds the whole race rather than each address. Raises the last error if no address is reachable.
+    """
+    if not addresses:
+        raise socket.gaierror("No addresses to connect to")
+    loop = asyncio.get_running_loop()
+    pending = interleave_families(addresses)
+    deadline = loop.time() + timeout
+    attempts = {} # connect task -> socket
+    last_error = None
+    winner = None
+    try:
+        while winner is None and (pending or attempts):
+            if pending:
+                family, address = pending.pop(0)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                attempts[loop.create_task(loop.sock_connect(sock, address))] = sock
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(attempts, timeout=min(delay, remaining) if pending else remaining,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                sock = attempts.pop(task)
+                if task.exception() is None and winner is None:
+                    winner = sock
+                else:
+                    sock.close()
+                    last_error = task.exception() or last_error
+            if not done and not pending:
+                break # Every address was tried and the deadline passed
+    finally:
+        for task, sock in attempts.items():
+            task.cancel()
+            sock.close()
+    if winner is not None:
+        return winner
+    if attempts or last_error is None:
+        raise socket.timeout(f"Connecting to {addresses[0][1][0]} timed out")
+    raise last_error
+
+def is_idle_connection_usable(sock):
+    """Returns False if an idle pooled socket was closed by the server or has stray data."""
+    try:
+        # Peeking works for any fd number, unlike select() which is limited to FD_SETSIZE
+        sock.recv(1, socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0))
+    except BlockingIOError:
+        return True # Nothing to read: the connection is idle and open
+    except OSError:
+        return False
+    # An idle HTTP connection must not be readable: that means EOF or garbage
+    return False
+
+class UpstreamPool:
+    """Per host:port pool of idle keep-alive upstream connections."""
+
+    def __init__(self, dns_cache, connect_timeout, on_connect=None, metrics=None, health=None,
+                 max_idle_per_host=POOL_MAX_IDLE_PER_HOST, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.dns_cache = dns_cache
+        self.connect_timeout = connect_timeout
+        self.on_connect = on_connect # Called with every new upstream socket, e.g. to tune it
+        self.metrics = metrics # Optional ProxyMetrics receiving DNS and connect timings
+        self.health = health # Optional UpstreamHealth learning which hosts are slow or down
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.idle = {} # (host, port) -> deque of (idle_since, socket), most recent last
+        self.lock = threading.Lock()
+        self.last_sweep = time.monotonic()
+
+    async def connect(self, host, port):
+        """Opens a new non-blocking upstream connection using the DNS cache."""
+        addresses = self.dns_cache.lookup(host, port)
+        if addresses is None:
+            loop = asyncio.get_running_loop()
+            started = time.monotonic()
+            try:
+                addresses = await loop.run_in_executor(None, self.dns_cache.resolve, host, port)
+            except OSError:
+                if self.health:
+                    self.health.record(host, port, None) # A host that does not resolve is as good as down
+                raise
+            if self.metrics:
+                self.metrics.observe_dns(time.monotonic() - started)
+        # A host that is known to be down only gets a short chance, so clients do not stall on it
+        timeout = self.connect_timeout
+        if self.health and self.health.is_down(host):
+            timeout = min(timeout, DOWN_CONNECT_TIMEOUT)
+        started = time.monotonic()
+        try:
+            sock = await connect_to_addresses(addresses, timeout)
+        except OSError as e:
+            if self.health:
+                self.health.record(host, port, None)
+            if isinstance(e, ConnectionRefusedError):
+                self.dns_cache.forget(host, port) # The host may have moved
+            raise
+        latency = time.monotonic() - started
+        if self.metrics:
+            self.metrics.observe_connect(host, latency)
+        if self.health:
+            self.health.record(host, port, latency)
+        if self.on_connect:
+            self.on_connect(sock)
+        return sock
+
+    async def acquire(self, host, port, reuse=True):
+        """Returns (socket, reused), taking a pooled connection when reuse is allowed and one is usable."""
+        now = time.monotonic()
+        while reuse:
+            with self.lock:
+                connections = self.idle.get((host, port))
+                if not connections:
+                    break
+                idle_since, sock = connections.pop()
+            if now - idle_since < self.idle_timeout and is_idle_connection_usable(sock):
+                return sock, True
+            sock.close()
+        return await self.connect(host, port), False
+
+    def release(self, host, port, sock):
+        """Returns a connection whose last response was fully read to the pool."""
+        now = time.monotonic()
+        with self.lock:
+            connections = self.idle.setdefault((host, port), deque())
+            if len(connections) < self.max_idle_per_host:
+                connections.append((now, sock))
+                sock = None
+        if sock is not None:
+            sock.close()
+        if now - self.last_sweep >= POOL_SWEEP_INTERVAL:
+            self.evict_expired()
+
+    def evict_expired(self):
+        """Closes idle connections older than the idle timeout."""
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            self.last_sweep = now
+            for key in list(self.idle):
+                connections = self.idle[key]
+                while connections and now - connections[0][0] >= self.idle_timeout:
+                    expired.append(connections.popleft()[1])
+                if not connections:
+                    del self.idle[key]
+        for sock in expired:
+            sock.close()